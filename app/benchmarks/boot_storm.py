@@ -0,0 +1,452 @@
+"""Boot-storm load test: many switches requesting their configs at once.
+
+Starts the `ztp.web` app against a local, throw-away `mongod` (or an
+existing MongoDB server with `--mongo-url`), loads N synthetic devices
+generated from `examples/switch-device-data.json` and
+`examples/switch-template.txt`, and runs a large number of concurrent
+clients that each connect and fetch a device's `/config/{serial}`, as
+switches do when a site powers up.  Reports the throughput, latency
+percentiles, and error rates, and saves the results (tagged with the
+current git commit) so runs can be compared between commits.
+
+The app runs in its own process(es), so the clients do not compete with it
+for the interpreter.  The database must be a real MongoDB server: the app
+relies on change streams (with a polling fallback), aggregation, and
+command monitoring, which in-memory stand-ins do not provide.  The `mongod`
+binary must be on the PATH (or given with `--mongod`).  Use `--storage
+sqlite` to benchmark the SQLite storage backend instead (with a throw-away
+database file); the `memory` backend is not supported, as the data is
+loaded from this process.
+
+Usage (from the `app` directory):
+
+    python -m benchmarks.boot_storm run --devices 10000 --clients 2000
+    python -m benchmarks.boot_storm run --mongo-url mongodb://localhost
+    python -m benchmarks.boot_storm run --storage sqlite
+    python -m benchmarks.boot_storm compare
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+import json
+import math
+import os
+from pathlib import Path
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+app_dir = Path(__file__).parent.parent
+examples_dir = app_dir.parent/"examples"
+results_dir = Path(__file__).parent/"results"
+
+TEMPLATE_NAME = "switch-template"
+
+
+# Local stand-in services
+def free_port() -> int:
+    """Find a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float):
+    """Wait until a process is accepting connections on a local port."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(
+                f"{process.args[0]} exited with status {process.returncode}."
+            )
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Timed out waiting for port {port}.")
+
+
+def stop(process: subprocess.Popen):
+    """Stop a child process, forcefully if it does not exit promptly."""
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def start_mongod(mongod: str) -> Tuple[subprocess.Popen, str, str]:
+    """Start a throw-away mongod with its data in a temporary directory.
+
+    Returns:
+        The process, MongoDB URL, and data directory.
+    """
+    port = free_port()
+    dbpath = tempfile.mkdtemp(prefix="ztp-boot-storm-")
+    process = subprocess.Popen(
+        [mongod, "--dbpath", dbpath, "--port", str(port),
+         "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL,
+    )
+    wait_for_port(port, process, timeout=60)
+    return process, f"mongodb://127.0.0.1:{port}", dbpath
+
+
+def start_app(workers: int) -> Tuple[subprocess.Popen, int]:
+    """Start the ztp.web app, in its own process(es), on a free port.
+
+    The app's storage settings are taken from this process's environment.
+    """
+    port = free_port()
+    env = dict(os.environ, LOG_LEVEL="WARNING")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "ztp.web", "--address", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers)],
+        cwd=str(app_dir),
+        env=env,
+    )
+    wait_for_port(port, process, timeout=60)
+    return process, port
+
+
+# Test data
+def load_devices(count: int) -> List[str]:
+    """Load the template and N synthetic devices into the database.
+
+    The `ztp` package is imported here, after the storage settings have been
+    set in the environment, so it connects to the benchmark database.
+
+    Returns:
+        The serial numbers of the generated devices.
+    """
+    from ztp.storage import make_device_data, storage
+
+    with open(examples_dir/"switch-device-data.json") as file:
+        examples = json.load(file)
+    with open(examples_dir/"switch-template.txt") as file:
+        template_text = file.read()
+
+    storage.save_template(TEMPLATE_NAME, template_text)
+
+    serial_numbers = [f"STORM{index:08d}" for index in range(count)]
+    storage.replace_device_data(
+        make_device_data(
+            serial_number,
+            TEMPLATE_NAME,
+            examples[index % len(examples)]["config_data"],
+        )
+        for index, serial_number in enumerate(serial_numbers)
+    )
+    return serial_numbers
+
+
+# Clients
+async def fetch_config(port: int, serial_number: str) -> int:
+    """Fetch a device configuration on a new connection, like a switch.
+
+    Returns:
+        The HTTP response status code.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(
+            f"GET /config/{serial_number} HTTP/1.1\r\n"
+            f"Host: 127.0.0.1:{port}\r\n"
+            f"Connection: close\r\n"
+            f"\r\n".encode("ascii")
+        )
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed without response.")
+        status = int(status_line.split()[1])
+        await reader.read()
+        return status
+    finally:
+        writer.close()
+
+
+async def client(port: int, serial_numbers: Iterator[str], timeout: float,
+                 latencies: List[float], errors: Dict[str, int]):
+    """Fetch configurations until there are no serial numbers left."""
+    for serial_number in serial_numbers:
+        start = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(
+                fetch_config(port, serial_number), timeout,
+            )
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except (OSError, ValueError, IndexError) as exception:
+            error = type(exception).__name__
+        else:
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+                continue
+            error = f"HTTP {status}"
+        errors[error] = errors.get(error, 0) + 1
+
+
+def percentile(sorted_values: List[float], percent: float) -> Optional[float]:
+    """Nearest-rank percentile of a sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def storm(port: int, serial_numbers: List[str], clients: int,
+          timeout: float) -> dict:
+    """Run concurrent clients against the app and summarize the results."""
+    latencies = []
+    errors = {}
+    remaining = iter(serial_numbers)
+
+    loop = asyncio.get_event_loop()
+    start = time.perf_counter()
+    loop.run_until_complete(asyncio.gather(*[
+        client(port, remaining, timeout, latencies, errors)
+        for _ in range(clients)
+    ]))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    requests = len(serial_numbers)
+    failed = sum(errors.values())
+    return {
+        "requests": requests,
+        "succeeded": len(latencies),
+        "failed": failed,
+        "error_rate": failed / requests if requests else 0.0,
+        "errors": errors,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def raise_open_file_limit(clients: int):
+    """Raise the open-file limit to allow one socket per client."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = clients + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        limit = wanted if hard == resource.RLIM_INFINITY \
+            else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+        if limit < wanted:
+            print(f"Warning: open-file limit is {limit}; some of the "
+                  f"{clients} clients may fail to connect.")
+
+
+# Results
+def git_commit() -> str:
+    """Get the current git commit (with a `-dirty` suffix if modified)."""
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty", "--abbrev=12"],
+            cwd=str(app_dir), stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(results: dict, output_dir: Path) -> Path:
+    """Save the results as JSON, named by time and commit."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = results["timestamp"].replace(":", "").replace("-", "")
+    path = output_dir/f"boot_storm-{timestamp}-{results['commit']}.json"
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+    return path
+
+
+def _ms(seconds: Optional[float]) -> str:
+    """Format a latency in milliseconds."""
+    return f"{seconds * 1000:9.1f}" if seconds is not None else f"{'-':>9}"
+
+
+def print_results(results: dict):
+    """Print one run's results."""
+    storm_results = results["results"]
+    latency = storm_results["latency_seconds"]
+    print(
+        f"Boot storm: {results['devices']} devices, {results['clients']} "
+        f"clients, {results['workers']} app worker(s), "
+        f"{results.get('storage', 'mongo')} storage, commit "
+        f"{results['commit']}"
+    )
+    print(f"  throughput  {storm_results['throughput_rps']:10.1f} req/s")
+    print(f"  latency p50 {_ms(latency['p50'])} ms")
+    print(f"  latency p90 {_ms(latency['p90'])} ms")
+    print(f"  latency p99 {_ms(latency['p99'])} ms")
+    print(f"  latency max {_ms(latency['max'])} ms")
+    print(
+        f"  errors      {storm_results['failed']:10d} "
+        f"({storm_results['error_rate']:.2%})"
+    )
+    for error, count in sorted(storm_results["errors"].items()):
+        print(f"    {error:<24} {count:8d}")
+
+
+def compare(paths: List[Path]):
+    """Print saved results side by side, oldest first."""
+    runs = []
+    for path in paths:
+        with open(path) as file:
+            runs.append(json.load(file))
+    runs.sort(key=lambda run: run["timestamp"])
+
+    print(
+        f"{'timestamp':<20} {'commit':<20} {'devices':>8} {'clients':>8} "
+        f"{'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>8}"
+    )
+    baseline = None
+    for run in runs:
+        storm_results = run["results"]
+        latency = storm_results["latency_seconds"]
+        throughput = storm_results["throughput_rps"]
+        change = ""
+        if baseline:
+            change = f"  ({(throughput - baseline) / baseline:+.1%} req/s)"
+        baseline = baseline or throughput
+        print(
+            f"{run['timestamp']:<20} {run['commit']:<20} "
+            f"{run['devices']:8d} {run['clients']:8d} {throughput:10.1f} "
+            f"{_ms(latency['p50'])} {_ms(latency['p99'])} "
+            f"{storm_results['error_rate']:8.2%}{change}"
+        )
+
+
+# Command line
+def run(args: argparse.Namespace):
+    """Run the boot-storm benchmark."""
+    raise_open_file_limit(args.clients)
+
+    mongod = dbpath = app = None
+    try:
+        os.environ["STORAGE_BACKEND"] = args.storage
+        if args.storage == "sqlite":
+            dbpath = tempfile.mkdtemp(prefix="ztp-boot-storm-")
+            database = os.path.join(dbpath, "ztp.sqlite3")
+            os.environ["SQLITE_PATH"] = database
+        elif args.mongo_url:
+            database = args.mongo_url
+        else:
+            mongod, database, dbpath = start_mongod(args.mongod)
+
+        if args.storage == "mongo":
+            os.environ["MONGO_URL"] = database
+        print(f"Loading {args.devices} devices into {database}")
+        serial_numbers = load_devices(args.devices)
+
+        app, port = start_app(args.workers)
+        if args.warm:
+            storm(port, serial_numbers, args.clients, args.timeout)
+
+        results = {
+            "timestamp": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "storage": args.storage,
+            "devices": args.devices,
+            "clients": args.clients,
+            "workers": args.workers,
+            "warm": args.warm,
+            "python": sys.version.split()[0],
+            "results": storm(
+                port, serial_numbers, args.clients, args.timeout,
+            ),
+        }
+
+    finally:
+        if app is not None:
+            stop(app)
+        if mongod is not None:
+            stop(mongod)
+        if dbpath is not None:
+            shutil.rmtree(dbpath, ignore_errors=True)
+
+    print_results(results)
+    if not args.no_save:
+        print(f"Saved {save_results(results, args.output_dir)}")
+
+
+def main():
+    """Parse the command line and run the requested command."""
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.boot_storm",
+        description=__doc__.splitlines()[0],
+    )
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    run_parser = commands.add_parser("run", help="run the load test")
+    run_parser.add_argument("--devices", type=int, default=10000,
+                            help="number of devices (default: 10000)")
+    run_parser.add_argument("--clients", type=int, default=2000,
+                            help="concurrent clients (default: 2000)")
+    run_parser.add_argument("--workers", type=int, default=1,
+                            help="app worker processes (default: 1)")
+    run_parser.add_argument("--timeout", type=float, default=30.0,
+                            help="request timeout, seconds (default: 30)")
+    run_parser.add_argument("--warm", action="store_true",
+                            help="fetch every config once before measuring")
+    run_parser.add_argument("--storage", choices=["mongo", "sqlite"],
+                            default="mongo",
+                            help="app storage backend (default: mongo)")
+    run_parser.add_argument("--mongo-url",
+                            help="use an existing MongoDB server (its `ztp` "
+                                 "database is overwritten)")
+    run_parser.add_argument("--mongod", default="mongod",
+                            help="mongod binary (default: mongod)")
+    run_parser.add_argument("--output-dir", type=Path, default=results_dir,
+                            help=f"results directory (default: "
+                                 f"{results_dir.relative_to(app_dir)})")
+    run_parser.add_argument("--no-save", action="store_true",
+                            help="do not save the results")
+
+    compare_parser = commands.add_parser(
+        "compare", help="compare saved results",
+    )
+    compare_parser.add_argument(
+        "paths", nargs="*", type=Path,
+        help="result files (default: all saved results)",
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args.paths or sorted(results_dir.glob("boot_storm-*.json")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Benchmark the API read path: mongoengine + marshmallow vs. MongoStorage.
+
+Measures the per-record cost of producing the API JSON for device-data
+records with the original path (hydrate mongoengine `DeviceData` documents,
+serialize them with `DeviceDataSchema`, encode to JSON) and with the path
+the API serves (`MongoStorage`: convert the raw pymongo documents to
+records, then encode them with `ztp.storage.to_api`).
+
+By default, the benchmark generates synthetic BSON documents in memory, so
+it isolates the hydration and serialization cost from the database.  With
+`--live`, both paths query the configured MongoDB database (which must
+already contain device data; nothing is written).
+
+Usage (from the `app` directory):
+
+    python -m benchmarks.read_path --records 10000
+    python -m benchmarks.read_path --live
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import argparse
+from datetime import datetime
+import json
+from pathlib import Path
+import time
+from typing import Callable, List
+
+from bson import ObjectId
+
+from ztp.mongo.models.device_data import DeviceData
+from ztp.storage import storage, to_api
+from ztp.storage.mongo import _device_data_record
+from ztp.web.views.api.device_data import DeviceDataSchema
+
+
+examples_dir = Path(__file__).parent.parent.parent/"examples"
+
+
+def generate_documents(count: int) -> List[dict]:
+    """Generate synthetic device-data BSON documents from the example data."""
+    with open(examples_dir/"switch-device-data.json") as file:
+        examples = json.load(file)
+
+    now = datetime.utcnow().replace(microsecond=0)
+    documents = []
+    for index in range(count):
+        example = examples[index % len(examples)]
+        documents.append({
+            "_id": ObjectId(),
+            "serial_number": f"BENCH{index:08d}",
+            "template_name": example["template_name"],
+            "config_data": example["config_data"],
+            "updated": now,
+        })
+    return documents
+
+
+def mongoengine_path(documents: List[dict]) -> str:
+    """Hydrate DeviceData documents and serialize them with marshmallow."""
+    device_data_objects = [DeviceData._from_son(son) for son in documents]
+    schema = DeviceDataSchema(many=True)
+    return json.dumps(list(schema.dump(device_data_objects)[0]))
+
+
+def storage_path(documents: List[dict]) -> str:
+    """Convert the raw BSON documents to records, and encode them."""
+    return json.dumps([
+        to_api(_device_data_record(document)) for document in documents
+    ])
+
+
+def live_mongoengine_path() -> str:
+    """Query and serialize all device data with mongoengine + marshmallow."""
+    device_data_objects = list(DeviceData.objects.order_by("serial_number"))
+    schema = DeviceDataSchema(many=True)
+    return json.dumps(list(schema.dump(device_data_objects)[0]))
+
+
+def live_storage_path() -> str:
+    """Query and serialize all device data with the MongoStorage backend."""
+    return json.dumps([
+        to_api(record) for record in storage.find_device_data()
+    ])
+
+
+def measure(function: Callable[[], str], repeat: int) -> float:
+    """Return the best (minimum) run time of a function, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    """Run the read-path benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=10000,
+                        help="number of synthetic records (default: 10000)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of timed runs per path (default: 5)")
+    parser.add_argument("--live", action="store_true",
+                        help="query the configured MongoDB database")
+    args = parser.parse_args()
+
+    if args.live:
+        records = DeviceData.objects.count()
+        paths = {
+            "mongoengine + marshmallow": live_mongoengine_path,
+            "MongoStorage + to_api": live_storage_path,
+        }
+    else:
+        documents = generate_documents(args.records)
+        records = len(documents)
+        assert json.loads(mongoengine_path(documents)) \
+            == json.loads(storage_path(documents))
+        paths = {
+            "mongoengine + marshmallow": lambda: mongoengine_path(documents),
+            "MongoStorage + to_api": lambda: storage_path(documents),
+        }
+
+    print(f"Read path benchmark: {records} records, best of {args.repeat}")
+    results = {}
+    for name, function in paths.items():
+        seconds = measure(function, args.repeat)
+        results[name] = seconds
+        print(
+            f"  {name:<28} {seconds * 1000:10.1f} ms total  "
+            f"{seconds / max(records, 1) * 1e6:8.2f} us/record"
+        )
+
+    baseline, fast = results.values()
+    print(f"  speedup: {baseline / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Template changes made by other processes reach the render pool.
+
+Runs the web app against a shared SQLite database, with the render pool
+enabled, and changes the template from a second process (as another
+server worker or replica would).  Run it from the `app` directory:
+
+    $ python -m unittest tests.test_template_watch
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+
+app_dir = Path(__file__).parent.parent
+database_dir = tempfile.TemporaryDirectory()
+
+# The settings are read when `ztp` is first imported
+os.environ.update(
+    STORAGE_BACKEND="sqlite",
+    SQLITE_PATH=str(Path(database_dir.name)/"ztp.sqlite3"),
+    RENDER_PROCESSES="1",
+    PRERENDER_ENABLED="false",
+    TEMPLATE_WATCH_POLL_INTERVAL="0.2",
+)
+
+
+def other_process(code: str):
+    """Run storage operations in a second process."""
+    subprocess.run(
+        [sys.executable, "-c", f"from ztp.storage import storage; {code}"],
+        cwd=str(app_dir), env=dict(os.environ, PYTHONPATH=str(app_dir)),
+        check=True,
+    )
+
+
+class TemplateWatchTest(unittest.TestCase):
+    """Serve the configuration as another process changes its template."""
+
+    @classmethod
+    def setUpClass(cls):
+        other_process(
+            "from ztp.storage import make_device_data; "
+            "storage.save_template('switch', 'one {{config_data.x}}'); "
+            "storage.create_device_data(make_device_data("
+            "serial_number='SN1', template_name='switch', "
+            "config_data={'x': 1}))"
+        )
+
+    @staticmethod
+    def get_config(client) -> tuple:
+        response = client.get("http://;/config/SN1")
+        return response.status_code, response.content
+
+    def wait_for(self, client, status: int, content: bytes = None,
+                 timeout: float = 10.0):
+        """Wait for the server to pick up the change (it polls for it)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            served_status, served_content = self.get_config(client)
+            if served_status == status \
+                    and content in (None, served_content):
+                return
+            if time.monotonic() > deadline:
+                self.fail(f"Still serving {served_status} {served_content}")
+            time.sleep(0.1)
+
+    def test_template_changed_by_other_process(self):
+        from ztp.web import api
+
+        with api.requests as client:
+            self.assertEqual(self.get_config(client), (200, b"one 1"))
+
+            other_process("storage.save_template('switch', 'two "
+                          "{{config_data.x}}')")
+            self.wait_for(client, 200, b"two 1")
+
+            other_process("storage.delete_template('switch')")
+            self.wait_for(client, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Persistent Jinja2 bytecode cache for compiled templates.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from datetime import datetime
+import logging
+from typing import Optional
+
+from bson import Binary
+from pymongo.collection import Collection
+import pymongo.errors
+
+from ztp.bytecode_files import FileBytecodeCache
+from ztp.config import (
+    STORAGE_BACKEND, TEMPLATE_BYTECODE_CACHE_DIR,
+    TEMPLATE_BYTECODE_CACHE_MONGO,
+)
+from ztp.mongo import db
+from ztp.template_versions import template_versions
+
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateBytecodeCache(FileBytecodeCache):
+    """Share compiled template bytecode across workers and restarts.
+
+    Bytecode is keyed by the template's sha256 hash (the same hash stored in
+    `Template.sha256`) and name, and is stored in a local directory and,
+    optionally, in a MongoDB collection.  Any worker can load bytecode
+    compiled by another worker instead of compiling the template from
+    source.  Entries for the previous version of a template are evicted
+    when the template-version table reports that the template has changed.
+    """
+
+    def __init__(self, directory: Optional[str] = None,
+                 collection: Optional[Collection] = None):
+        """Initialize a new template bytecode cache.
+
+        Args:
+            directory: Local directory used to store bytecode files.
+            collection: MongoDB collection used to store bytecode.
+        """
+        super().__init__(directory)
+        self.collection = collection
+
+        self._indexed = False
+
+    def evict(self, name: str, template_sha256: str):
+        """Remove the bytecode for a version of a template."""
+        super().evict(name, template_sha256)
+
+        if self.collection is not None:
+            try:
+                self.collection.delete_one(
+                    {"_id": self.make_key(name, template_sha256)}
+                )
+            except pymongo.errors.PyMongoError as error:
+                logger.warning(f"Unable to evict template bytecode: {error}")
+
+    def clear(self):
+        """Remove all cached bytecode."""
+        super().clear()
+        if self.collection is not None:
+            self.collection.delete_many({})
+
+    def _load(self, key: str) -> Optional[bytes]:
+        """Read bytecode from local disk, falling back to MongoDB."""
+        data = self._load_from_disk(key)
+
+        if data is None and self.collection is not None:
+            data = self._load_from_mongo(key)
+            if data is not None:
+                self._dump_to_disk(key, data)
+
+        return data
+
+    def _dump(self, key: str, data: bytes):
+        """Write bytecode to local disk and to MongoDB."""
+        self._dump_to_disk(key, data)
+        if self.collection is not None:
+            self._dump_to_mongo(key, data)
+
+    def _load_from_mongo(self, key: str) -> Optional[bytes]:
+        """Read bytecode from the MongoDB bytecode collection."""
+        try:
+            document = self.collection.find_one({"_id": key})
+        except pymongo.errors.PyMongoError as error:
+            logger.warning(f"Unable to load template bytecode: {error}")
+            return None
+        return bytes(document["bytecode"]) if document else None
+
+    def _dump_to_mongo(self, key: str, data: bytes):
+        """Write bytecode to the MongoDB bytecode collection."""
+        try:
+            if not self._indexed:
+                self.collection.create_index("sha256", background=True)
+                self._indexed = True
+            self.collection.replace_one(
+                {"_id": key},
+                {
+                    "_id": key,
+                    "sha256": key.split("-", 1)[0],
+                    "bytecode": Binary(data),
+                    "updated": datetime.utcnow(),
+                },
+                upsert=True,
+            )
+        except pymongo.errors.PyMongoError as error:
+            logger.warning(f"Unable to store template bytecode: {error}")
+
+
+bytecode_cache = TemplateBytecodeCache(
+    directory=TEMPLATE_BYTECODE_CACHE_DIR or None,
+    collection=db["template_bytecode"]
+    if TEMPLATE_BYTECODE_CACHE_MONGO and STORAGE_BACKEND == "mongo" else None,
+)
+
+
+def _evict_stale_bytecode(name: str, old_sha256: Optional[str],
+                          new_sha256: Optional[str]):
+    """Evict the bytecode for the previous version of a changed template."""
+    if old_sha256 is not None:
+        bytecode_cache.evict(name, old_sha256)
+
+
+template_versions.add_listener(_evict_stale_bytecode)
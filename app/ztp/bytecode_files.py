@@ -0,0 +1,181 @@
+"""Local-directory Jinja2 bytecode cache for compiled templates.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from hashlib import sha1, sha256
+import logging
+import os
+from pathlib import Path
+import stat
+import tempfile
+from typing import Optional
+
+import jinja2
+import jinja2.bccache
+
+
+logger = logging.getLogger(__name__)
+
+
+class FileBytecodeCache(jinja2.BytecodeCache):
+    """Keep compiled template bytecode in a local directory.
+
+    Bytecode is keyed by the template's sha256 hash (the same hash stored in
+    `Template.sha256`) and name, so the processes that share the directory
+    (the server workers and the render workers) can load bytecode compiled
+    by any of them instead of compiling the template from source.
+
+    Imports only Jinja2 and the standard library, so render worker
+    processes can use it.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        """Initialize a new template bytecode cache.
+
+        The directory is created private to the current user; a directory
+        that is not (one that another user could have created, or could
+        write bytecode to) is not used.
+
+        Args:
+            directory: Local directory used to store bytecode files.
+        """
+        self.directory = Path(directory) if directory else None
+
+        self.hits = 0
+        self.misses = 0
+
+        if self.directory is not None \
+                and not private_directory(self.directory):
+            self.directory = None
+
+    @staticmethod
+    def make_key(name: str, template_sha256: str) -> str:
+        """Create a cache key from a template's name and sha256 hash."""
+        name_hash = sha1(name.encode("utf-8")).hexdigest()[:16]
+        return f"{template_sha256}-{name_hash}"
+
+    def get_bucket(self, environment: jinja2.Environment, name: str,
+                   filename: Optional[str], source: str) \
+            -> jinja2.bccache.Bucket:
+        """Get the cache bucket for a template, keyed by its sha256 hash."""
+        template_sha256 = sha256(source.encode("utf-8")).hexdigest()
+        bucket = jinja2.bccache.Bucket(
+            environment,
+            self.make_key(name, template_sha256),
+            self.get_source_checksum(source),
+        )
+        self.load_bytecode(bucket)
+        return bucket
+
+    def load_bytecode(self, bucket: jinja2.bccache.Bucket):
+        """Load a template's bytecode, if it has been cached."""
+        data = self._load(bucket.key)
+        if data is not None:
+            bucket.bytecode_from_string(data)
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def dump_bytecode(self, bucket: jinja2.bccache.Bucket):
+        """Store newly compiled bytecode."""
+        self._dump(bucket.key, bucket.bytecode_to_string())
+
+    def stats(self) -> dict:
+        """Get the bytecode cache hit/miss counters."""
+        return {"hits": self.hits, "misses": self.misses}
+
+    def evict(self, name: str, template_sha256: str):
+        """Remove the bytecode for a version of a template."""
+        if self.directory is None:
+            return
+        key = self.make_key(name, template_sha256)
+        try:
+            (self.directory/f"{key}.jbc").unlink()
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Remove all cached bytecode."""
+        if self.directory is not None:
+            for path in self.directory.glob("*.jbc"):
+                path.unlink()
+
+    def _load(self, key: str) -> Optional[bytes]:
+        """Read bytecode from the cache."""
+        return self._load_from_disk(key)
+
+    def _dump(self, key: str, data: bytes):
+        """Write bytecode to the cache."""
+        self._dump_to_disk(key, data)
+
+    def _load_from_disk(self, key: str) -> Optional[bytes]:
+        """Read bytecode from the local cache directory."""
+        if self.directory is None:
+            return None
+        try:
+            return (self.directory/f"{key}.jbc").read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _dump_to_disk(self, key: str, data: bytes):
+        """Write bytecode to the local cache directory (atomically)."""
+        if self.directory is None:
+            return
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=str(self.directory), suffix=".tmp",
+        )
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, str(self.directory/f"{key}.jbc"))
+        except OSError as error:
+            logger.warning(f"Unable to write template bytecode: {error}")
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+
+def private_directory(directory: Path) -> bool:
+    """Create a private directory, or check that an existing one is private.
+
+    Cached bytecode is loaded (unmarshalled) as code, so the directory must
+    be a real directory (not a symlink), owned by the current user, and not
+    writable by other users; otherwise another local user could plant
+    bytecode in it.
+    """
+    try:
+        directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        status = os.lstat(str(directory))
+    except OSError as error:
+        logger.error(
+            f"Unable to create the template bytecode cache directory "
+            f"`{directory}`: {error}"
+        )
+        return False
+
+    if not stat.S_ISDIR(status.st_mode) \
+            or status.st_uid != os.getuid() \
+            or status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        logger.error(
+            f"Not using the template bytecode cache directory `{directory}`; "
+            f"it must be a directory (not a symlink) owned by the server's "
+            f"user, and not writable by other users."
+        )
+        return False
+
+    return True
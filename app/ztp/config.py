@@ -17,6 +17,7 @@ or implied.
 """
 
 import os
+import tempfile
 
 
 # Logging
@@ -27,12 +28,143 @@ LOG_LEVEL = os.environ.get("LOG_LEVEL", "").upper() \
 
 # Responder
 RESPONDER_ADDRESS = os.environ.get("RESPONDER_ADDRESS", "0.0.0.0")
-RESPONDER_PORT = int(os.environ.get("PORT")) \
-                 or int(os.environ.get("RESPONDER_PORT")) \
-                 or 8000
+RESPONDER_PORT = int(
+    os.environ.get("PORT") or os.environ.get("RESPONDER_PORT") or 8000
+)
 RESPONDER_DEBUG = os.environ.get("RESPONDER_DEBUG", "false").lower() == "true"
+RESPONDER_WORKERS = int(os.environ.get("RESPONDER_WORKERS") or 1)
+RESPONDER_GRACEFUL_TIMEOUT = int(
+    os.environ.get("RESPONDER_GRACEFUL_TIMEOUT", 30)
+)
+
+
+# Storage Backend: mongo, memory, or sqlite
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo").lower()
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "ztp.sqlite3")
 
 
 # MondoDB
 MONGO_DATABASE = "ztp"
 MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+
+
+# Rendered-Configuration Cache
+RENDER_CACHE_MAX_ENTRIES = int(
+    os.environ.get("RENDER_CACHE_MAX_ENTRIES", 10000)
+)
+RENDER_CACHE_MAX_BYTES = int(
+    os.environ.get("RENDER_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+
+
+# Database Executor
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", 32))
+
+
+# Render Executor
+RENDER_EXECUTOR_WORKERS = int(
+    os.environ.get("RENDER_EXECUTOR_WORKERS", os.cpu_count() or 4)
+)
+
+
+# Render Worker Processes (0 renders in the render executor threads)
+RENDER_PROCESSES = int(
+    os.environ.get("RENDER_PROCESSES", os.cpu_count() or 4)
+)
+RENDER_TIMEOUT = float(os.environ.get("RENDER_TIMEOUT", 10.0))
+RENDER_MAX_OUTPUT_BYTES = int(
+    os.environ.get("RENDER_MAX_OUTPUT_BYTES", 16 * 1024 * 1024)
+)
+RENDER_WORKER_MAX_RENDERS = int(
+    os.environ.get("RENDER_WORKER_MAX_RENDERS", 10000)
+)
+RENDER_WORKER_MEMORY_LIMIT = int(
+    os.environ.get("RENDER_WORKER_MEMORY_LIMIT", 0)
+)
+
+
+# Template Version Watcher
+TEMPLATE_WATCH_POLL_INTERVAL = float(
+    os.environ.get("TEMPLATE_WATCH_POLL_INTERVAL", 2.0)
+)
+
+
+# Bulk Writes
+BULK_WRITE_BATCH_SIZE = int(os.environ.get("BULK_WRITE_BATCH_SIZE", 1000))
+
+
+# API Listings
+API_MAX_PAGE_SIZE = int(os.environ.get("API_MAX_PAGE_SIZE", 1000))
+API_STREAM_BATCH_SIZE = int(os.environ.get("API_STREAM_BATCH_SIZE", 500))
+
+
+# Template Bytecode Cache (a private, per-user directory by default)
+TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get(
+    "TEMPLATE_BYTECODE_CACHE_DIR",
+    os.path.join(
+        tempfile.gettempdir(), f"ztp-template-bytecode-{os.getuid()}",
+    ),
+)
+TEMPLATE_BYTECODE_CACHE_MONGO = os.environ.get(
+    "TEMPLATE_BYTECODE_CACHE_MONGO", "false"
+).lower() == "true"
+
+
+# Pre-Rendering
+PRERENDER_ENABLED = os.environ.get("PRERENDER_ENABLED", "true").lower() \
+    == "true"
+PRERENDER_WORKERS = int(os.environ.get("PRERENDER_WORKERS", 4))
+PRERENDER_BATCH_SIZE = int(os.environ.get("PRERENDER_BATCH_SIZE", 500))
+
+
+# HTTP Compression
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get("COMPRESSION_MINIMUM_SIZE", 500))
+COMPRESSION_LEVEL = int(os.environ.get("COMPRESSION_LEVEL", 6))
+COMPRESSION_CACHE_MAX_BYTES = int(
+    os.environ.get("COMPRESSION_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+)
+REQUEST_MAX_DECODED_BYTES = int(
+    os.environ.get("REQUEST_MAX_DECODED_BYTES", 256 * 1024 * 1024)
+)
+
+
+# Bulk Rendering
+BULK_RENDER_BATCH_SIZE = int(os.environ.get("BULK_RENDER_BATCH_SIZE", 500))
+
+
+# Request Tracing
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "true").lower() == "true"
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH", "")
+SLOW_REQUEST_THRESHOLD = float(os.environ.get("SLOW_REQUEST_THRESHOLD", 1.0))
+
+
+# Device Data Validation
+DEVICE_DATA_VALIDATION = os.environ.get(
+    "DEVICE_DATA_VALIDATION", "true"
+).lower() == "true"
+VALIDATION_PROCESSES = int(
+    os.environ.get("VALIDATION_PROCESSES", os.cpu_count() or 4)
+)
+VALIDATION_CHUNK_SIZE = int(os.environ.get("VALIDATION_CHUNK_SIZE", 5000))
+VALIDATION_PARALLEL_THRESHOLD = int(
+    os.environ.get("VALIDATION_PARALLEL_THRESHOLD", 20000)
+)
+VALIDATION_MAX_ERRORS = int(os.environ.get("VALIDATION_MAX_ERRORS", 100))
+
+
+# Admission Control
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() \
+    == "true"
+ADMISSION_MAX_CONCURRENCY = int(
+    os.environ.get("ADMISSION_MAX_CONCURRENCY", 64)
+)
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 512))
+ADMISSION_MAX_BULK_QUEUE = int(
+    os.environ.get("ADMISSION_MAX_BULK_QUEUE", 16)
+)
+ADMISSION_QUEUE_TIMEOUT = float(
+    os.environ.get("ADMISSION_QUEUE_TIMEOUT", 10.0)
+)
+ADMISSION_MAX_RETRY_AFTER = int(
+    os.environ.get("ADMISSION_MAX_RETRY_AFTER", 60)
+)
@@ -0,0 +1,96 @@
+"""Request context, propagated from the event loop to worker threads.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import asyncio
+import threading
+from typing import Any, Callable, Optional
+import weakref
+
+
+class RequestContext(object):
+    """Per-request state shared by the code that serves a request."""
+
+    __slots__ = ("route", "mongo_operations", "trace", "__weakref__")
+
+    def __init__(self, route: str):
+        """Initialize a new request context.
+
+        Args:
+            route: The route (URL pattern) serving the request.
+        """
+        self.route = route
+        self.mongo_operations = 0
+        # The request's trace (`ztp.tracing.Trace`), if it is traced
+        self.trace = None
+
+
+# Contexts are tracked by asyncio task on the event loop, and by thread in
+# the executor worker threads (`run_in_executor` does not carry
+# `contextvars` over to the worker threads).
+_task_contexts = weakref.WeakKeyDictionary()
+_local = threading.local()
+
+
+def _get_task() -> Optional[asyncio.Task]:
+    """Get the running asyncio task, if called from a task."""
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        # No event loop in this thread
+        return None
+
+
+def current_context() -> Optional[RequestContext]:
+    """Get the context of the request being served, if any."""
+    context = getattr(_local, "context", None)
+    if context is not None:
+        return context
+
+    task = _get_task()
+    if task is None:
+        return None
+    return _task_contexts.get(task)
+
+
+def set_context(context: RequestContext):
+    """Bind a request context to the running asyncio task."""
+    task = _get_task()
+    if task is not None:
+        _task_contexts[task] = context
+
+
+def bind_context(func: Callable[[], Any]) -> Callable[[], Any]:
+    """Wrap a function to run with the caller's request context.
+
+    Call from the event loop to prepare a function that will be run in a
+    worker thread; the wrapped function binds the request context to the
+    worker thread while it runs.
+    """
+    context = current_context()
+    if context is None:
+        return func
+
+    def run_with_context() -> Any:
+        previous = getattr(_local, "context", None)
+        _local.context = context
+        try:
+            return func()
+        finally:
+            _local.context = previous
+
+    return run_with_context
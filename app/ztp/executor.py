@@ -0,0 +1,128 @@
+"""Executors for running blocking operations off the event loop.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import functools
+import multiprocessing
+import threading
+from typing import Any, Callable, Optional
+
+from ztp.config import (
+    DB_EXECUTOR_WORKERS, RENDER_EXECUTOR_WORKERS, VALIDATION_PROCESSES,
+)
+from ztp.context import bind_context
+
+
+# Dedicated thread pool for blocking (mongoengine / pymongo) operations
+db_executor = ThreadPoolExecutor(
+    max_workers=DB_EXECUTOR_WORKERS,
+    thread_name_prefix="ztp-db",
+)
+
+# Thread pool for (CPU-bound) template rendering
+render_executor = ThreadPoolExecutor(
+    max_workers=RENDER_EXECUTOR_WORKERS,
+    thread_name_prefix="ztp-render",
+)
+
+# Process pool for CPU-bound work that would hold the serving process's GIL
+# (bulk validation); created on first use.  Its processes are started by a
+# fork server (as the render pool's are): forking the serving process, with
+# its executor, watcher, and database driver threads, could leave a child
+# blocked on a lock held by another thread at the time of the fork.
+_process_executor: Optional[ProcessPoolExecutor] = None
+_process_executor_lock = threading.Lock()
+
+
+def get_process_executor() -> ProcessPoolExecutor:
+    """Get the process pool, creating it if needed."""
+    global _process_executor
+    with _process_executor_lock:
+        if _process_executor is None:
+            _process_executor = ProcessPoolExecutor(
+                max_workers=VALIDATION_PROCESSES,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return _process_executor
+
+
+def _discard_process_executor(executor: ProcessPoolExecutor):
+    """Discard a broken process pool; the next call creates a new one."""
+    global _process_executor
+    with _process_executor_lock:
+        if _process_executor is executor:
+            _process_executor = None
+    executor.shutdown(wait=False)
+
+
+async def run_sync(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking function in the database executor and await the result.
+
+    The responder / uvicorn event loop serves every in-flight request, so the
+    synchronous MongoDB driver must never be called on it directly.  Queries
+    run in the dedicated database thread pool and the calling coroutine
+    yields to the event loop until the result (or exception) is available.
+
+    The calling request's context is carried over to the worker thread, so
+    the queries are attributed to the request.
+
+    Args:
+        func: The blocking function to be called.
+        *args: Positional arguments to be passed to the function.
+        **kwargs: Keyword arguments to be passed to the function.
+
+    Returns:
+        The function's return value.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        db_executor, bind_context(functools.partial(func, *args, **kwargs)),
+    )
+
+
+async def run_render(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a (CPU-bound) rendering function in the render executor."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        render_executor,
+        bind_context(functools.partial(func, *args, **kwargs)),
+    )
+
+
+async def run_process(func: Callable[..., Any], *args) -> Any:
+    """Run a (CPU-bound) function in the process pool.
+
+    The function and its arguments are pickled to a worker process, so the
+    function must be defined at module level.  The request context is not
+    carried over.
+
+    Raises:
+        BrokenProcessPool: If a worker process died; the pool is replaced
+            for the following calls.
+    """
+    loop = asyncio.get_event_loop()
+    executor = get_process_executor()
+    try:
+        return await loop.run_in_executor(
+            executor, functools.partial(func, *args),
+        )
+    except BrokenProcessPool:
+        _discard_process_executor(executor)
+        raise
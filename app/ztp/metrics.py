@@ -0,0 +1,458 @@
+"""Prometheus metrics.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import pymongo.monitoring
+
+from ztp.context import current_context
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0,
+)
+
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value in the Prometheus text format."""
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if value != value:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    """Escape a label value."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    """Format a label set, e.g. `{route="/config/{serial_number}"}`."""
+    labels = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return f"{{{labels}}}" if labels else ""
+
+
+class Registry(object):
+    """Collection of metrics exposed together."""
+
+    def __init__(self):
+        """Initialize a new, empty registry."""
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric") -> "Metric":
+        """Add a metric to the registry."""
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Metric(object):
+    """Base class for metrics, with an optional set of label names."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Iterable[str] = (),
+                 registry: Optional[Registry] = registry):
+        """Initialize a new metric and add it to a registry."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._lock = threading.Lock()
+        self._values = {}
+
+        if registry is not None:
+            registry.register(self)
+
+    def _label_values(self, labels: Dict[str, object]) -> LabelValues:
+        """Get the label values, in label-name order."""
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labelnames}; got "
+                f"{tuple(labels)}."
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """Get the (suffix, formatted labels, value) samples."""
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield "", _format_labels(self.labelnames, label_values), value
+
+    def expose(self) -> List[str]:
+        """Render the metric in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{labels} {_format_value(value)}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """Increment the counter."""
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        """Set the gauge value."""
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        """Increment the gauge."""
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        """Decrement the gauge."""
+        self.inc(-amount, **labels)
+
+
+class CallbackMetric(Metric):
+    """Metric whose values are collected from a callback when exposed.
+
+    The callback returns a dictionary of label-value tuples to values.
+    Used to expose counters that are already kept elsewhere (e.g. cache
+    hit/miss counters).
+    """
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Iterable[str],
+                 callback: Callable[[], Dict[LabelValues, float]],
+                 type: str = "gauge",
+                 registry: Optional[Registry] = registry):
+        """Initialize a new callback metric and add it to a registry."""
+        super().__init__(name, documentation, labelnames, registry)
+        self.type = type
+        self.callback = callback
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """Collect the samples from the callback."""
+        for label_values, value in sorted(self.callback().items()):
+            yield "", _format_labels(self.labelnames, label_values), value
+
+
+class Histogram(Metric):
+    """Histogram of observed values, with cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS,
+                 registry: Optional[Registry] = registry):
+        """Initialize a new histogram and add it to a registry."""
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        """Record an observation."""
+        key = self._label_values(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) \
+                or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block of code, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """Get the bucket, sum, and count samples."""
+        with self._lock:
+            values = {
+                key: (list(counts), total)
+                for key, (counts, total) in self._values.items()
+            }
+        labelnames = self.labelnames + ("le",)
+        for label_values, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", _format_labels(
+                    labelnames, label_values + (_format_value(bound),),
+                ), cumulative
+            labels = _format_labels(self.labelnames, label_values)
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
+
+
+# Web requests
+http_request_duration = Histogram(
+    "ztp_http_request_duration_seconds",
+    "HTTP request latency, by route.",
+    ("method", "route", "status"),
+)
+http_requests_in_flight = Gauge(
+    "ztp_http_requests_in_flight",
+    "HTTP requests currently being served, by route.",
+    ("route",),
+)
+http_request_mongo_operations = Histogram(
+    "ztp_http_request_mongo_operations",
+    "MongoDB operations per HTTP request, by route.",
+    ("route",),
+    buckets=COUNT_BUCKETS,
+)
+
+# MongoDB
+mongo_command_duration = Histogram(
+    "ztp_mongo_command_duration_seconds",
+    "MongoDB command latency, by command.",
+    ("command",),
+)
+mongo_command_failures = Counter(
+    "ztp_mongo_command_failures_total",
+    "Failed MongoDB commands, by command.",
+    ("command",),
+)
+
+# Templates
+template_compile_duration = Histogram(
+    "ztp_template_compile_duration_seconds",
+    "Jinja2 template compile time (in the server or a render worker), by "
+    "template name.",
+    ("template",),
+)
+template_render_duration = Histogram(
+    "ztp_template_render_duration_seconds",
+    "Jinja2 template render time, by template name.",
+    ("template",),
+)
+template_render_failures = Counter(
+    "ztp_template_render_failures_total",
+    "Failed template renders, by template name and reason (`error`, "
+    "`timeout`, `output_limit`, or `worker_crash`).",
+    ("template", "reason"),
+)
+render_worker_replacements = Counter(
+    "ztp_render_worker_replacements_total",
+    "Render worker processes replaced, by reason (`timeout`, "
+    "`worker_crash`, or `recycled`).",
+    ("reason",),
+)
+
+# Request coalescing
+singleflight_calls = Counter(
+    "ztp_singleflight_calls_total",
+    "Single-flight calls, by group and role (`leader` calls ran the "
+    "operation; `follower` calls shared an in-flight leader's result).",
+    ("group", "role"),
+)
+
+# Admission control
+admission_queue_wait = Histogram(
+    "ztp_admission_queue_wait_seconds",
+    "Time admitted requests waited in the admission queue, by priority.",
+    ("priority",),
+)
+admission_rejections = Counter(
+    "ztp_admission_rejections_total",
+    "Requests shed with a 503 response, by priority and reason "
+    "(`queue_full` or `queue_timeout`).",
+    ("priority", "reason"),
+)
+
+
+class MongoCommandListener(pymongo.monitoring.CommandListener):
+    """Record MongoDB command latencies and per-request operation counts."""
+
+    def started(self, event: pymongo.monitoring.CommandStartedEvent):
+        """Count the command against the request being served, if any."""
+        context = current_context()
+        if context is not None:
+            context.mongo_operations += 1
+
+    def succeeded(self, event: pymongo.monitoring.CommandSucceededEvent):
+        """Record the command latency."""
+        mongo_command_duration.observe(
+            event.duration_micros / 1e6, command=event.command_name,
+        )
+
+    def failed(self, event: pymongo.monitoring.CommandFailedEvent):
+        """Record the command latency and failure."""
+        mongo_command_duration.observe(
+            event.duration_micros / 1e6, command=event.command_name,
+        )
+        mongo_command_failures.inc(command=event.command_name)
+
+
+def cache_metrics(caches: Dict[str, Callable[[], dict]]):
+    """Expose cache hit/miss counters and hit ratios.
+
+    Args:
+        caches: Cache `stats()` functions, by cache name.  Each function
+            returns a dictionary with (at least) `hits` and `misses` keys.
+    """
+    def collect(key: str) -> Callable[[], Dict[LabelValues, float]]:
+        def collect_stat() -> Dict[LabelValues, float]:
+            values = {}
+            for cache, stats in caches.items():
+                stats = stats()
+                lookups = stats["hits"] + stats["misses"]
+                if key == "hit_ratio":
+                    values[(cache,)] = \
+                        stats["hits"] / lookups if lookups else 0.0
+                else:
+                    values[(cache,)] = stats[key]
+            return values
+        return collect_stat
+
+    CallbackMetric(
+        "ztp_cache_hits_total", "Cache hits, by cache.",
+        ("cache",), collect("hits"), type="counter",
+    )
+    CallbackMetric(
+        "ztp_cache_misses_total", "Cache misses, by cache.",
+        ("cache",), collect("misses"), type="counter",
+    )
+    CallbackMetric(
+        "ztp_cache_hit_ratio", "Cache hit ratio, by cache.",
+        ("cache",), collect("hit_ratio"),
+    )
+
+
+def admission_metrics(stats: Callable[[], dict]):
+    """Expose the admission limiter state.
+
+    Args:
+        stats: The limiter `stats()` function; returns a dictionary with
+            `active`, `max_concurrency`, `max_queue`, and `max_bulk_queue`
+            values, the `queued` requests by priority, and the estimated
+            `service_time`.
+    """
+    def collect(key: str) -> Callable[[], Dict[LabelValues, float]]:
+        return lambda: {(): stats()[key]}
+
+    def collect_queued() -> Dict[LabelValues, float]:
+        return {
+            (priority,): queued
+            for priority, queued in stats()["queued"].items()
+        }
+
+    CallbackMetric(
+        "ztp_admission_active", "Requests admitted and being served.",
+        (), collect("active"),
+    )
+    CallbackMetric(
+        "ztp_admission_max_concurrency",
+        "The maximum number of requests served at once.",
+        (), collect("max_concurrency"),
+    )
+    CallbackMetric(
+        "ztp_admission_queued", "Requests waiting for admission, by priority.",
+        ("priority",), collect_queued,
+    )
+    CallbackMetric(
+        "ztp_admission_max_queue",
+        "The maximum number of device requests waiting for admission.",
+        (), collect("max_queue"),
+    )
+    CallbackMetric(
+        "ztp_admission_max_bulk_queue",
+        "The maximum number of bulk API requests waiting for admission.",
+        (), collect("max_bulk_queue"),
+    )
+    CallbackMetric(
+        "ztp_admission_service_time_seconds",
+        "Moving average of the time admitted requests are served.",
+        (), collect("service_time"),
+    )
+
+
+def render_pool_metrics(stats: Callable[[], dict]):
+    """Expose the render worker pool state.
+
+    Args:
+        stats: The pool `stats()` function; returns a dictionary with
+            `processes`, `workers`, and `busy` values.
+    """
+    def collect(key: str) -> Callable[[], Dict[LabelValues, float]]:
+        return lambda: {(): stats()[key]}
+
+    CallbackMetric(
+        "ztp_render_pool_processes",
+        "The maximum number of render worker processes.",
+        (), collect("processes"),
+    )
+    CallbackMetric(
+        "ztp_render_pool_workers", "Render worker processes running.",
+        (), collect("workers"),
+    )
+    CallbackMetric(
+        "ztp_render_pool_busy", "Render worker processes rendering.",
+        (), collect("busy"),
+    )
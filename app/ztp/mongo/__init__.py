@@ -20,10 +20,19 @@ import mongoengine
 import pymongo.database
 
 from ztp.config import MONGO_DATABASE, MONGO_URL
-
-
-# Initialize pymongo and mongoengine
-client = mongoengine.connect(MONGO_DATABASE, host=MONGO_URL)
+from ztp.metrics import MongoCommandListener
+from ztp.tracing import TracingCommandListener
+
+
+# Initialize pymongo and mongoengine; the client connects on first use, so
+# importing the models does not open connections when another storage
+# backend is selected
+client = mongoengine.connect(
+    MONGO_DATABASE,
+    host=MONGO_URL,
+    connect=False,
+    event_listeners=[MongoCommandListener(), TracingCommandListener()],
+)
 assert isinstance(client, pymongo.MongoClient)
 
 # Initialize database connection object
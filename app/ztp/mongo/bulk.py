@@ -0,0 +1,93 @@
+"""Bulk MongoDB collection operations.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from datetime import datetime
+import logging
+from typing import Iterable, Type
+
+from bson import ObjectId
+from mongoengine import Document
+
+from ztp.config import BULK_WRITE_BATCH_SIZE
+from ztp.utils import batched
+
+
+logger = logging.getLogger(__name__)
+
+
+def replace_collection(document_cls: Type[Document],
+                       documents: Iterable[Document],
+                       batch_size: int = BULK_WRITE_BATCH_SIZE) -> int:
+    """Atomically replace the contents of a document collection.
+
+    The document class's indexes are built on a new (empty) staging
+    collection, so the unique constraints are enforced as the documents are
+    written to it, with batched unordered `insert_many` operations.  The
+    staging collection is then renamed over the live collection (dropping
+    the target) in a single atomic operation, so readers see either the old
+    or the new dataset and never a partial one.  If any step fails, the
+    staging collection is dropped and the live collection is left untouched.
+
+    mongoengine signals are not sent for the bulk inserts; documents that
+    have an `updated` field are timestamped here instead.
+
+    Args:
+        document_cls: The mongoengine document class for the collection.
+        documents: The documents that make up the new collection contents.
+        batch_size: The number of documents to send in each `insert_many`.
+
+    Returns:
+        The number of documents written.
+
+    Raises:
+        pymongo.errors.BulkWriteError: If a document violates an index
+            constraint (for example, a duplicate unique key).
+    """
+    db = document_cls._get_db()
+    collection_name = document_cls._get_collection_name()
+    staging = db.create_collection(
+        f"{collection_name}.staging.{ObjectId()}"
+    )
+
+    updated = datetime.utcnow()
+    count = 0
+    try:
+        for index_spec in document_cls._meta.get("index_specs", []):
+            index_spec = index_spec.copy()
+            fields = index_spec.pop("fields")
+            staging.create_index(fields, **index_spec)
+
+        for batch in batched(documents, batch_size):
+            sons = []
+            for document in batch:
+                if "updated" in document._fields:
+                    document.updated = updated
+                sons.append(document.to_mongo())
+            staging.insert_many(sons, ordered=False)
+            count += len(sons)
+
+        staging.rename(collection_name, dropTarget=True)
+
+    except Exception:
+        staging.drop()
+        raise
+
+    logger.info(
+        f"Replaced the `{collection_name}` collection with {count} documents."
+    )
+    return count
@@ -22,6 +22,8 @@ from mongoengine import (
     DateTimeField, DictField, DynamicDocument, StringField, signals,
 )
 
+from ztp.utils import device_data_sha256
+
 
 class DeviceData(DynamicDocument):
     """Device data document."""
@@ -29,11 +31,13 @@ class DeviceData(DynamicDocument):
     template_name = StringField(required=True)
     config_data = DictField()
     updated = DateTimeField()
+    sha256 = StringField()
 
     meta = {
         "collection": "device_data",
         "indexes": [
             "serial_number",
+            "template_name",
         ]
     }
 
@@ -42,6 +46,9 @@ class DeviceData(DynamicDocument):
         """Update the device data attributes before saving the document."""
         assert isinstance(document, DeviceData)
         document.updated = datetime.utcnow()
+        document.sha256 = device_data_sha256(
+            document.template_name, document.config_data,
+        )
 
 
 signals.pre_save.connect(
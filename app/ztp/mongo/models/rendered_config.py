@@ -0,0 +1,43 @@
+"""Rendered (pre-rendered) device configuration data model.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from mongoengine import DateTimeField, Document, StringField
+
+
+class RenderedConfig(Document):
+    """Rendered device configuration document.
+
+    Stores a device's rendered configuration together with the versions of
+    the inputs it was rendered from: the device-data `updated` timestamp and
+    the template sha256 hash.  The stored configuration is current only
+    while both inputs still match.
+    """
+    serial_number = StringField(required=True, unique=True)
+    template_name = StringField(required=True)
+    device_updated = DateTimeField(required=True)
+    template_sha256 = StringField(required=True)
+    content = StringField(required=True)
+    rendered = DateTimeField()
+
+    meta = {
+        "collection": "rendered_configs",
+        "indexes": [
+            "serial_number",
+            "template_name",
+        ]
+    }
@@ -17,10 +17,13 @@ or implied.
 """
 
 from datetime import datetime
-from hashlib import sha256
 
 from mongoengine import (
-    DateTimeField, DynamicDocument, StringField, signals,
+    DateTimeField, DynamicDocument, ListField, StringField, signals,
+)
+
+from ztp.utils import (
+    find_template_dependencies, find_template_variables, template_sha256,
 )
 
 
@@ -29,6 +32,8 @@ class Template(DynamicDocument):
     name = StringField(required=True, unique=True)
     template = StringField(required=True)
     sha256 = StringField()
+    dependencies = ListField(StringField())
+    variables = ListField(StringField())
     updated = DateTimeField()
 
     meta = {
@@ -44,7 +49,9 @@ class Template(DynamicDocument):
         """Update the template attributes before saving the document."""
         assert isinstance(document, Template)
         document.updated = datetime.utcnow()
-        document.sha256 = sha256(document.template.encode("utf-8")).hexdigest()
+        document.sha256 = template_sha256(document.template)
+        document.dependencies = find_template_dependencies(document.template)
+        document.variables = find_template_variables(document.template)
 
 
 signals.pre_save.connect(
@@ -0,0 +1,68 @@
+"""Raw pymongo read path that bypasses mongoengine and marshmallow.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from typing import Optional, Tuple
+
+import pymongo
+from pymongo.collection import Collection
+from pymongo.cursor import Cursor
+
+from ztp.mongo import db
+from ztp.mongo.models.device_data import DeviceData
+from ztp.mongo.models.template import Template
+
+
+# API document shapes: (field name, default value) in API field order
+DEVICE_DATA_FIELDS: Tuple[Tuple[str, object], ...] = (
+    ("serial_number", None),
+    ("template_name", None),
+    ("config_data", {}),
+    ("updated", None),
+)
+TEMPLATE_FIELDS: Tuple[Tuple[str, object], ...] = (
+    ("name", None),
+    ("template", None),
+    ("sha256", None),
+    ("dependencies", []),
+    ("variables", []),
+    ("updated", None),
+)
+
+device_data_collection = db[DeviceData._meta["collection"]]
+templates_collection = db[Template._meta["collection"]]
+
+
+def projection(fields: Tuple[Tuple[str, object], ...]) -> dict:
+    """Create a projection that returns only the API fields."""
+    projection = {field: True for field, _ in fields}
+    projection["_id"] = False
+    return projection
+
+
+def find_documents(collection: Collection,
+                   fields: Tuple[Tuple[str, object], ...],
+                   key: str,
+                   after: Optional[str] = None,
+                   limit: Optional[int] = None) -> Cursor:
+    """Find documents, ordered by key, projected to the API fields."""
+    return collection.find(
+        {key: {"$gt": after}} if after is not None else {},
+        projection=projection(fields),
+        sort=[(key, pymongo.ASCENDING)],
+        limit=limit or 0,
+    )
@@ -0,0 +1,264 @@
+"""Background pre-rendering of device configurations.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+import threading
+from typing import Iterable, List, Optional, Union
+
+import jinja2
+from pymongo import UpdateOne
+import pymongo.errors
+
+from ztp.config import (
+    PRERENDER_BATCH_SIZE, PRERENDER_ENABLED, PRERENDER_WORKERS,
+)
+from ztp.mongo.models.device_data import DeviceData
+from ztp.mongo.models.rendered_config import RenderedConfig
+from ztp.render_pool import RenderError, load_template, render_isolated
+from ztp.storage import DeviceDataRecord, TemplateRecord, storage
+from ztp.template_versions import template_versions
+from ztp.utils import batched
+
+
+logger = logging.getLogger(__name__)
+
+
+class PreRenderer(object):
+    """Render device configurations in the background when their inputs change.
+
+    Writes to device data and templates schedule the affected devices for
+    rendering in a pool of worker threads.  Each rendered configuration is
+    stored (in the `rendered_configs` collection) with the versions of the
+    inputs it was rendered from, so the config endpoint can serve the stored
+    bytes whenever they are still current.  Requires the MongoDB storage
+    backend.
+    """
+
+    def __init__(self, enabled: bool, workers: int, batch_size: int):
+        """Initialize a new pre-renderer.
+
+        Args:
+            enabled: Whether writes should schedule background renders.
+            workers: The number of worker threads rendering configurations.
+            batch_size: The number of devices rendered per batch job.
+        """
+        self.enabled = enabled
+        self.batch_size = batch_size
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="ztp-prerender",
+        )
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def schedule_devices(self, serial_numbers: Iterable[str]):
+        """Schedule devices for rendering, by serial number."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            serial_numbers = [
+                serial_number for serial_number in serial_numbers
+                if serial_number not in self._pending
+            ]
+            self._pending.update(serial_numbers)
+
+        for batch in batched(serial_numbers, self.batch_size):
+            self._executor.submit(self._render_batch, batch)
+
+    def schedule_template(self, template_name: str):
+        """Schedule all devices that use a template for rendering."""
+        if self.enabled:
+            self._executor.submit(self._schedule_template, template_name)
+
+    def schedule_all(self):
+        """Schedule all devices for rendering."""
+        if self.enabled:
+            self._executor.submit(self._schedule_all)
+
+    def load(self, serial_number: str, device_updated: datetime,
+             template_version: str) -> Optional[bytes]:
+        """Load a device's stored configuration, if it is still current.
+
+        Returns:
+            The stored configuration, or None if the device has no stored
+            configuration or it was rendered from different inputs.
+        """
+        if not self.enabled:
+            return None
+
+        document = RenderedConfig._get_collection().find_one(
+            {
+                "serial_number": serial_number,
+                "device_updated": device_updated,
+                "template_sha256": template_version,
+            },
+            projection={"content": True, "_id": False},
+        )
+        return document["content"].encode("utf-8") if document else None
+
+    def store(self, record: DeviceDataRecord, template_version: str,
+              content: bytes):
+        """Store a configuration rendered on demand (in the background)."""
+        if self.enabled:
+            self._executor.submit(
+                self._store,
+                [self._update(record, template_version, content)],
+            )
+
+    def _schedule_template(self, template_name: str):
+        """Find the devices that use a template and schedule them."""
+        self.schedule_devices(
+            document.serial_number
+            for document in DeviceData.objects(
+                template_name=template_name,
+            ).only("serial_number").no_cache()
+        )
+
+    def _schedule_all(self):
+        """Find all devices and schedule them, and remove orphaned configs."""
+        self.schedule_devices(
+            document.serial_number
+            for document in DeviceData.objects.only("serial_number").no_cache()
+        )
+
+        orphans = RenderedConfig._get_collection().aggregate([
+            {"$lookup": {
+                "from": DeviceData._get_collection_name(),
+                "localField": "serial_number",
+                "foreignField": "serial_number",
+                "as": "device_data",
+            }},
+            {"$match": {"device_data": {"$size": 0}}},
+            {"$project": {"_id": True}},
+        ])
+        for batch in batched(orphans, self.batch_size):
+            RenderedConfig._get_collection().delete_many(
+                {"_id": {"$in": [document["_id"] for document in batch]}}
+            )
+
+    def _render_batch(self, serial_numbers: List[str]):
+        """Render and store the configurations for a batch of devices."""
+        with self._lock:
+            self._pending.difference_update(serial_numbers)
+
+        try:
+            device_data_objects = DeviceData.objects(
+                serial_number__in=serial_numbers,
+            )
+
+            # Templates are rendered in the render pool's worker processes
+            # (with its time and output limits), not on these threads
+            versions = {}
+            updates = []
+            for device_data_object in device_data_objects:
+                name = device_data_object.template_name
+                try:
+                    if name not in versions:
+                        versions[name] = template_versions.closure_version(
+                            name,
+                        ) or load_template(name)
+                    template_version, content = render_isolated(
+                        name, versions[name], device_data_object.config_data,
+                    )
+                except (jinja2.TemplateNotFound, RenderError):
+                    continue
+                versions[name] = template_version
+                updates.append(self._update(
+                    device_data_object, template_version, content,
+                ))
+
+            self._store(updates)
+
+        except Exception:
+            logger.exception(
+                f"Unable to pre-render the configurations for "
+                f"{len(serial_numbers)} devices."
+            )
+
+    @staticmethod
+    def _update(device_data_object: Union[DeviceData, DeviceDataRecord],
+                template_version: str, content: bytes) -> UpdateOne:
+        """Create the upsert operation that stores a rendered configuration."""
+        return UpdateOne(
+            {"serial_number": device_data_object.serial_number},
+            {"$set": {
+                "template_name": device_data_object.template_name,
+                "device_updated": device_data_object.updated,
+                "template_sha256": template_version,
+                "content": content.decode("utf-8"),
+                "rendered": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
+
+    @staticmethod
+    def _store(updates: List[UpdateOne]):
+        """Write rendered configurations to the rendered_configs collection."""
+        if not updates:
+            return
+        try:
+            RenderedConfig._get_collection().bulk_write(updates, ordered=False)
+        except pymongo.errors.PyMongoError as error:
+            logger.error(f"Unable to store rendered configurations: {error}")
+
+
+# Stored configurations are kept in MongoDB
+prerenderer = PreRenderer(
+    enabled=PRERENDER_ENABLED and storage.name == "mongo",
+    workers=PRERENDER_WORKERS,
+    batch_size=PRERENDER_BATCH_SIZE,
+)
+
+
+# Schedule renders when device data or templates change
+def _device_data_changed(serial_number: Optional[str],
+                         record: Optional[DeviceDataRecord]):
+    """Schedule a changed device for rendering.
+
+    Removes a deleted device's stored configuration, and schedules all
+    devices after the device data has been replaced.
+    """
+    if not prerenderer.enabled:
+        return
+    if serial_number is None:
+        prerenderer.schedule_all()
+    elif record is None:
+        RenderedConfig.objects(serial_number=serial_number).delete()
+    else:
+        prerenderer.schedule_devices([serial_number])
+
+
+def _template_changed(name: str, record: Optional[TemplateRecord]):
+    """Schedule the devices that use a changed template for rendering.
+
+    Devices using templates that include, extend, or import the changed
+    template are scheduled as well.
+    """
+    if record is None:
+        return
+    prerenderer.schedule_template(name)
+    for dependent in template_versions.dependents(name):
+        prerenderer.schedule_template(dependent)
+
+
+storage.add_device_data_listener(_device_data_changed)
+storage.add_template_listener(_template_changed)
@@ -0,0 +1,178 @@
+"""In-process cache of rendered device configurations.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+import threading
+from typing import Optional
+
+from ztp.config import RENDER_CACHE_MAX_BYTES, RENDER_CACHE_MAX_ENTRIES
+from ztp.storage import DeviceDataRecord, storage
+from ztp.template_versions import template_versions
+
+
+CacheKey = namedtuple(
+    "CacheKey", ["serial_number", "device_updated", "template_version"],
+)
+
+_CacheEntry = namedtuple("_CacheEntry", ["key", "template_name", "content"])
+
+
+class RenderCache(object):
+    """Bounded, thread-safe LRU cache of rendered device configurations.
+
+    Entries are keyed by the device serial number, the device-data `updated`
+    timestamp, and the template closure version; a change to either input
+    produces a new key, so a stale entry can never be served.  Only the
+    latest entry is kept for each serial number, and the least recently used
+    entries are evicted when either the entry or byte limit is exceeded.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        """Initialize a new, empty render cache.
+
+        Args:
+            max_entries: The maximum number of cached configurations.
+            max_bytes: The maximum total size of the cached configurations.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(serial_number: str, device_updated: datetime,
+                 template_version: str) -> CacheKey:
+        """Create a cache key from the rendering inputs."""
+        return CacheKey(serial_number, device_updated, template_version)
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        """Get a rendered configuration from the cache.
+
+        Returns:
+            The cached configuration, or None if there is no current entry
+            for the key.
+        """
+        with self._lock:
+            entry = self._entries.get(key.serial_number)
+            if entry is None or entry.key != key:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key.serial_number)
+            self.hits += 1
+            return entry.content
+
+    def put(self, key: CacheKey, template_name: str, content: bytes):
+        """Add a rendered configuration to the cache."""
+        if len(content) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove(key.serial_number)
+            self._entries[key.serial_number] = _CacheEntry(
+                key, template_name, content,
+            )
+            self._size += len(content)
+
+            while len(self._entries) > self.max_entries \
+                    or self._size > self.max_bytes:
+                serial_number = next(iter(self._entries))
+                self._remove(serial_number)
+                self.evictions += 1
+
+    def invalidate_device(self, serial_number: str):
+        """Remove the cached configuration for a device."""
+        with self._lock:
+            self._remove(serial_number)
+
+    def invalidate_template(self, template_name: str):
+        """Remove all cached configurations rendered from a template."""
+        with self._lock:
+            serial_numbers = [
+                serial_number
+                for serial_number, entry in self._entries.items()
+                if entry.template_name == template_name
+            ]
+            for serial_number in serial_numbers:
+                self._remove(serial_number)
+
+    def clear(self):
+        """Remove all cached configurations."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        """Get the cache utilization and hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, serial_number: str):
+        """Remove an entry; the caller must hold the cache lock."""
+        entry = self._entries.pop(serial_number, None)
+        if entry is not None:
+            self._size -= len(entry.content)
+
+
+render_cache = RenderCache(
+    max_entries=RENDER_CACHE_MAX_ENTRIES,
+    max_bytes=RENDER_CACHE_MAX_BYTES,
+)
+
+
+# Invalidate cached configurations when the underlying records change
+def _device_data_changed(serial_number: Optional[str],
+                         record: Optional[DeviceDataRecord]):
+    """Invalidate the cached configuration for a changed device."""
+    if serial_number is None:
+        render_cache.clear()
+    else:
+        render_cache.invalidate_device(serial_number)
+
+
+def _template_changed(name: str, old_sha256: Optional[str],
+                      new_sha256: Optional[str]):
+    """Invalidate the configurations rendered from a changed template.
+
+    Configurations rendered from templates that include, extend, or import
+    the changed template are invalidated as well.
+    """
+    render_cache.invalidate_template(name)
+    for dependent in template_versions.dependents(name):
+        render_cache.invalidate_template(dependent)
+
+
+storage.add_device_data_listener(_device_data_changed)
+template_versions.add_listener(_template_changed)
@@ -0,0 +1,460 @@
+"""Process pool for isolated, time- and size-limited template rendering.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from collections import OrderedDict
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from ztp import render_worker
+from ztp.bytecode_cache import bytecode_cache
+from ztp.config import (
+    RENDER_MAX_OUTPUT_BYTES, RENDER_PROCESSES, RENDER_TIMEOUT,
+    RENDER_WORKER_MAX_RENDERS, RENDER_WORKER_MEMORY_LIMIT,
+)
+from ztp.metrics import (
+    render_worker_replacements, template_compile_duration,
+    template_render_duration, template_render_failures,
+)
+from ztp.template_engine import (
+    fetch_template_closure, get_template, render_template,
+)
+from ztp.tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+
+# Template closure sources kept for sending to workers
+_MAX_SOURCES = 256
+
+# Workers are started by a fork server: forking the (multi-threaded) web
+# server process directly is not safe
+_context = multiprocessing.get_context("forkserver")
+_context.set_forkserver_preload(["ztp.render_worker"])
+
+
+class RenderError(Exception):
+    """Rendering a device configuration failed."""
+
+    reason = "error"
+
+    def __init__(self, template_name: str, message: str):
+        super().__init__(
+            f"Rendering the configuration with the template "
+            f"`{template_name}` failed: {message}"
+        )
+        self.template_name = template_name
+
+
+class RenderTimeout(RenderError):
+    """A render exceeded the time limit (its worker was replaced)."""
+
+    reason = "timeout"
+
+
+class RenderOutputTooLarge(RenderError):
+    """A render exceeded the output-size limit."""
+
+    reason = "output_limit"
+
+
+class RenderWorkerCrashed(RenderError):
+    """A render worker process died (and was replaced)."""
+
+    reason = "worker_crash"
+
+
+class _Worker(object):
+    """A render worker process, and the pool's end of its pipe."""
+
+    def __init__(self, max_output_bytes: int, memory_limit: int,
+                 bytecode_cache_dir: Optional[str]):
+        """Start a new worker process."""
+        self.connection, worker_connection = _context.Pipe()
+        self.process = _context.Process(
+            target=render_worker.run,
+            args=(
+                worker_connection, max_output_bytes, memory_limit,
+                bytecode_cache_dir,
+            ),
+            name="ztp-render-worker",
+            daemon=True,
+        )
+        self.process.start()
+        worker_connection.close()
+
+        # The template versions the worker has compiled (as far as the pool
+        # knows; the worker may have evicted some since)
+        self.compiled = set()
+        self.renders = 0
+
+    def call(self, request: tuple, deadline: float) -> Optional[tuple]:
+        """Send a request, and wait for the reply until the deadline.
+
+        Returns:
+            The reply, or None if the worker did not reply in time.
+
+        Raises:
+            EOFError, OSError: The worker process died.
+        """
+        self.connection.send(request)
+        if not self.connection.poll(max(0.0, deadline - time.monotonic())):
+            return None
+        return self.connection.recv()
+
+    def stop(self):
+        """Kill the worker process."""
+        try:
+            os.kill(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        self.connection.close()
+
+
+class RenderPool(object):
+    """Render device configurations in a pool of worker processes.
+
+    Each render runs in a worker process, so a heavy or badly written
+    template holds neither the web server's GIL nor its event loop, and
+    rendering scales across CPU cores.  Templates are rendered by name and
+    closure version (from the template-version table) and are not compiled
+    in the server process: workers compile each template version once,
+    sharing bytecode through the bytecode cache directory, and keep it.  The
+    template sources are sent to a worker only when it has not compiled
+    that version.
+
+    A render that exceeds the time limit has its worker killed and
+    replaced; a render whose output exceeds the size limit is stopped.
+    Workers are also replaced after `max_renders` renders, to bound the
+    memory any one worker can accumulate.
+
+    `render()` blocks until the render is complete; call it from the render
+    executor (`ztp.executor.run_render`) or a background thread.  Workers
+    are started on first use, up to `processes` of them.
+    """
+
+    def __init__(self, processes: int, timeout: float,
+                 max_output_bytes: int, max_renders: int,
+                 memory_limit: int = 0,
+                 bytecode_cache_dir: Optional[str] = None):
+        """Initialize a new render pool.
+
+        Args:
+            processes: The number of worker processes.
+            timeout: The time limit for each render, in seconds.
+            max_output_bytes: The largest configuration a render may
+                produce.
+            max_renders: The renders after which a worker is replaced.
+            memory_limit: Each worker's address-space limit, in bytes (0
+                for no limit).
+            bytecode_cache_dir: The local template bytecode cache directory
+                the workers share.
+        """
+        self.processes = processes
+        self.timeout = timeout
+        self.max_output_bytes = max_output_bytes
+        self.max_renders = max_renders
+        self.memory_limit = memory_limit
+        self.bytecode_cache_dir = bytecode_cache_dir
+
+        self._idle = queue.Queue()
+        self._workers = 0
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._sources = OrderedDict()
+        self._sources_lock = threading.Lock()
+
+    def load(self, name: str) -> str:
+        """Fetch the current sources of a template closure.
+
+        Returns:
+            The closure version of the sources.
+
+        Raises:
+            jinja2.TemplateNotFound: The template does not exist.
+        """
+        return self._fetch_sources(name)[0]
+
+    def render(self, name: str, version: Optional[str],
+               config_data: dict) -> Tuple[str, bytes]:
+        """Render a device configuration in a worker process.
+
+        The template sources are fetched when they are needed (the workers
+        have not compiled the version); if the template has changed since
+        the version was looked up, the current version is rendered instead.
+
+        Args:
+            name: The template name.
+            version: The template's closure version, if it is known.
+            config_data: The device's config data.
+
+        Returns:
+            The closure version that was rendered, and the configuration.
+
+        Raises:
+            RenderError: The template raised an error, or the render
+                exceeded a limit.
+            jinja2.TemplateNotFound: The template does not exist.
+        """
+        deadline = time.monotonic() + self.timeout
+        worker = self._checkout()
+        with self._lock:
+            self._busy += 1
+        try:
+            version, (status, value) = self._call(
+                worker, name, version, config_data, deadline,
+            )
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+        if status == render_worker.OK:
+            return version, value
+        if status == render_worker.TOO_LARGE:
+            raise self._failed(RenderOutputTooLarge(
+                name, f"the configuration exceeded the "
+                      f"{self.max_output_bytes} byte output limit.",
+            ))
+        raise self._failed(RenderError(name, value))
+
+    def stats(self) -> dict:
+        """Get the pool state."""
+        return {
+            "processes": self.processes,
+            "workers": self._workers,
+            "busy": self._busy,
+        }
+
+    def _call(self, worker: _Worker, name: str, version: Optional[str],
+              config_data: dict, deadline: float) -> Tuple[str, tuple]:
+        """Send a render request to a worker, and check it in again.
+
+        Returns:
+            The closure version sent, and the worker's `(status, value)`
+            reply.
+
+        Raises:
+            RenderTimeout, RenderWorkerCrashed: The worker was replaced.
+        """
+        reply = None
+        if (name, version) in worker.compiled:
+            reply = self._send(
+                worker, name, (name, version, None, config_data), deadline,
+            )
+
+        if reply is None or reply[0] == render_worker.MISSING:
+            try:
+                version, sources = self._get_sources(name, version)
+            except BaseException:
+                # E.g. the template does not exist; the worker has no
+                # request in progress
+                self._idle.put(worker)
+                raise
+            # The retry gets what is left of the time limit
+            reply = self._send(
+                worker, name, (name, version, sources, config_data), deadline,
+            )
+
+        worker.compiled.add((name, version))
+        worker.renders += 1
+        self._checkin(worker)
+        return version, reply
+
+    def _send(self, worker: _Worker, name: str, request: tuple,
+              deadline: float) -> tuple:
+        """Send a request to a worker, replacing the worker if it fails.
+
+        The compile times the worker reports are recorded.
+
+        Returns:
+            The worker's `(status, value)` reply.
+
+        Raises:
+            RenderTimeout, RenderWorkerCrashed: The worker was replaced.
+        """
+        try:
+            reply = worker.call(request, deadline)
+        except (EOFError, OSError) as error:
+            self._replace(worker, RenderWorkerCrashed.reason)
+            raise self._failed(RenderWorkerCrashed(
+                name, f"the render worker process died ({error!r}).",
+            ))
+
+        if reply is None:
+            self._replace(worker, RenderTimeout.reason)
+            raise self._failed(RenderTimeout(
+                name, f"the render exceeded the {self.timeout:g} second "
+                      f"time limit.",
+            ))
+
+        # Templates are compiled in the workers; record their compile times
+        status, value, compiles = reply
+        for template_name, seconds in compiles:
+            template_compile_duration.observe(seconds, template=template_name)
+        return status, value
+
+    @staticmethod
+    def _failed(error: RenderError) -> RenderError:
+        """Log and count a failed render."""
+        logger.error(str(error))
+        template_render_failures.inc(
+            template=error.template_name, reason=error.reason,
+        )
+        return error
+
+    def _get_sources(self, name: str, version: Optional[str]) \
+            -> Tuple[str, Dict[str, str]]:
+        """Get the sources of a template closure version.
+
+        Returns:
+            The closure version, and the template sources by name.  The
+            version differs from the one requested when the template has
+            changed since (the current sources are returned).
+        """
+        with self._sources_lock:
+            sources = self._sources.get((name, version))
+            if sources is not None:
+                self._sources.move_to_end((name, version))
+                return version, sources
+        return self._fetch_sources(name)
+
+    def _fetch_sources(self, name: str) -> Tuple[str, Dict[str, str]]:
+        """Fetch the current sources of a template closure, and keep them.
+
+        The sources are kept under the version of the texts actually read.
+        """
+        version, sources = fetch_template_closure(name)
+        with self._sources_lock:
+            self._sources[(name, version)] = sources
+            self._sources.move_to_end((name, version))
+            if len(self._sources) > _MAX_SOURCES:
+                self._sources.popitem(last=False)
+        return version, sources
+
+    def _checkout(self) -> _Worker:
+        """Take an idle worker, starting one if the pool is not full."""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    start = self._workers < self.processes
+                    if start:
+                        self._workers += 1
+                worker = self._start() if start else self._idle.get()
+
+            # None marks a replaced worker: start its replacement
+            if worker is not None:
+                return worker
+
+    def _start(self) -> _Worker:
+        """Start a new worker (already counted in the pool size)."""
+        try:
+            return _Worker(
+                self.max_output_bytes, self.memory_limit,
+                self.bytecode_cache_dir,
+            )
+        except BaseException:
+            with self._lock:
+                self._workers -= 1
+            raise
+
+    def _checkin(self, worker: _Worker):
+        """Return a worker to the pool, or recycle it."""
+        if worker.renders >= self.max_renders:
+            self._replace(worker, "recycled")
+        else:
+            self._idle.put(worker)
+
+    def _replace(self, worker: _Worker, reason: str):
+        """Stop a worker; a new worker is started when one is next needed.
+        """
+        worker.stop()
+        render_worker_replacements.inc(reason=reason)
+        with self._lock:
+            self._workers -= 1
+        # Wake a thread waiting for an idle worker, so it starts a new one
+        self._idle.put(None)
+
+
+render_pool = RenderPool(
+    processes=RENDER_PROCESSES,
+    timeout=RENDER_TIMEOUT,
+    max_output_bytes=RENDER_MAX_OUTPUT_BYTES,
+    max_renders=RENDER_WORKER_MAX_RENDERS,
+    memory_limit=RENDER_WORKER_MEMORY_LIMIT,
+    bytecode_cache_dir=str(bytecode_cache.directory)
+    if bytecode_cache.directory is not None else None,
+)
+
+
+def load_template(name: str) -> str:
+    """Get the current closure version of a template, loading it.
+
+    In the render pool, the template sources are fetched (for the workers);
+    with `RENDER_PROCESSES` set to 0, the template is compiled in this
+    process.
+
+    Raises:
+        jinja2.TemplateNotFound: The template does not exist.
+    """
+    if render_pool.processes <= 0:
+        return get_template(name).version
+    return render_pool.load(name)
+
+
+def render_isolated(name: str, version: Optional[str],
+                    config_data: dict) -> Tuple[str, bytes]:
+    """Render a device configuration, in the render pool if it is enabled.
+
+    With `RENDER_PROCESSES` set to 0 the configuration is rendered in the
+    calling thread, without the time and output limits.
+
+    Args:
+        name: The template name.
+        version: The template's closure version, if it is known.
+        config_data: The device's config data.
+
+    Returns:
+        The closure version that was rendered (the current version, if the
+        template has changed), and the configuration.
+
+    Raises:
+        RenderError: The template raised an error, or the render exceeded a
+            limit.
+        jinja2.TemplateNotFound: The template does not exist.
+    """
+    if render_pool.processes <= 0:
+        template = get_template(name)
+        try:
+            return template.version, render_template(template, config_data)
+        except Exception as error:
+            raise RenderPool._failed(RenderError(
+                name, f"{type(error).__name__}: {error}",
+            ))
+
+    with span("template.render", template=name), \
+            template_render_duration.time(template=name):
+        return render_pool.render(name, version, config_data)
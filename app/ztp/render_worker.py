@@ -0,0 +1,152 @@
+"""Template rendering worker process.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from collections import OrderedDict
+from multiprocessing.connection import Connection
+import resource
+import signal
+import time
+from typing import Dict, List, Optional, Tuple
+
+import jinja2
+
+from ztp.bytecode_files import FileBytecodeCache
+
+
+# Reply statuses: (status, value, compiles); `compiles` lists the templates
+# the request compiled, as (name, seconds) pairs
+OK = "ok"                   # value: the rendered configuration (bytes)
+MISSING = "missing"         # the worker needs the template sources
+TOO_LARGE = "too_large"     # the output exceeded the size limit
+ERROR = "error"             # value: the error message
+
+# Compiled templates kept per worker
+_MAX_TEMPLATES = 256
+
+
+class _OutputTooLarge(Exception):
+    """The rendered output exceeded the size limit."""
+
+
+class _Environment(jinja2.Environment):
+    """Jinja2 environment that records template compile times.
+
+    The pool observes the compile-time metric (`ztp.metrics` is not
+    imported in the worker); included templates are compiled when they are
+    first rendered, so compiles are collected per request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compiles: List[Tuple[str, float]] = []
+
+    def compile(self, source, name=None, filename=None, raw=False,
+                defer_init=False):
+        """Compile a template, recording the compile time."""
+        start = time.perf_counter()
+        try:
+            return super().compile(source, name, filename, raw, defer_init)
+        finally:
+            self.compiles.append(
+                (name or "<string>", time.perf_counter() - start),
+            )
+
+
+def _compile(name: str, sources: Dict[str, str],
+             bytecode_cache: Optional[FileBytecodeCache]) -> jinja2.Template:
+    """Compile a template from the sources of its closure."""
+    environment = _Environment(
+        loader=jinja2.DictLoader(sources),
+        bytecode_cache=bytecode_cache,
+    )
+    return environment.get_template(name)
+
+
+def _render(template: jinja2.Template, config_data: dict,
+            max_output_bytes: int) -> bytes:
+    """Render a template, stopping once the output exceeds the limit."""
+    chunks = []
+    size = 0
+    for chunk in template.generate(config_data=config_data):
+        chunk = chunk.encode("utf-8")
+        size += len(chunk)
+        if size > max_output_bytes:
+            raise _OutputTooLarge()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def run(connection: Connection, max_output_bytes: int,
+        memory_limit: Optional[int] = None,
+        bytecode_cache_dir: Optional[str] = None):
+    """Serve render requests from the pool until the connection closes.
+
+    Each request is a `(name, version, sources, config_data)` tuple.
+    Templates are compiled once per closure version and kept for later
+    requests; the pool sends the template sources (the texts of the
+    template and the templates it depends on, by name) only when the
+    worker has not compiled that version, and resends them when the worker
+    replies `MISSING`.  Compiled bytecode is shared with the other workers
+    (and the server) through the bytecode cache directory.
+
+    Args:
+        connection: The worker's end of the pool's pipe.
+        max_output_bytes: The largest configuration a render may produce.
+        memory_limit: The worker's address-space limit, in bytes.
+        bytecode_cache_dir: The local template bytecode cache directory.
+    """
+    # The pool (parent process) handles interrupts and shuts workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    bytecode_cache = FileBytecodeCache(bytecode_cache_dir) \
+        if bytecode_cache_dir else None
+    templates = OrderedDict()
+    while True:
+        try:
+            name, version, sources, config_data = connection.recv()
+        except EOFError:
+            return
+
+        template = None
+        try:
+            template = templates.get((name, version))
+            if template is None:
+                if sources is None:
+                    connection.send((MISSING, None, []))
+                    continue
+                template = _compile(name, sources, bytecode_cache)
+                templates[(name, version)] = template
+                if len(templates) > _MAX_TEMPLATES:
+                    templates.popitem(last=False)
+            else:
+                templates.move_to_end((name, version))
+
+            reply = (OK, _render(template, config_data, max_output_bytes))
+
+        except _OutputTooLarge:
+            reply = (TOO_LARGE, None)
+        except Exception as error:
+            reply = (ERROR, f"{type(error).__name__}: {error}")
+
+        compiles = []
+        if template is not None:
+            compiles = template.environment.compiles
+            template.environment.compiles = []
+        connection.send(reply + (compiles,))
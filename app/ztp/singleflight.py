@@ -0,0 +1,130 @@
+"""Single-flight coalescing of concurrent identical operations.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from ztp.context import RequestContext, current_context, set_context
+from ztp.metrics import singleflight_calls
+
+
+class _Call(object):
+    """An in-flight call, shared by the threads waiting on its result."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls with the same key, across threads.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it runs (followers) wait for it and share its result, or
+    its exception.  Results are not kept once the call completes; a later
+    call runs the function again.
+    """
+
+    def __init__(self, name: str):
+        """Initialize a new single-flight group.
+
+        Args:
+            name: The group name, used as the metrics label.
+        """
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """Call a function, or share the result of the in-flight call."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            singleflight_calls.inc(group=self.name, role="follower")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        singleflight_calls.inc(group=self.name, role="leader")
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight(object):
+    """Coalesce concurrent calls with the same key, on the event loop.
+
+    The leader's coroutine runs in its own task, so a follower keeps waiting
+    for the shared result when the leader's request is cancelled (e.g. the
+    device disconnected), and the task runs with the leader's request
+    context, so its work is attributed to the leader's request.
+    """
+
+    def __init__(self, name: str):
+        """Initialize a new single-flight group.
+
+        Args:
+            name: The group name, used as the metrics label.
+        """
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable,
+                 function: Callable[[], Awaitable]) -> Any:
+        """Await a coroutine function, or share the in-flight call's result.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            singleflight_calls.inc(group=self.name, role="leader")
+            task = asyncio.ensure_future(
+                self._run(key, function, current_context()),
+            )
+            # Retrieve the exception of a call nobody awaits any more
+            task.add_done_callback(
+                lambda done: done.cancelled() or done.exception()
+            )
+            self._calls[key] = task
+        else:
+            singleflight_calls.inc(group=self.name, role="follower")
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, function: Callable[[], Awaitable],
+                   context: Optional[RequestContext]) -> Any:
+        """Run the leader's call, then remove it from the in-flight calls."""
+        if context is not None:
+            set_context(context)
+        try:
+            return await function()
+        finally:
+            del self._calls[key]
@@ -0,0 +1,57 @@
+"""Pluggable device data and template storage.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from ztp.config import SQLITE_PATH, STORAGE_BACKEND
+from ztp.storage.base import (
+    CREATED, DELETED, FAILED, NOT_FOUND, UNCHANGED, UPDATED,
+    DeviceDataListener, DeviceDataRecord, DoesNotExist, NotUniqueError,
+    Storage, StorageError, SyncOutcome, TemplateListener, TemplateRecord,
+    ValidationError, make_device_data, make_template, to_api,
+)
+
+
+BACKENDS = ("mongo", "memory", "sqlite")
+
+
+def create_storage(backend: str) -> Storage:
+    """Create a storage backend, by name.
+
+    The backend modules are imported on demand.
+
+    Raises:
+        ValueError: If the backend name is not known.
+    """
+    if backend == "mongo":
+        from ztp.storage.mongo import MongoStorage
+        return MongoStorage()
+
+    if backend == "memory":
+        from ztp.storage.memory import MemoryStorage
+        return MemoryStorage()
+
+    if backend == "sqlite":
+        from ztp.storage.sqlite import SQLiteStorage
+        return SQLiteStorage(SQLITE_PATH)
+
+    raise ValueError(
+        f"Unknown storage backend `{backend}`; the STORAGE_BACKEND setting "
+        f"should be one of: {', '.join(BACKENDS)}."
+    )
+
+
+storage = create_storage(STORAGE_BACKEND)
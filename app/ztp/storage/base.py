@@ -0,0 +1,420 @@
+"""Storage backend interface.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime
+import logging
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple,
+)
+
+from ztp.utils import (
+    device_data_sha256, encode_datetime, find_template_dependencies,
+    find_template_variables, template_sha256,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Records
+class DeviceDataRecord(NamedTuple):
+    """Device data record."""
+    serial_number: str
+    template_name: str
+    config_data: dict
+    updated: Optional[datetime] = None
+
+
+class TemplateRecord(NamedTuple):
+    """Template record."""
+    name: str
+    template: str
+    sha256: str
+    dependencies: Tuple[str, ...] = ()
+    variables: Tuple[str, ...] = ()
+    updated: Optional[datetime] = None
+
+
+class SyncOutcome(NamedTuple):
+    """The outcome of one record in a device data sync."""
+    serial_number: str
+    result: str
+    error: Optional[str] = None
+
+
+# Sync outcome results
+CREATED = "created"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+DELETED = "deleted"
+NOT_FOUND = "not_found"
+FAILED = "failed"
+
+DeviceDataListener = Callable[
+    [Optional[str], Optional[DeviceDataRecord]], None,
+]
+TemplateListener = Callable[[str, Optional[TemplateRecord]], None]
+
+
+# Exceptions
+class StorageError(Exception):
+    """Base class for storage errors."""
+
+
+class ValidationError(StorageError):
+    """A record is not valid."""
+
+
+class NotUniqueError(StorageError):
+    """A record violates a unique constraint (duplicate key)."""
+
+    def __init__(self, message: str, details: Optional[List[dict]] = None):
+        super().__init__(message)
+        self.details = details or []
+
+
+class DoesNotExist(StorageError):
+    """The requested record does not exist."""
+
+
+# Record helpers
+def utcnow() -> datetime:
+    """Get the current (naive UTC) time, at the precision MongoDB stores."""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def make_device_data(serial_number: str, template_name: str,
+                     config_data: Optional[dict] = None,
+                     updated: Optional[datetime] = None) \
+        -> DeviceDataRecord:
+    """Create and validate a device data record.
+
+    Raises:
+        ValidationError: If a required field is missing or has the wrong type.
+    """
+    if not isinstance(serial_number, str) or not serial_number:
+        raise ValidationError("`serial_number` is required (a string).")
+    if not isinstance(template_name, str) or not template_name:
+        raise ValidationError("`template_name` is required (a string).")
+    if config_data is None:
+        config_data = {}
+    if not isinstance(config_data, dict):
+        raise ValidationError("`config_data` should be an object.")
+    return DeviceDataRecord(serial_number, template_name, config_data, updated)
+
+
+def make_template(name: str, text: str,
+                  updated: Optional[datetime] = None) -> TemplateRecord:
+    """Create a template record, with its hash, dependencies, and variables.
+
+    Raises:
+        ValidationError: If the name or text is missing.
+    """
+    if not isinstance(name, str) or not name:
+        raise ValidationError("The template name is required.")
+    if not isinstance(text, str) or not text:
+        raise ValidationError("The template text is required (a string).")
+    return TemplateRecord(
+        name=name,
+        template=text,
+        sha256=template_sha256(text),
+        dependencies=tuple(find_template_dependencies(text)),
+        variables=tuple(find_template_variables(text)),
+        updated=updated,
+    )
+
+
+def to_api(record: NamedTuple) -> dict:
+    """Convert a record to the API's JSON document shape."""
+    document = dict(record._asdict())
+    if document.get("updated") is not None:
+        document["updated"] = encode_datetime(document["updated"])
+    for field in ("dependencies", "variables"):
+        if field in document:
+            document[field] = list(document[field])
+    return document
+
+
+class Storage(ABC):
+    """Device data and template store.
+
+    Backends store the device data records (keyed by serial number) and
+    templates (keyed by name), and notify registered listeners of changes
+    made through them.  All methods are blocking; call them from the
+    database executor (`ztp.executor.run_sync`), not the event loop.
+    """
+
+    #: The backend name (the `STORAGE_BACKEND` setting)
+    name = None
+
+    #: Whether other processes can change the stored data
+    shared = True
+
+    def __init__(self):
+        self._device_data_listeners: List[DeviceDataListener] = []
+        self._template_listeners: List[TemplateListener] = []
+
+    # Device data
+    @abstractmethod
+    def get_device_data(self, serial_number: str) \
+            -> Optional[DeviceDataRecord]:
+        """Get a device data record, by serial number."""
+
+    @abstractmethod
+    def find_device_data(self, after: Optional[str] = None,
+                         limit: Optional[int] = None) \
+            -> Iterator[DeviceDataRecord]:
+        """Find device data records, ordered by serial number.
+
+        Args:
+            after: Only find the records whose serial number sorts after
+                this value.
+            limit: The maximum number of records to find.
+        """
+
+    @abstractmethod
+    def select_device_data(self, serial_numbers: Optional[List[str]] = None,
+                           template_name: Optional[str] = None) \
+            -> Iterator[DeviceDataRecord]:
+        """Select device data records, ordered by template and serial number.
+
+        Args:
+            serial_numbers: Only select these devices.
+            template_name: Only select the devices that use this template.
+        """
+
+    @abstractmethod
+    def create_device_data(self, record: DeviceDataRecord) \
+            -> DeviceDataRecord:
+        """Add a new device data record.
+
+        Raises:
+            NotUniqueError: A record exists for the serial number.
+        """
+
+    @abstractmethod
+    def update_device_data(self, serial_number: str, changes: dict) \
+            -> DeviceDataRecord:
+        """Update the fields of a device data record.
+
+        Raises:
+            DoesNotExist: There is no record for the serial number.
+            ValidationError: The updated record is not valid.
+        """
+
+    @abstractmethod
+    def delete_device_data(self, serial_number: str) -> bool:
+        """Delete a device data record; returns False if it did not exist."""
+
+    @abstractmethod
+    def replace_device_data(self, records: Iterable[DeviceDataRecord]) \
+            -> List[DeviceDataRecord]:
+        """Atomically replace all device data records (bulk load).
+
+        Returns:
+            The stored records, in the order they were given.
+
+        Raises:
+            NotUniqueError: The records contain duplicate serial numbers;
+                the existing records are left unchanged.
+        """
+
+    def sync_device_data(self, upserts: Iterable[DeviceDataRecord],
+                         deletes: Iterable[str] = ()) -> List[SyncOutcome]:
+        """Upsert and delete device data records, writing only the changes.
+
+        The content hash of each upserted record (its template name and
+        config data) is compared with the stored record's hash; only new and
+        changed records, and deletes of existing records, are written.  The
+        writes are not atomic: a record that cannot be written fails on its
+        own, without affecting the others.
+
+        Args:
+            upserts: The records to create or update.
+            deletes: The serial numbers of the records to delete.
+
+        Returns:
+            The outcome for each upserted record and then each deleted serial
+            number, in the order given.  A serial number that appears more
+            than once in the request fails every time it appears.
+        """
+        updated = utcnow()
+        upserts = [
+            make_device_data(*record[:3], updated=updated)
+            for record in upserts
+        ]
+        deletes = list(deletes)
+        counts = Counter(record.serial_number for record in upserts)
+        counts.update(deletes)
+
+        stored = self._device_data_hashes(list(counts))
+
+        outcomes = []
+        changes = []
+        removals = []
+        duplicate = "The serial number appears more than once in the request."
+        for record in upserts:
+            serial_number = record.serial_number
+            sha256 = device_data_sha256(
+                record.template_name, record.config_data,
+            )
+            if counts[serial_number] > 1:
+                outcomes.append(SyncOutcome(serial_number, FAILED, duplicate))
+            elif serial_number not in stored:
+                outcomes.append(SyncOutcome(serial_number, CREATED))
+                changes.append((record, sha256))
+            elif stored[serial_number] != sha256:
+                outcomes.append(SyncOutcome(serial_number, UPDATED))
+                changes.append((record, sha256))
+            else:
+                outcomes.append(SyncOutcome(serial_number, UNCHANGED))
+
+        for serial_number in deletes:
+            if counts[serial_number] > 1:
+                outcomes.append(SyncOutcome(serial_number, FAILED, duplicate))
+            elif serial_number not in stored:
+                outcomes.append(SyncOutcome(serial_number, NOT_FOUND))
+            else:
+                outcomes.append(SyncOutcome(serial_number, DELETED))
+                removals.append(serial_number)
+
+        errors = {}
+        if changes or removals:
+            errors = self._write_device_data_changes(changes, removals)
+
+        for record, _ in changes:
+            if record.serial_number not in errors:
+                self._device_data_changed(record.serial_number, record)
+        for serial_number in removals:
+            if serial_number not in errors:
+                self._device_data_changed(serial_number, None)
+
+        return [
+            SyncOutcome(outcome.serial_number, FAILED,
+                        errors[outcome.serial_number])
+            if outcome.serial_number in errors else outcome
+            for outcome in outcomes
+        ]
+
+    @abstractmethod
+    def _device_data_hashes(self, serial_numbers: List[str]) \
+            -> Dict[str, Optional[str]]:
+        """Get the stored content hashes of device data records.
+
+        Returns:
+            The content hash of each stored record, by serial number (None
+            for a record stored without a hash).  Serial numbers without a
+            stored record are omitted.
+        """
+
+    @abstractmethod
+    def _write_device_data_changes(
+            self, changes: List[Tuple[DeviceDataRecord, str]],
+            removals: List[str]) -> Dict[str, str]:
+        """Write the changes of a device data sync (unordered).
+
+        Args:
+            changes: The records to upsert, with their content hashes.
+            removals: The serial numbers of the records to delete.
+
+        Returns:
+            An error message for each serial number that was not written.
+        """
+
+    # Templates
+    @abstractmethod
+    def get_template(self, name: str) -> Optional[TemplateRecord]:
+        """Get a template, by name."""
+
+    @abstractmethod
+    def get_templates(self, names: Iterable[str]) -> List[TemplateRecord]:
+        """Get the templates (that exist) with the given names."""
+
+    @abstractmethod
+    def find_templates(self, after: Optional[str] = None,
+                       limit: Optional[int] = None) \
+            -> Iterator[TemplateRecord]:
+        """Find templates, ordered by name."""
+
+    @abstractmethod
+    def list_template_versions(self) \
+            -> Iterator[Tuple[str, str, Tuple[str, ...]]]:
+        """List the (name, sha256, dependencies) of all templates."""
+
+    @abstractmethod
+    def save_template(self, name: str, text: str) -> TemplateRecord:
+        """Create or update a template, by name."""
+
+    @abstractmethod
+    def delete_template(self, name: str) -> bool:
+        """Delete a template; returns False if it did not exist."""
+
+    def watch_templates(self, on_open: Callable[[], None],
+                        on_change: TemplateListener):
+        """Watch for template changes made by other processes (blocking).
+
+        Calls `on_open` once the watch is established and `on_change` for
+        each changed (or deleted, with a None record) template.
+
+        Raises:
+            NotImplementedError: The backend cannot watch for changes; poll
+                `list_template_versions` instead.
+        """
+        raise NotImplementedError(
+            f"The {self.name} storage backend cannot watch for changes."
+        )
+
+    # Change notifications
+    def add_device_data_listener(self, listener: DeviceDataListener):
+        """Register a function called when device data changes.
+
+        The listener is called with the serial number and the new record (or
+        None when the record was deleted).  After a bulk replace, it is
+        called once with (None, None).
+        """
+        self._device_data_listeners.append(listener)
+
+    def add_template_listener(self, listener: TemplateListener):
+        """Register a function called when a template changes.
+
+        The listener is called with the template name and the new record (or
+        None when the template was deleted).
+        """
+        self._template_listeners.append(listener)
+
+    def _device_data_changed(self, serial_number: Optional[str],
+                             record: Optional[DeviceDataRecord]):
+        """Notify the device data listeners of a change."""
+        for listener in self._device_data_listeners:
+            try:
+                listener(serial_number, record)
+            except Exception:
+                logger.exception(
+                    f"Device data listener {listener!r} failed."
+                )
+
+    def _template_changed(self, name: str, record: Optional[TemplateRecord]):
+        """Notify the template listeners of a change."""
+        for listener in self._template_listeners:
+            try:
+                listener(name, record)
+            except Exception:
+                logger.exception(f"Template listener {listener!r} failed.")
@@ -0,0 +1,251 @@
+"""In-memory storage backend.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from bisect import bisect_right, insort
+import copy
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ztp.storage.base import (
+    DeviceDataRecord, DoesNotExist, NotUniqueError, Storage, TemplateRecord,
+    make_device_data, make_template, utcnow,
+)
+from ztp.utils import device_data_sha256
+
+
+class _SortedIndex(object):
+    """Dictionary of records with keys kept in sorted order."""
+
+    def __init__(self):
+        self.records = {}
+        self.keys = []
+
+    def put(self, key: str, record):
+        if key not in self.records:
+            insort(self.keys, key)
+        self.records[key] = record
+
+    def pop(self, key: str):
+        record = self.records.pop(key, None)
+        if record is not None:
+            self.keys.pop(bisect_right(self.keys, key) - 1)
+        return record
+
+    def page(self, after: Optional[str], limit: Optional[int]) -> List:
+        start = bisect_right(self.keys, after) if after is not None else 0
+        stop = start + limit if limit is not None else None
+        return [self.records[key] for key in self.keys[start:stop]]
+
+
+class MemoryStorage(Storage):
+    """Store device data and templates in process memory.
+
+    Nothing is persisted and nothing is shared with other processes; meant
+    for single-process deployments that are loaded through the API, and for
+    hermetic tests and benchmarks.  Records are copied on the way in, so
+    callers cannot change the stored data by mutating the records they pass
+    in; the records returned are the stored records and must be treated as
+    read-only.
+    """
+
+    name = "memory"
+    shared = False
+
+    def __init__(self):
+        """Initialize a new, empty in-memory store."""
+        super().__init__()
+        self._lock = threading.RLock()
+        self._device_data = _SortedIndex()
+        self._templates = _SortedIndex()
+
+    # Device data
+    def get_device_data(self, serial_number: str) \
+            -> Optional[DeviceDataRecord]:
+        with self._lock:
+            return self._device_data.records.get(serial_number)
+
+    def find_device_data(self, after: Optional[str] = None,
+                         limit: Optional[int] = None) \
+            -> Iterator[DeviceDataRecord]:
+        with self._lock:
+            return iter(self._device_data.page(after, limit))
+
+    def select_device_data(self, serial_numbers: Optional[List[str]] = None,
+                           template_name: Optional[str] = None) \
+            -> Iterator[DeviceDataRecord]:
+        with self._lock:
+            if serial_numbers is not None:
+                records = [
+                    self._device_data.records[serial_number]
+                    for serial_number in set(serial_numbers)
+                    if serial_number in self._device_data.records
+                ]
+            else:
+                records = list(self._device_data.records.values())
+        if template_name is not None:
+            records = [
+                record for record in records
+                if record.template_name == template_name
+            ]
+        records.sort(key=lambda record: (
+            record.template_name, record.serial_number,
+        ))
+        return iter(records)
+
+    def create_device_data(self, record: DeviceDataRecord) \
+            -> DeviceDataRecord:
+        record = make_device_data(*record[:3], updated=utcnow())
+        with self._lock:
+            if record.serial_number in self._device_data.records:
+                raise NotUniqueError(
+                    f"Device data exists for {record.serial_number}."
+                )
+            self._device_data.put(record.serial_number, _copy(record))
+        self._device_data_changed(record.serial_number, record)
+        return record
+
+    def update_device_data(self, serial_number: str, changes: dict) \
+            -> DeviceDataRecord:
+        with self._lock:
+            record = self._device_data.records.get(serial_number)
+            if record is None:
+                raise DoesNotExist(f"No device data for {serial_number}.")
+            fields = record._asdict()
+            fields.update(changes, updated=utcnow())
+            new_record = make_device_data(**fields)
+            if new_record.serial_number != serial_number:
+                if new_record.serial_number in self._device_data.records:
+                    raise NotUniqueError(
+                        f"Device data exists for {new_record.serial_number}."
+                    )
+                self._device_data.pop(serial_number)
+            self._device_data.put(new_record.serial_number, _copy(new_record))
+        if new_record.serial_number != serial_number:
+            self._device_data_changed(serial_number, None)
+        self._device_data_changed(new_record.serial_number, new_record)
+        return new_record
+
+    def delete_device_data(self, serial_number: str) -> bool:
+        with self._lock:
+            record = self._device_data.pop(serial_number)
+        if record is None:
+            return False
+        self._device_data_changed(serial_number, None)
+        return True
+
+    def replace_device_data(self, records: Iterable[DeviceDataRecord]) \
+            -> List[DeviceDataRecord]:
+        updated = utcnow()
+        index = _SortedIndex()
+        stored = []
+        duplicates = []
+        for position, record in enumerate(records):
+            record = make_device_data(*record[:3], updated=updated)
+            if record.serial_number in index.records:
+                duplicates.append({
+                    "index": position,
+                    "errmsg": f"duplicate serial number "
+                              f"{record.serial_number}",
+                })
+            record = _copy(record)
+            index.put(record.serial_number, record)
+            stored.append(record)
+
+        if duplicates:
+            raise NotUniqueError(
+                "The records contain duplicate serial numbers.", duplicates,
+            )
+
+        with self._lock:
+            self._device_data = index
+        self._device_data_changed(None, None)
+        return stored
+
+    def _device_data_hashes(self, serial_numbers: List[str]) \
+            -> Dict[str, Optional[str]]:
+        with self._lock:
+            records = [
+                self._device_data.records[serial_number]
+                for serial_number in serial_numbers
+                if serial_number in self._device_data.records
+            ]
+        return {
+            record.serial_number: device_data_sha256(
+                record.template_name, record.config_data,
+            )
+            for record in records
+        }
+
+    def _write_device_data_changes(
+            self, changes: List[Tuple[DeviceDataRecord, str]],
+            removals: List[str]) -> Dict[str, str]:
+        with self._lock:
+            for record, _ in changes:
+                self._device_data.put(record.serial_number, _copy(record))
+            for serial_number in removals:
+                self._device_data.pop(serial_number)
+        return {}
+
+    # Templates
+    def get_template(self, name: str) -> Optional[TemplateRecord]:
+        with self._lock:
+            return self._templates.records.get(name)
+
+    def get_templates(self, names: Iterable[str]) -> List[TemplateRecord]:
+        with self._lock:
+            return [
+                self._templates.records[name] for name in set(names)
+                if name in self._templates.records
+            ]
+
+    def find_templates(self, after: Optional[str] = None,
+                       limit: Optional[int] = None) \
+            -> Iterator[TemplateRecord]:
+        with self._lock:
+            return iter(self._templates.page(after, limit))
+
+    def list_template_versions(self) \
+            -> Iterator[Tuple[str, str, Tuple[str, ...]]]:
+        with self._lock:
+            records = list(self._templates.records.values())
+        return (
+            (record.name, record.sha256, record.dependencies)
+            for record in records
+        )
+
+    def save_template(self, name: str, text: str) -> TemplateRecord:
+        record = make_template(name, text, updated=utcnow())
+        with self._lock:
+            self._templates.put(name, record)
+        self._template_changed(name, record)
+        return record
+
+    def delete_template(self, name: str) -> bool:
+        with self._lock:
+            record = self._templates.pop(name)
+        if record is None:
+            return False
+        self._template_changed(name, None)
+        return True
+
+
+def _copy(record: Optional[DeviceDataRecord]) -> Optional[DeviceDataRecord]:
+    """Copy a device data record (its config data is mutable)."""
+    if record is None:
+        return None
+    return record._replace(config_data=copy.deepcopy(record.config_data))
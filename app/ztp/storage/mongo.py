@@ -0,0 +1,382 @@
+"""MongoDB storage backend.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import logging
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, Optional, Tuple,
+)
+
+import mongoengine
+from mongoengine import signals
+from pymongo import DeleteOne, UpdateOne
+import pymongo.errors
+
+from ztp.config import BULK_WRITE_BATCH_SIZE
+from ztp.mongo import raw
+from ztp.mongo.bulk import replace_collection
+from ztp.mongo.models.device_data import DeviceData
+from ztp.mongo.models.template import Template
+from ztp.storage.base import (
+    DeviceDataRecord, DoesNotExist, NotUniqueError, Storage, TemplateListener,
+    TemplateRecord, ValidationError, make_device_data,
+)
+from ztp.utils import batched, device_data_sha256
+
+
+logger = logging.getLogger(__name__)
+
+
+def _device_data_record(document: dict) -> DeviceDataRecord:
+    """Create a device data record from a raw (projected) document."""
+    return DeviceDataRecord(*(
+        document.get(field, default)
+        for field, default in raw.DEVICE_DATA_FIELDS
+    ))
+
+
+def _template_record(document: dict) -> TemplateRecord:
+    """Create a template record from a raw (projected) document."""
+    record = TemplateRecord(*(
+        document.get(field, default)
+        for field, default in raw.TEMPLATE_FIELDS
+    ))
+    return record._replace(
+        dependencies=tuple(record.dependencies or ()),
+        variables=tuple(record.variables or ()),
+    )
+
+
+class MongoStorage(Storage):
+    """Store device data and templates in MongoDB.
+
+    Reads use the raw pymongo path (`ztp.mongo.raw`); single-record writes
+    go through the mongoengine models, so the model signals (and listeners
+    registered with this backend) see every change, including changes made
+    directly through the models.  The bulk writes (replace and sync) bypass
+    the models and notify the listeners themselves.
+    """
+
+    name = "mongo"
+    shared = True
+
+    def __init__(self):
+        """Initialize the MongoDB backend and connect the model signals."""
+        super().__init__()
+        signals.post_save.connect(self._device_data_saved, sender=DeviceData)
+        signals.post_delete.connect(
+            self._device_data_deleted, sender=DeviceData,
+        )
+        signals.post_save.connect(self._template_saved, sender=Template)
+        signals.post_delete.connect(self._template_deleted, sender=Template)
+
+    # Device data
+    def get_device_data(self, serial_number: str) \
+            -> Optional[DeviceDataRecord]:
+        document = raw.device_data_collection.find_one(
+            {"serial_number": serial_number},
+            projection=raw.projection(raw.DEVICE_DATA_FIELDS),
+        )
+        return _device_data_record(document) if document else None
+
+    def find_device_data(self, after: Optional[str] = None,
+                         limit: Optional[int] = None) \
+            -> Iterator[DeviceDataRecord]:
+        return map(_device_data_record, raw.find_documents(
+            raw.device_data_collection, raw.DEVICE_DATA_FIELDS,
+            "serial_number", after=after, limit=limit,
+        ))
+
+    def select_device_data(self, serial_numbers: Optional[List[str]] = None,
+                           template_name: Optional[str] = None) \
+            -> Iterator[DeviceDataRecord]:
+        query = {}
+        if serial_numbers is not None:
+            query["serial_number"] = {"$in": list(serial_numbers)}
+        if template_name is not None:
+            query["template_name"] = template_name
+        return map(_device_data_record, raw.device_data_collection.find(
+            query,
+            projection=raw.projection(raw.DEVICE_DATA_FIELDS),
+            sort=[
+                ("template_name", pymongo.ASCENDING),
+                ("serial_number", pymongo.ASCENDING),
+            ],
+        ))
+
+    def create_device_data(self, record: DeviceDataRecord) \
+            -> DeviceDataRecord:
+        record = make_device_data(*record[:3])
+        document = DeviceData(
+            serial_number=record.serial_number,
+            template_name=record.template_name,
+            config_data=record.config_data,
+        )
+        try:
+            document.save()
+        except mongoengine.NotUniqueError as error:
+            raise NotUniqueError(str(error))
+        except mongoengine.ValidationError as error:
+            raise ValidationError(str(error))
+        return _document_record(document)
+
+    def update_device_data(self, serial_number: str, changes: dict) \
+            -> DeviceDataRecord:
+        unknown = set(changes) - set(DeviceDataRecord._fields)
+        if unknown:
+            raise ValidationError(
+                f"Unknown device data fields: {', '.join(sorted(unknown))}."
+            )
+
+        document = DeviceData.objects(serial_number=serial_number).first()
+        if document is None:
+            raise DoesNotExist(f"No device data for {serial_number}.")
+
+        fields = _document_record(document)._asdict()
+        fields.update(changes)
+        record = make_device_data(**fields)
+        document.serial_number = record.serial_number
+        document.template_name = record.template_name
+        document.config_data = record.config_data
+        try:
+            document.save()
+        except mongoengine.NotUniqueError as error:
+            raise NotUniqueError(str(error))
+        except mongoengine.ValidationError as error:
+            raise ValidationError(str(error))
+        return _document_record(document)
+
+    def delete_device_data(self, serial_number: str) -> bool:
+        document = DeviceData.objects(serial_number=serial_number).first()
+        if document is None:
+            return False
+        document.delete()
+        return True
+
+    def replace_device_data(self, records: Iterable[DeviceDataRecord]) \
+            -> List[DeviceDataRecord]:
+        documents = [
+            DeviceData(
+                serial_number=record.serial_number,
+                template_name=record.template_name,
+                config_data=record.config_data,
+                sha256=device_data_sha256(
+                    record.template_name, record.config_data,
+                ),
+            )
+            for record in map(
+                lambda record: make_device_data(*record[:3]), records,
+            )
+        ]
+        try:
+            replace_collection(DeviceData, documents)
+        except pymongo.errors.BulkWriteError as error:
+            raise NotUniqueError(
+                "The records violate a unique constraint (duplicate serial "
+                "numbers?).",
+                error.details.get("writeErrors", [])[:10],
+            )
+        self._device_data_changed(None, None)
+        return [_document_record(document) for document in documents]
+
+    def _device_data_hashes(self, serial_numbers: List[str]) \
+            -> Dict[str, Optional[str]]:
+        hashes = {}
+        for batch in batched(serial_numbers, BULK_WRITE_BATCH_SIZE):
+            for document in raw.device_data_collection.find(
+                {"serial_number": {"$in": batch}},
+                projection={"serial_number": True, "sha256": True,
+                            "_id": False},
+            ):
+                hashes[document["serial_number"]] = document.get("sha256")
+        return hashes
+
+    def _write_device_data_changes(
+            self, changes: List[Tuple[DeviceDataRecord, str]],
+            removals: List[str]) -> Dict[str, str]:
+        # One unordered bulk write; the model signals are not sent, so the
+        # listeners are notified by `sync_device_data`.
+        operations = [
+            UpdateOne(
+                {"serial_number": record.serial_number},
+                {"$set": {
+                    "template_name": record.template_name,
+                    "config_data": record.config_data,
+                    "updated": record.updated,
+                    "sha256": sha256,
+                }},
+                upsert=True,
+            )
+            for record, sha256 in changes
+        ] + [
+            DeleteOne({"serial_number": serial_number})
+            for serial_number in removals
+        ]
+        serial_numbers = [record.serial_number for record, _ in changes] \
+            + removals
+        try:
+            raw.device_data_collection.bulk_write(operations, ordered=False)
+        except pymongo.errors.BulkWriteError as error:
+            return {
+                serial_numbers[write_error["index"]]: write_error["errmsg"]
+                for write_error in error.details.get("writeErrors", [])
+            }
+        return {}
+
+    # Templates
+    def get_template(self, name: str) -> Optional[TemplateRecord]:
+        document = raw.templates_collection.find_one(
+            {"name": name}, projection=raw.projection(raw.TEMPLATE_FIELDS),
+        )
+        return _template_record(document) if document else None
+
+    def get_templates(self, names: Iterable[str]) -> List[TemplateRecord]:
+        return [
+            _template_record(document)
+            for document in raw.templates_collection.find(
+                {"name": {"$in": list(names)}},
+                projection=raw.projection(raw.TEMPLATE_FIELDS),
+            )
+        ]
+
+    def find_templates(self, after: Optional[str] = None,
+                       limit: Optional[int] = None) \
+            -> Iterator[TemplateRecord]:
+        return map(_template_record, raw.find_documents(
+            raw.templates_collection, raw.TEMPLATE_FIELDS, "name",
+            after=after, limit=limit,
+        ))
+
+    def list_template_versions(self) \
+            -> Iterator[Tuple[str, str, Tuple[str, ...]]]:
+        cursor = raw.templates_collection.find(
+            {}, {"name": True, "sha256": True, "dependencies": True},
+        )
+        return (
+            (
+                document["name"],
+                document.get("sha256"),
+                tuple(document.get("dependencies") or ()),
+            )
+            for document in cursor
+        )
+
+    def save_template(self, name: str, text: str) -> TemplateRecord:
+        document = Template.objects(name=name).first() or Template(name=name)
+        document.template = text
+        try:
+            document.save()
+        except mongoengine.ValidationError as error:
+            raise ValidationError(str(error))
+        return _template_document_record(document)
+
+    def delete_template(self, name: str) -> bool:
+        document = Template.objects(name=name).first()
+        if document is None:
+            return False
+        document.delete()
+        return True
+
+    def watch_templates(self, on_open: Callable[[], None],
+                        on_change: TemplateListener):
+        """Watch the templates collection with a MongoDB change stream.
+
+        Raises:
+            NotImplementedError: Change streams are not available (MongoDB
+                is not running as a replica set or sharded cluster).
+        """
+        collection = raw.templates_collection
+        pipeline = [{"$project": {
+            "operationType": True,
+            "documentKey": True,
+            "fullDocument.name": True,
+            "fullDocument.template": True,
+            "fullDocument.sha256": True,
+            "fullDocument.dependencies": True,
+            "fullDocument.variables": True,
+            "fullDocument.updated": True,
+        }}]
+
+        try:
+            stream = collection.watch(pipeline, full_document="updateLookup")
+        except pymongo.errors.OperationFailure as error:
+            raise NotImplementedError(
+                f"MongoDB change streams are not available ({error})."
+            )
+
+        with stream:
+            # Deletes report only the document ObjectId
+            names = {
+                document["_id"]: document["name"]
+                for document in collection.find({}, {"name": True})
+            }
+            on_open()
+
+            for change in stream:
+                operation = change["operationType"]
+                object_id = change.get("documentKey", {}).get("_id")
+                document = change.get("fullDocument")
+
+                if operation in ("insert", "replace", "update") and document:
+                    names[object_id] = document["name"]
+                    on_change(document["name"], _template_record(document))
+                elif operation == "delete":
+                    name = names.pop(object_id, None)
+                    if name is not None:
+                        on_change(name, None)
+                elif operation in ("drop", "rename", "dropDatabase",
+                                   "invalidate"):
+                    return
+
+    # Model signals
+    def _device_data_saved(self, sender, document: DeviceData, **kwargs):
+        self._device_data_changed(
+            document.serial_number, _document_record(document),
+        )
+
+    def _device_data_deleted(self, sender, document: DeviceData, **kwargs):
+        self._device_data_changed(document.serial_number, None)
+
+    def _template_saved(self, sender, document: Template, **kwargs):
+        self._template_changed(
+            document.name, _template_document_record(document),
+        )
+
+    def _template_deleted(self, sender, document: Template, **kwargs):
+        self._template_changed(document.name, None)
+
+
+def _document_record(document: DeviceData) -> DeviceDataRecord:
+    """Create a device data record from a DeviceData document."""
+    return DeviceDataRecord(
+        document.serial_number,
+        document.template_name,
+        document.config_data,
+        document.updated,
+    )
+
+
+def _template_document_record(document: Template) -> TemplateRecord:
+    """Create a template record from a Template document."""
+    return TemplateRecord(
+        document.name,
+        document.template,
+        document.sha256,
+        tuple(document.dependencies or ()),
+        tuple(document.variables or ()),
+        document.updated,
+    )
@@ -0,0 +1,424 @@
+"""SQLite storage backend.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from datetime import datetime
+import json
+import sqlite3
+import threading
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, Optional, Tuple,
+)
+
+from ztp.storage.base import (
+    DeviceDataRecord, DoesNotExist, NotUniqueError, Storage, TemplateRecord,
+    make_device_data, make_template, utcnow,
+)
+from ztp.utils import batched, device_data_sha256
+
+
+_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# Serial-number lists are sent in chunks below SQLite's variable limit
+_MAX_VARIABLES = 500
+
+# Rows read per query by the (keyset-paginated) record iterators
+_PAGE_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS device_data (
+    serial_number TEXT PRIMARY KEY,
+    template_name TEXT NOT NULL,
+    config_data TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS device_data_template_name
+    ON device_data (template_name, serial_number);
+CREATE TABLE IF NOT EXISTS templates (
+    name TEXT PRIMARY KEY,
+    template TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    dependencies TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    variables TEXT NOT NULL DEFAULT '[]'
+);
+"""
+
+# Columns added since the first schema: (table, column, definition)
+_MIGRATIONS = (
+    ("templates", "variables", "TEXT NOT NULL DEFAULT '[]'"),
+)
+
+_DEVICE_DATA_COLUMNS = "serial_number, template_name, config_data, updated"
+_DEVICE_DATA_WRITE_COLUMNS = f"{_DEVICE_DATA_COLUMNS}, sha256"
+_TEMPLATE_COLUMNS = "name, template, sha256, dependencies, variables, updated"
+
+
+def _encode_datetime(value: datetime) -> str:
+    return value.strftime(_DATETIME_FORMAT)
+
+
+def _decode_datetime(value: str) -> datetime:
+    return datetime.strptime(value, _DATETIME_FORMAT)
+
+
+def _device_data_row(record: DeviceDataRecord,
+                     sha256: Optional[str] = None) -> tuple:
+    """Create a device data row (`_DEVICE_DATA_WRITE_COLUMNS`)."""
+    return (
+        record.serial_number,
+        record.template_name,
+        json.dumps(record.config_data),
+        _encode_datetime(record.updated),
+        sha256 or device_data_sha256(
+            record.template_name, record.config_data,
+        ),
+    )
+
+
+def _device_data_record(row: tuple) -> DeviceDataRecord:
+    serial_number, template_name, config_data, updated = row
+    return DeviceDataRecord(
+        serial_number, template_name, json.loads(config_data),
+        _decode_datetime(updated),
+    )
+
+
+def _template_record(row: tuple) -> TemplateRecord:
+    name, template, sha256, dependencies, variables, updated = row
+    return TemplateRecord(
+        name, template, sha256, tuple(json.loads(dependencies)),
+        tuple(json.loads(variables)), _decode_datetime(updated),
+    )
+
+
+def _paginate(query: Callable[[Optional[tuple], int], List[tuple]],
+              limit: Optional[int] = None) -> Iterator[tuple]:
+    """Iterate over the rows of a keyset-paginated query.
+
+    Args:
+        query: Function that reads (at most) `size` rows following the last
+            row read (None for the first page).
+        limit: The maximum number of rows to read.
+    """
+    last_row = None
+    while limit is None or limit > 0:
+        size = _PAGE_SIZE if limit is None else min(_PAGE_SIZE, limit)
+        rows = query(last_row, size)
+        yield from rows
+        if len(rows) < size:
+            return
+        last_row = rows[-1]
+        if limit is not None:
+            limit -= len(rows)
+
+
+class SQLiteStorage(Storage):
+    """Store device data and templates in an embedded SQLite database.
+
+    Each thread uses its own connection.  The record iterators read the
+    rows in keyset-paginated queries on the connection of the thread that
+    advances them, so they can be consumed from any executor thread.  The
+    database runs in WAL mode, so readers are not blocked by a writer, and
+    can be shared by the worker processes of a multi-process server
+    (template changes made by another process are picked up by polling).
+    """
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        """Open (and create, if needed) a SQLite database.
+
+        Args:
+            path: The database file path.
+            timeout: Seconds to wait for a lock held by another connection.
+        """
+        super().__init__()
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+            for table, column, definition in _MIGRATIONS:
+                columns = {
+                    row[1] for row in connection.execute(
+                        f"PRAGMA table_info({table})"
+                    )
+                }
+                if column not in columns:
+                    connection.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+                    )
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's database connection."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    # Device data
+    def get_device_data(self, serial_number: str) \
+            -> Optional[DeviceDataRecord]:
+        row = self._connection().execute(
+            f"SELECT {_DEVICE_DATA_COLUMNS} FROM device_data "
+            f"WHERE serial_number = ?",
+            (serial_number,),
+        ).fetchone()
+        return _device_data_record(row) if row else None
+
+    def find_device_data(self, after: Optional[str] = None,
+                         limit: Optional[int] = None) \
+            -> Iterator[DeviceDataRecord]:
+        def query(last_row: Optional[tuple], size: int) -> List[tuple]:
+            key = last_row[0] if last_row else after
+            return self._connection().execute(
+                f"SELECT {_DEVICE_DATA_COLUMNS} FROM device_data "
+                f"WHERE serial_number > ? ORDER BY serial_number LIMIT ?",
+                ("" if key is None else key, size),
+            ).fetchall()
+
+        return map(_device_data_record, _paginate(query, limit))
+
+    def select_device_data(self, serial_numbers: Optional[List[str]] = None,
+                           template_name: Optional[str] = None) \
+            -> Iterator[DeviceDataRecord]:
+        if serial_numbers is None:
+            def query(last_row: Optional[tuple], size: int) -> List[tuple]:
+                conditions, parameters = [], []
+                if template_name is not None:
+                    conditions.append("template_name = ?")
+                    parameters.append(template_name)
+                if last_row is not None:
+                    conditions.append(
+                        "(template_name > ? OR "
+                        "(template_name = ? AND serial_number > ?))"
+                    )
+                    parameters += [last_row[1], last_row[1], last_row[0]]
+                where = f"WHERE {' AND '.join(conditions)} " \
+                    if conditions else ""
+                return self._connection().execute(
+                    f"SELECT {_DEVICE_DATA_COLUMNS} FROM device_data {where}"
+                    f"ORDER BY template_name, serial_number LIMIT ?",
+                    parameters + [size],
+                ).fetchall()
+
+            return map(_device_data_record, _paginate(query))
+
+        connection = self._connection()
+        rows = []
+        for chunk in batched(set(serial_numbers), _MAX_VARIABLES):
+            placeholders = ", ".join("?" * len(chunk))
+            rows.extend(connection.execute(
+                f"SELECT {_DEVICE_DATA_COLUMNS} FROM device_data "
+                f"WHERE serial_number IN ({placeholders})",
+                chunk,
+            ))
+        records = [
+            _device_data_record(row) for row in rows
+            if template_name is None or row[1] == template_name
+        ]
+        records.sort(key=lambda record: (
+            record.template_name, record.serial_number,
+        ))
+        return iter(records)
+
+    def create_device_data(self, record: DeviceDataRecord) \
+            -> DeviceDataRecord:
+        record = make_device_data(*record[:3], updated=utcnow())
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    f"INSERT INTO device_data ({_DEVICE_DATA_WRITE_COLUMNS}) "
+                    f"VALUES (?, ?, ?, ?, ?)",
+                    _device_data_row(record),
+                )
+        except sqlite3.IntegrityError as error:
+            raise NotUniqueError(str(error))
+        self._device_data_changed(record.serial_number, record)
+        return record
+
+    def update_device_data(self, serial_number: str, changes: dict) \
+            -> DeviceDataRecord:
+        with self._connection() as connection:
+            row = connection.execute(
+                f"SELECT {_DEVICE_DATA_COLUMNS} FROM device_data "
+                f"WHERE serial_number = ?",
+                (serial_number,),
+            ).fetchone()
+            if row is None:
+                raise DoesNotExist(f"No device data for {serial_number}.")
+            fields = _device_data_record(row)._asdict()
+            fields.update(changes, updated=utcnow())
+            record = make_device_data(**fields)
+            try:
+                connection.execute(
+                    "UPDATE device_data SET serial_number = ?, "
+                    "template_name = ?, config_data = ?, updated = ?, "
+                    "sha256 = ? WHERE serial_number = ?",
+                    _device_data_row(record) + (serial_number,),
+                )
+            except sqlite3.IntegrityError as error:
+                raise NotUniqueError(str(error))
+        if record.serial_number != serial_number:
+            self._device_data_changed(serial_number, None)
+        self._device_data_changed(record.serial_number, record)
+        return record
+
+    def delete_device_data(self, serial_number: str) -> bool:
+        with self._connection() as connection:
+            deleted = connection.execute(
+                "DELETE FROM device_data WHERE serial_number = ?",
+                (serial_number,),
+            ).rowcount
+        if deleted:
+            self._device_data_changed(serial_number, None)
+        return bool(deleted)
+
+    def replace_device_data(self, records: Iterable[DeviceDataRecord]) \
+            -> List[DeviceDataRecord]:
+        updated = utcnow()
+        stored = []
+        try:
+            with self._connection() as connection:
+                connection.execute("DELETE FROM device_data")
+                for batch in batched(records, _MAX_VARIABLES):
+                    batch = [
+                        make_device_data(*record[:3], updated=updated)
+                        for record in batch
+                    ]
+                    connection.executemany(
+                        f"INSERT INTO device_data "
+                        f"({_DEVICE_DATA_WRITE_COLUMNS}) "
+                        f"VALUES (?, ?, ?, ?, ?)",
+                        [_device_data_row(record) for record in batch],
+                    )
+                    stored.extend(batch)
+        except sqlite3.IntegrityError as error:
+            raise NotUniqueError(
+                "The records contain duplicate serial numbers.",
+                [{"errmsg": str(error)}],
+            )
+        self._device_data_changed(None, None)
+        return stored
+
+    def _device_data_hashes(self, serial_numbers: List[str]) \
+            -> Dict[str, Optional[str]]:
+        connection = self._connection()
+        hashes = {}
+        for chunk in batched(serial_numbers, _MAX_VARIABLES):
+            placeholders = ", ".join("?" * len(chunk))
+            hashes.update(connection.execute(
+                f"SELECT serial_number, sha256 FROM device_data "
+                f"WHERE serial_number IN ({placeholders})",
+                chunk,
+            ))
+        return hashes
+
+    def _write_device_data_changes(
+            self, changes: List[Tuple[DeviceDataRecord, str]],
+            removals: List[str]) -> Dict[str, str]:
+        with self._connection() as connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO device_data "
+                f"({_DEVICE_DATA_WRITE_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                [
+                    _device_data_row(record, sha256)
+                    for record, sha256 in changes
+                ],
+            )
+            connection.executemany(
+                "DELETE FROM device_data WHERE serial_number = ?",
+                [(serial_number,) for serial_number in removals],
+            )
+        return {}
+
+    # Templates
+    def get_template(self, name: str) -> Optional[TemplateRecord]:
+        row = self._connection().execute(
+            f"SELECT {_TEMPLATE_COLUMNS} FROM templates WHERE name = ?",
+            (name,),
+        ).fetchone()
+        return _template_record(row) if row else None
+
+    def get_templates(self, names: Iterable[str]) -> List[TemplateRecord]:
+        connection = self._connection()
+        records = []
+        for chunk in batched(set(names), _MAX_VARIABLES):
+            placeholders = ", ".join("?" * len(chunk))
+            records.extend(
+                _template_record(row) for row in connection.execute(
+                    f"SELECT {_TEMPLATE_COLUMNS} FROM templates "
+                    f"WHERE name IN ({placeholders})",
+                    chunk,
+                )
+            )
+        return records
+
+    def find_templates(self, after: Optional[str] = None,
+                       limit: Optional[int] = None) \
+            -> Iterator[TemplateRecord]:
+        def query(last_row: Optional[tuple], size: int) -> List[tuple]:
+            key = last_row[0] if last_row else after
+            return self._connection().execute(
+                f"SELECT {_TEMPLATE_COLUMNS} FROM templates "
+                f"WHERE name > ? ORDER BY name LIMIT ?",
+                ("" if key is None else key, size),
+            ).fetchall()
+
+        return map(_template_record, _paginate(query, limit))
+
+    def list_template_versions(self) \
+            -> Iterator[Tuple[str, str, Tuple[str, ...]]]:
+        rows = self._connection().execute(
+            "SELECT name, sha256, dependencies FROM templates"
+        ).fetchall()
+        return (
+            (name, sha256, tuple(json.loads(dependencies)))
+            for name, sha256, dependencies in rows
+        )
+
+    def save_template(self, name: str, text: str) -> TemplateRecord:
+        record = make_template(name, text, updated=utcnow())
+        with self._connection() as connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO templates ({_TEMPLATE_COLUMNS}) "
+                f"VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    record.name, record.template, record.sha256,
+                    json.dumps(record.dependencies),
+                    json.dumps(record.variables),
+                    _encode_datetime(record.updated),
+                ),
+            )
+        self._template_changed(name, record)
+        return record
+
+    def delete_template(self, name: str) -> bool:
+        with self._connection() as connection:
+            deleted = connection.execute(
+                "DELETE FROM templates WHERE name = ?", (name,),
+            ).rowcount
+        if deleted:
+            self._template_changed(name, None)
+        return bool(deleted)
@@ -16,66 +16,224 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
-from typing import Callable, Tuple
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
 
 import jinja2
-import mongoengine
-
-from ztp.mongo.models.template import Template
 
+from ztp.bytecode_cache import bytecode_cache
+from ztp.metrics import template_compile_duration, template_render_duration
+from ztp.singleflight import SingleFlight
+from ztp.storage import TemplateRecord, storage
+from ztp.template_versions import combine_versions, template_versions
+from ztp.tracing import span
+
+
+class StorageLoader(jinja2.BaseLoader):
+    """Load Jinja2 templates from the storage backend.
+
+    Concurrent loads of the same template (e.g. many devices using a template
+    that has just changed) are coalesced: one thread fetches and compiles
+    the template, and the others share the compiled template.
+    """
+
+    def __init__(self):
+        """Initialize a new storage template loader."""
+        # Passes the loaded version from get_source() to load(), and holds
+        # the dependencies fetched along with the last template loaded
+        self._local = threading.local()
+        self._loads = SingleFlight("template_load")
+
+    def load(self, environment: jinja2.Environment, name: str,
+             globals: Optional[dict] = None) -> jinja2.Template:
+        """Load a template and record the version it was loaded from.
+
+        The version of the template closure (the template and the templates
+        it includes, extends, or imports) is stored on the returned template
+        object (as `template.version`), so renders can be tied to the exact
+        template versions that produced them.
+        """
+        def load_template() -> jinja2.Template:
+            template = super(StorageLoader, self).load(
+                environment, name, globals,
+            )
+            template.version = self._local.version
+            return template
 
-class MongoLoader(jinja2.BaseLoader):
-    """Load Jinja2 templates from a MongoDB database."""
+        return self._loads.do(
+            (id(environment), name, id(globals)), load_template,
+        )
 
     def get_source(self, environment: jinja2.Environment, template: str) \
             -> Tuple[str, None, Callable[[], bool]]:
         """Get the template source (text) and reload helper function.
 
-        Retrieve the template source text from MongoDB (querying by template
-        name) and create a reload helper function that determines if the
-        template has changed in MongoDB.
+        Retrieve the template source text from the storage backend (by
+        template name) and create a reload helper function that determines
+        if the template, or any template it depends on, has changed, using
+        the local template-version table.
+
+        The templates a template depends on are fetched in the same query
+        (and in one more query for each level of dependencies not yet in the
+        template-version table) and kept until Jinja2 loads them, so
+        rendering a template with many includes does not cost a storage
+        round trip per include.
 
         The Jinja2 auto-reload feature uses the reload helper function
         to determine when the template needs to be reloaded from source.
 
         Args:
             environment: The rendering environment.
-            template: The name of the template to be loaded from MongoDB.
+            template: The name of the template to be loaded.
         """
-        try:
-            loaded_template = Template.objects.get(name=template)
-
-        except mongoengine.DoesNotExist:
+        with span("loader.get_source", template=template):
+            template_versions.start()
+
+            prefetched = getattr(self._local, "prefetched", {})
+            loaded = prefetched.pop(template, None)
+            current_version = template_versions.closure_version(template)
+            if loaded is None or loaded[1] != current_version:
+                records = self._fetch_closure(template)
+                prefetched = {
+                    name: (record, closure_version(name, records))
+                    for name, record in records.items()
+                }
+                self._local.prefetched = prefetched
+                loaded = prefetched.pop(template)
+
+            loaded_template, loaded_version = loaded
+
+            def reload_helper() -> bool:
+                """Compare versions to determine if the template has changed.
+
+                This helper function captures (as a closure) the version of
+                the template closure when it is loaded. Then, to detect
+                changes, the function looks up the latest closure version in
+                the template-version table (kept current by a background
+                watcher, no database query) and compares the latest version
+                with the captured version and returns the result.
+                """
+                with span("loader.reload_helper", template=template):
+                    latest_version = template_versions.closure_version(
+                        template,
+                    )
+                    return loaded_version == latest_version
+
+            self._local.version = loaded_version
+
+            return loaded_template.template, None, reload_helper
+
+    @staticmethod
+    def _fetch_closure(template: str) -> Dict[str, TemplateRecord]:
+        """Fetch a template and the templates it depends on from storage.
+
+        Raises:
+            jinja2.TemplateNotFound: The template does not exist.
+        """
+        records = {}
+        queried = set()
+        pending = set(template_versions.closure(template))
+        while pending:
+            queried.update(pending)
+            fetched = storage.get_templates(pending)
+            pending = set()
+            for record in fetched:
+                records[record.name] = record
+                template_versions.setdefault(
+                    record.name, record.sha256, record.dependencies,
+                )
+                pending.update(record.dependencies or ())
+            pending -= queried
+
+        if template not in records:
             raise jinja2.TemplateNotFound(template)
 
-        except mongoengine.MultipleObjectsReturned:
-            raise jinja2.TemplateRuntimeError(
-                f"Multiple templates exist with the name '{template}'."
-            )
+        return records
+
 
-        def reload_helper() -> bool:
-            """Compare sha256 hashes to determine if the template has changed.
+def closure_version(name: str, records: Dict[str, TemplateRecord]) -> str:
+    """Get the closure version of a template from its fetched records."""
+    return combine_versions(
+        (record.name, record.sha256)
+        for record in _closure(name, records)
+    )
 
-            This helper function captures (as a closure) the sha256 hash of the
-            template when it is loaded. Then, to detect changes, the function
-            requests the latest hash from MongoDB and compares the latest hash
-            with the captured hash and returns the result.
-            """
-            loaded_template_hash = loaded_template.sha256
-            latest_template_hash = Template.objects.only("sha256").get(
-                name=template,
-            ).sha256
-            return loaded_template_hash == latest_template_hash
 
-        return loaded_template.template, None, reload_helper
+def _closure(name: str, records: Dict[str, TemplateRecord]) \
+        -> Iterable[TemplateRecord]:
+    """Walk a template and its dependencies in the fetched records."""
+    seen = set()
+    pending = [name]
+    while pending:
+        template_name = pending.pop()
+        record = records.get(template_name)
+        if template_name in seen or record is None:
+            continue
+        seen.add(template_name)
+        yield record
+        pending.extend(record.dependencies or ())
+
+
+class Environment(jinja2.Environment):
+    """Jinja2 environment that records template compile times."""
+
+    def compile(self, source, name=None, filename=None, raw=False,
+                defer_init=False):
+        """Compile a template, recording the compile time."""
+        start = time.perf_counter()
+        try:
+            with span("template.compile", template=name or "<string>"):
+                return super().compile(
+                    source, name, filename, raw, defer_init,
+                )
+        finally:
+            template_compile_duration.observe(
+                time.perf_counter() - start, template=name or "<string>",
+            )
 
 
 # Setup the Jinja2 rendering environment
-env = jinja2.Environment(
-    loader=MongoLoader(),
+env = Environment(
+    loader=StorageLoader(),
     auto_reload=True,
+    bytecode_cache=bytecode_cache,
 )
 
 
 # Main function for requesting templates
 get_template = env.get_template
+
+
+def get_template_version(template: jinja2.Template) -> str:
+    """Get the closure version a template was loaded from.
+
+    The version changes when the template, or any template it includes,
+    extends, or imports, changes.
+    """
+    return template.version
+
+
+def render_template(template: jinja2.Template, config_data: dict) -> bytes:
+    """Render a device configuration, recording the render time."""
+    with span("template.render", template=template.name), \
+            template_render_duration.time(template=template.name):
+        return template.render(config_data=config_data).encode("utf-8")
+
+
+def fetch_template_closure(template_name: str) \
+        -> Tuple[str, Dict[str, str]]:
+    """Fetch the texts of a template and the templates it depends on.
+
+    Returns:
+        The closure version of the texts that were read, and the texts by
+        template name.
+
+    Raises:
+        jinja2.TemplateNotFound: The template does not exist.
+    """
+    template_versions.start()
+    records = StorageLoader._fetch_closure(template_name)
+    return closure_version(template_name, records), {
+        name: record.template for name, record in records.items()
+    }
@@ -0,0 +1,261 @@
+"""Local template-version table kept current by a background watcher.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import logging
+from hashlib import sha256 as sha256_hash
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from ztp.config import TEMPLATE_WATCH_POLL_INTERVAL
+from ztp.storage import Storage, TemplateRecord, storage
+
+
+logger = logging.getLogger(__name__)
+
+
+# Callback signature: listener(name, old_sha256, new_sha256)
+VersionListener = Callable[[str, Optional[str], Optional[str]], None]
+
+
+class TemplateVersionTable(object):
+    """Local table of template sha256 hashes and dependencies, by name.
+
+    A single background thread keeps the table current.  It watches the
+    storage backend for template changes when the backend supports it (a
+    MongoDB change stream, on replica sets and sharded clusters) and falls
+    back to periodically polling the template names and hashes otherwise.
+    Writes made by this process are applied immediately via the storage
+    template listener.  Backends that are not shared with other processes
+    (the in-memory store) need no watcher thread.
+
+    The table also holds the template dependency graph (the templates each
+    template includes, extends or imports), so the full dependency closure
+    of a template, its dependents, and a combined version for the closure
+    are available without a database query.
+
+    Looking up a version is a dictionary lookup and never touches the network.
+    """
+
+    def __init__(self, storage: Storage, poll_interval: float):
+        """Initialize a new, empty template-version table.
+
+        Args:
+            storage: The storage backend holding the templates.
+            poll_interval: Seconds between polls when change streams are not
+                available, and between retries after a watcher error.
+        """
+        self.storage = storage
+        self.poll_interval = poll_interval
+
+        self._versions: Dict[str, str] = {}
+        self._dependencies: Dict[str, Tuple[str, ...]] = {}
+        self._listeners: List[VersionListener] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the background watcher thread, if it is not running."""
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run if self.storage.shared else self.resync,
+                name="ztp-template-versions",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def get(self, name: str) -> Optional[str]:
+        """Get the current sha256 hash of a template."""
+        return self._versions.get(name)
+
+    def get_dependencies(self, name: str) -> Tuple[str, ...]:
+        """Get the templates a template directly depends on."""
+        return self._dependencies.get(name, ())
+
+    def closure(self, name: str) -> List[str]:
+        """Get a template and all the templates it (transitively) depends on.
+        """
+        closure = [name]
+        seen = {name}
+        for template_name in closure:
+            for dependency in self._dependencies.get(template_name, ()):
+                if dependency not in seen:
+                    seen.add(dependency)
+                    closure.append(dependency)
+        return closure
+
+    def dependents(self, name: str) -> Set[str]:
+        """Get the templates that (transitively) depend on a template."""
+        dependencies = dict(self._dependencies)
+        dependents = set()
+        pending = [name]
+        while pending:
+            target = pending.pop()
+            for template_name, template_dependencies in dependencies.items():
+                if target in template_dependencies \
+                        and template_name not in dependents:
+                    dependents.add(template_name)
+                    pending.append(template_name)
+        dependents.discard(name)
+        return dependents
+
+    def closure_version(self, name: str) -> Optional[str]:
+        """Get the combined version of a template and its dependencies.
+
+        A template without dependencies is versioned by its own sha256 hash;
+        otherwise, the version is a hash of the names and hashes of all the
+        templates in its dependency closure, so it changes whenever any
+        template the rendered output depends on changes.
+
+        Dependencies that do not exist (yet) are left out of the version.
+
+        Returns:
+            The closure version, or None if the template is not in the table.
+        """
+        versions = self._versions
+        if versions.get(name) is None:
+            return None
+        return combine_versions(
+            (template_name, versions[template_name])
+            for template_name in self.closure(name)
+            if versions.get(template_name) is not None
+        )
+
+    def add_listener(self, listener: VersionListener):
+        """Register a function to be called when a template version changes.
+
+        Listeners are called with the template name, the old sha256 hash and
+        the new sha256 hash (None when the template has been deleted).
+        """
+        self._listeners.append(listener)
+
+    def set(self, name: str, sha256: Optional[str],
+            dependencies: Optional[Iterable[str]] = None):
+        """Record the current version (and dependencies) of a template."""
+        with self._lock:
+            old_sha256 = self._versions.get(name)
+            if sha256 is None:
+                self._versions.pop(name, None)
+                self._dependencies.pop(name, None)
+            else:
+                self._versions[name] = sha256
+                if dependencies is not None:
+                    self._dependencies[name] = tuple(dependencies)
+
+        if old_sha256 != sha256:
+            self._notify(name, old_sha256, sha256)
+
+    def setdefault(self, name: str, sha256: str,
+                   dependencies: Optional[Iterable[str]] = None):
+        """Record a template version, if the template is not in the table."""
+        if self._versions.get(name) is None:
+            self.set(name, sha256, dependencies=dependencies)
+
+    def remove(self, name: str):
+        """Remove a template from the table."""
+        self.set(name, None)
+
+    def apply(self, name: str, record: Optional[TemplateRecord]):
+        """Apply a template change (a None record removes the template)."""
+        if record is None:
+            self.remove(name)
+        else:
+            self.set(name, record.sha256, dependencies=record.dependencies)
+
+    def resync(self):
+        """Reload all template versions from the storage backend."""
+        latest = {
+            name: (sha256, dependencies)
+            for name, sha256, dependencies
+            in self.storage.list_template_versions()
+        }
+
+        for name in set(self._versions) - set(latest):
+            self.remove(name)
+        for name, (sha256, dependencies) in latest.items():
+            self.set(name, sha256, dependencies=dependencies)
+
+    def _notify(self, name: str, old_sha256: Optional[str],
+                new_sha256: Optional[str]):
+        """Call the registered listeners for a version change."""
+        for listener in self._listeners:
+            try:
+                listener(name, old_sha256, new_sha256)
+            except Exception:
+                logger.exception(
+                    f"Template version listener {listener!r} failed."
+                )
+
+    def _run(self):
+        """Watch the storage backend for template changes (watcher thread)."""
+        while True:
+            try:
+                # Resync once the watch is open, so no change can be missed
+                self.storage.watch_templates(self.resync, self.apply)
+            except NotImplementedError as error:
+                logger.info(
+                    f"{error} Polling for template changes every "
+                    f"{self.poll_interval} seconds."
+                )
+                self._poll()
+            except Exception:
+                logger.exception("Template version watcher failed.")
+            time.sleep(self.poll_interval)
+
+    def _poll(self):
+        """Poll the template names and hashes (the polling fallback)."""
+        while True:
+            self._safe_resync()
+            time.sleep(self.poll_interval)
+
+    def _safe_resync(self):
+        """Resync the table, logging (not raising) any storage errors."""
+        try:
+            self.resync()
+        except Exception as error:
+            logger.warning(f"Unable to resync the template versions: {error}")
+
+
+def combine_versions(versions: Iterable[Tuple[str, str]]) -> str:
+    """Combine (name, sha256) pairs into a single template closure version.
+
+    Returns:
+        The sha256 hash of a single template, or a hash of the sorted names
+        and hashes of multiple templates.
+    """
+    versions = sorted(versions)
+    if len(versions) == 1:
+        return versions[0][1]
+    return sha256_hash("\n".join(
+        f"{name}:{sha256}" for name, sha256 in versions
+    ).encode("utf-8")).hexdigest()
+
+
+template_versions = TemplateVersionTable(
+    storage=storage,
+    poll_interval=TEMPLATE_WATCH_POLL_INTERVAL,
+)
+
+
+# Apply this process's template writes immediately
+storage.add_template_listener(template_versions.apply)
@@ -0,0 +1,396 @@
+"""Lightweight per-request tracing spans.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pymongo.monitoring
+
+from ztp.config import SLOW_REQUEST_THRESHOLD, TRACE_EXPORT_PATH
+from ztp.context import current_context
+
+
+logger = logging.getLogger(__name__)
+
+
+# OTLP span kinds
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+# OTLP status codes
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+SERVICE_NAME = "rapid-ztp"
+
+# Spans kept (for export) per trace; the stage breakdown counts them all
+_MAX_SPANS = 1000
+
+# Traces waiting to be written; traces are dropped when the file writer
+# falls this far behind
+_EXPORT_QUEUE_SIZE = 10000
+
+
+def _random_id(bits: int) -> str:
+    """Create a random (nonzero) trace or span ID, as hex digits."""
+    return format(random.getrandbits(bits) or 1, f"0{bits // 4}x")
+
+
+class Span(object):
+    """A timed operation within a trace."""
+
+    __slots__ = (
+        "name", "span_id", "parent_id", "kind", "attributes", "start_time",
+        "duration", "error", "_start",
+    )
+
+    def __init__(self, name: str, parent_id: Optional[str] = None,
+                 kind: int = KIND_INTERNAL,
+                 attributes: Optional[dict] = None):
+        """Start a new span.
+
+        Args:
+            name: The operation name (e.g. `template.render`).
+            parent_id: The ID of the enclosing span.
+            kind: The OTLP span kind.
+            attributes: Attributes describing the operation.
+        """
+        self.name = name
+        self.span_id = _random_id(64)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start_time = time.time()
+        self.duration = None
+        self.error = None
+        self._start = time.perf_counter()
+
+    def set_attribute(self, key: str, value):
+        """Set an attribute of the span."""
+        self.attributes[key] = value
+
+    def end(self, error: Optional[str] = None):
+        """End the span (the first call sets the duration)."""
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._start
+            self.error = error
+
+    @property
+    def elapsed(self) -> float:
+        """The span duration (so far), in seconds."""
+        if self.duration is not None:
+            return self.duration
+        return time.perf_counter() - self._start
+
+    def to_otlp(self, trace_id: str) -> dict:
+        """Convert the span to its OTLP JSON shape."""
+        start = int(self.start_time * 1e9)
+        return {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(start + int(self.elapsed * 1e9)),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in self.attributes.items()
+            ],
+            "status": {"code": STATUS_ERROR, "message": self.error}
+            if self.error else {"code": STATUS_UNSET},
+        }
+
+
+def _otlp_value(value) -> dict:
+    """Convert an attribute value to its OTLP JSON `AnyValue` shape."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Trace(object):
+    """The spans recorded while serving one request.
+
+    Spans started in a thread are nested under the span that thread has
+    open.  Spans started in an executor worker thread with no span open are
+    nested under the span open on the event loop thread that started the
+    trace (the stage awaiting the worker), or the root span.
+
+    Bulk requests can start many spans: only the first `_MAX_SPANS` are
+    kept for export, but every finished span is counted in the stage
+    breakdown.
+    """
+
+    def __init__(self, name: str, attributes: Optional[dict] = None):
+        """Start a new trace, and its root (server) span."""
+        self.trace_id = _random_id(128)
+        self.root = Span(name, kind=KIND_SERVER, attributes=attributes)
+        self.spans: List[Span] = [self.root]
+        self._thread = threading.get_ident()
+        self._current: Dict[int, Span] = {}
+        self._commands: Dict[tuple, Span] = {}
+        self._stages: Dict[str, Tuple[float, int]] = OrderedDict()
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, kind: int = KIND_INTERNAL,
+                   attributes: Optional[dict] = None) -> Span:
+        """Start a span, nested under the current span of this thread."""
+        parent = self._current.get(threading.get_ident()) \
+            or self._current.get(self._thread, self.root)
+        span = Span(name, parent.span_id, kind, attributes)
+        with self._lock:
+            # Stages are listed in the order they first start
+            self._stages.setdefault(name, (0.0, 0))
+            if len(self.spans) < _MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+        return span
+
+    def end_span(self, span: Span, error: Optional[str] = None):
+        """End a span, and add it to the stage breakdown."""
+        if span.duration is not None:
+            return
+        span.end(error=error)
+        with self._lock:
+            total, count = self._stages.get(span.name, (0.0, 0))
+            self._stages[span.name] = (total + span.duration, count + 1)
+
+    @contextmanager
+    def activate(self, span: Span) -> Iterator[Span]:
+        """Make a span the current span of this thread, then end it."""
+        thread = threading.get_ident()
+        previous = self._current.get(thread)
+        self._current[thread] = span
+        try:
+            yield span
+        except BaseException as error:
+            self.end_span(span, error=repr(error))
+            raise
+        finally:
+            self.end_span(span)
+            if previous is None:
+                self._current.pop(thread, None)
+            else:
+                self._current[thread] = previous
+
+    def start_command(self, key: tuple, span: Span):
+        """Track the span of a started (MongoDB) command, by request key."""
+        self._commands[key] = span
+
+    def end_command(self, key: tuple, error: Optional[str] = None):
+        """End the span of a finished command."""
+        command_span = self._commands.pop(key, None)
+        if command_span is not None:
+            self.end_span(command_span, error=error)
+
+    def breakdown(self) -> Dict[str, Tuple[float, int]]:
+        """Get the total duration and count of the finished spans, by name.
+
+        The root span is left out; the stages are listed in the order they
+        first started.
+        """
+        with self._lock:
+            return OrderedDict(
+                (name, (total, count))
+                for name, (total, count) in self._stages.items()
+                if count
+            )
+
+    def to_otlp(self) -> dict:
+        """Convert the trace to an OTLP JSON `ExportTraceServiceRequest`."""
+        with self._lock:
+            spans = list(self.spans)
+        if self.dropped:
+            self.root.set_attribute("ztp.dropped_spans", self.dropped)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name",
+                 "value": {"stringValue": SERVICE_NAME}},
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [span.to_otlp(self.trace_id) for span in spans],
+            }],
+        }]}
+
+
+def current_trace() -> Optional[Trace]:
+    """Get the trace of the request being served, if it is traced."""
+    context = current_context()
+    return context.trace if context is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """Record a span around a block of code.
+
+    A no-op (yielding None) when the code is not serving a traced request.
+    """
+    trace = current_trace()
+    if trace is None:
+        yield None
+        return
+    with trace.activate(trace.start_span(name, attributes=attributes)) \
+            as active_span:
+        yield active_span
+
+
+def annotate(attributes: dict):
+    """Set attributes of the root span of the request being traced."""
+    trace = current_trace()
+    if trace is not None:
+        trace.root.attributes.update(attributes)
+
+
+def server_timing(trace: Trace) -> str:
+    """Create a `Server-Timing` header value from a trace's stages."""
+    metrics = [
+        f"{name};dur={total * 1000:.1f}"
+        for name, (total, count) in trace.breakdown().items()
+    ]
+    metrics.append(f"total;dur={trace.root.elapsed * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+def log_slow_request(trace: Trace):
+    """Log the stage breakdown of a request that exceeded the threshold."""
+    if trace.root.elapsed < SLOW_REQUEST_THRESHOLD:
+        return
+    attributes = trace.root.attributes
+    stages = ", ".join(
+        f"{name}={total * 1000:.1f}ms" + (f" (x{count})" if count > 1 else "")
+        for name, (total, count) in trace.breakdown().items()
+    )
+    logger.warning(
+        f"Slow request: {trace.root.name} took "
+        f"{trace.root.elapsed * 1000:.1f}ms "
+        f"[serial_number={attributes.get('ztp.serial_number', '-')} "
+        f"template={attributes.get('ztp.template', '-')} "
+        f"trace_id={trace.trace_id}]: {stages or 'no stages recorded'}"
+    )
+
+
+class TraceFileExporter(object):
+    """Append finished traces to a file, as OTLP JSON lines.
+
+    Each line is an OTLP `ExportTraceServiceRequest` (the format written by
+    the OpenTelemetry Collector file exporter).  Traces are written by a
+    background thread, so request handlers never wait on the file.
+    """
+
+    def __init__(self, path: str):
+        """Initialize a new exporter; the writer starts on first export."""
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=_EXPORT_QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        """Queue a finished trace to be written."""
+        self._start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        """Start the writer thread, if it is not running."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="ztp-trace-exporter", daemon=True,
+                )
+                self._thread.start()
+
+    def _run(self):
+        """Write queued traces to the file."""
+        while True:
+            trace = self._queue.get()
+            try:
+                line = json.dumps(trace.to_otlp(), separators=(",", ":"))
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(line + "\n")
+            except (OSError, TypeError, ValueError) as error:
+                logger.error(f"Failed to export trace: {error!r}")
+
+
+exporter = TraceFileExporter(TRACE_EXPORT_PATH) if TRACE_EXPORT_PATH \
+    else None
+
+
+def finish_trace(trace: Trace):
+    """End a request's trace, then log and export it."""
+    trace.root.end()
+    log_slow_request(trace)
+    if exporter is not None:
+        exporter.export(trace)
+
+
+class TracingCommandListener(pymongo.monitoring.CommandListener):
+    """Record a span for each MongoDB command made by a traced request."""
+
+    def started(self, event: pymongo.monitoring.CommandStartedEvent):
+        """Start the command span."""
+        trace = current_trace()
+        if trace is not None:
+            trace.start_command(
+                (event.connection_id, event.request_id),
+                trace.start_span(
+                    f"mongo.{event.command_name}",
+                    kind=KIND_CLIENT,
+                    attributes={
+                        "db.system": "mongodb",
+                        "db.name": event.database_name,
+                        "db.operation": event.command_name,
+                    },
+                ),
+            )
+
+    def succeeded(self, event: pymongo.monitoring.CommandSucceededEvent):
+        """End the command span."""
+        self._end(event)
+
+    def failed(self, event: pymongo.monitoring.CommandFailedEvent):
+        """End the command span, with the failure."""
+        self._end(event, error=repr(event.failure))
+
+    @staticmethod
+    def _end(event, error: Optional[str] = None):
+        trace = current_trace()
+        if trace is not None:
+            trace.end_command(
+                (event.connection_id, event.request_id), error=error,
+            )
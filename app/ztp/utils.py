@@ -16,8 +16,28 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+from datetime import datetime, timezone
+from hashlib import sha256
+from itertools import islice
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, Set
 from urllib.parse import urljoin, urlparse
 
+import jinja2
+import jinja2.meta
+from jinja2 import nodes
+
+
+# Iterator Utilities
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists of (at most) `size` items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
 
 # URL Utilities
 def is_url(string: str) -> bool:
@@ -29,3 +49,196 @@ def is_url(string: str) -> bool:
 def create_abs_url(base_url: str, relative_path: str) -> str:
     """Create an absolute URL from a base + a relative path."""
     return urljoin(base_url, relative_path)
+
+
+# HTTP Utilities
+def make_etag(*parts) -> str:
+    """Create a strong (quoted) HTTP entity tag from the version parts."""
+    digest = sha256("|".join(str(part) for part in parts).encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an `If-None-Match` request header against an entity tag.
+
+    Uses the weak comparison function required for `If-None-Match`: a weak
+    (W/) validator in the header matches the same opaque tag.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+# Date / Time Utilities
+def encode_datetime(value: datetime) -> str:
+    """Encode a datetime the way the API schemas (marshmallow) do.
+
+    The data stores hold naive UTC datetimes; marshmallow serializes them as
+    ISO 8601 strings with an explicit UTC offset.
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
+# Content Hashes
+def device_data_sha256(template_name: str, config_data: dict) -> str:
+    """Get the sha256 hash (hex digest) of a device's rendering inputs.
+
+    The template name and config data are hashed in a canonical JSON form
+    (sorted keys, no whitespace), so equal records hash equally regardless
+    of key order.
+    """
+    content = json.dumps(
+        [template_name, config_data], sort_keys=True, separators=(",", ":"),
+    )
+    return sha256(content.encode("utf-8")).hexdigest()
+
+
+# Template Utilities
+def template_sha256(text: str) -> str:
+    """Get the sha256 hash (hex digest) of a template's text."""
+    return sha256(text.encode("utf-8")).hexdigest()
+
+
+def find_template_dependencies(text: str) -> List[str]:
+    """Find the templates a template includes, extends, or imports.
+
+    Only references with constant template names can be found; references
+    computed at render time are skipped.  Templates with syntax errors have
+    no (discoverable) dependencies.
+    """
+    try:
+        ast = jinja2.Environment().parse(text)
+    except jinja2.TemplateSyntaxError:
+        return []
+
+    return sorted({
+        name for name in jinja2.meta.find_referenced_templates(ast)
+        if name is not None
+    })
+
+
+# Template variable paths: dotted `config_data` key paths, where `[]` marks
+# the items of a list the template loops over (`interfaces[].name`)
+ITEMS = "[]"
+
+# Expressions under these filters and tests may safely be undefined
+_OPTIONAL_FILTERS = frozenset({"default", "d"})
+_OPTIONAL_TESTS = frozenset({"defined", "undefined", "none"})
+
+# Statements whose contents are not (unconditionally) rendered
+_CONDITIONAL_NODES = (nodes.If, nodes.CondExpr, nodes.Macro, nodes.CallBlock)
+
+# Local names in scope: a `config_data` path, or None for other locals
+_Scope = Dict[str, Optional[List[str]]]
+
+
+def _variable_path(node: nodes.Node, scope: _Scope) -> Optional[List[str]]:
+    """Get the `config_data` path an expression reads, if it reads one."""
+    if isinstance(node, nodes.Name):
+        return scope.get(node.name) if node.ctx == "load" else None
+    if isinstance(node, nodes.Getattr):
+        key = node.attr
+    elif isinstance(node, nodes.Getitem) \
+            and isinstance(node.arg, nodes.Const) \
+            and isinstance(node.arg.value, str):
+        key = node.arg.value
+    else:
+        return None
+    if "." in key or ITEMS in key:
+        return None
+    parent = _variable_path(node.node, scope)
+    return None if parent is None else parent + [key]
+
+
+def _loop_scope(node: nodes.For, scope: _Scope) -> _Scope:
+    """Get the scope of a loop body, with the loop target names bound."""
+    scope = dict(scope)
+    iterable = _variable_path(node.iter, scope)
+    if isinstance(node.target, nodes.Name):
+        scope[node.target.name] = iterable + [ITEMS] if iterable else None
+    else:
+        for name in node.target.find_all(nodes.Name):
+            scope[name.name] = None
+    return scope
+
+
+def _find_variable_paths(node: nodes.Node, scope: _Scope,
+                         paths: Set[str]):
+    """Collect the `config_data` paths a template node always reads."""
+    if isinstance(node, _CONDITIONAL_NODES):
+        return
+    if isinstance(node, nodes.Filter) and node.name in _OPTIONAL_FILTERS:
+        return
+    if isinstance(node, nodes.Test) and node.name in _OPTIONAL_TESTS:
+        return
+
+    path = _variable_path(node, scope)
+    if path is not None:
+        if path:
+            paths.add(".".join(path).replace("." + ITEMS, ITEMS))
+        return
+
+    if isinstance(node, nodes.Call) and isinstance(node.node, nodes.Getattr):
+        # A method call (`interfaces.items()`) reads the object
+        _find_variable_paths(node.node.node, scope, paths)
+        for child in node.iter_child_nodes(exclude=("node",)):
+            _find_variable_paths(child, scope, paths)
+        return
+
+    if isinstance(node, nodes.For):
+        _find_variable_paths(node.iter, scope, paths)
+        # A filtered or recursive loop renders its body conditionally, and
+        # the `else` block is rendered only for an empty sequence
+        if node.test is None and not node.recursive:
+            body_scope = _loop_scope(node, scope)
+            for child in node.body:
+                _find_variable_paths(child, body_scope, paths)
+        return
+
+    if isinstance(node, nodes.With):
+        for value in node.values:
+            _find_variable_paths(value, scope, paths)
+        body_scope = dict(scope)
+        for target in node.targets:
+            for name in target.find_all(nodes.Name):
+                body_scope[name.name] = None
+        for child in node.body:
+            _find_variable_paths(child, body_scope, paths)
+        return
+
+    for child in node.iter_child_nodes():
+        _find_variable_paths(child, scope, paths)
+
+
+def find_template_variables(text: str) -> List[str]:
+    """Find the `config_data` paths a template needs to render.
+
+    Attribute and constant-subscript chains under `config_data` are followed
+    to dotted paths (`config_data.snmp.location` needs `snmp.location`), and
+    loop variables to the items of their list (`interfaces[].name`).  Only
+    the values read unconditionally are needed: references in `if` blocks
+    and conditional expressions, under a `default` filter or a `defined`
+    test, in filtered loops, and in macros are left out.  Templates with
+    syntax errors need no (discoverable) variables.
+    """
+    try:
+        ast = jinja2.Environment().parse(text)
+    except jinja2.TemplateSyntaxError:
+        return []
+
+    if "config_data" not in jinja2.meta.find_undeclared_variables(ast):
+        return []
+
+    paths = set()
+    _find_variable_paths(ast, {"config_data": []}, paths)
+    return sorted(paths)
@@ -0,0 +1,233 @@
+"""Validate device data against the variables its templates need.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import asyncio
+import functools
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from ztp.config import (
+    DEVICE_DATA_VALIDATION, VALIDATION_CHUNK_SIZE,
+    VALIDATION_PARALLEL_THRESHOLD,
+)
+from ztp.executor import run_process, run_render, run_sync
+from ztp.storage import DeviceDataRecord, storage
+from ztp.utils import ITEMS, batched
+
+
+logger = logging.getLogger(__name__)
+
+
+# A compiled validator: validator(config_data) -> error messages
+Validator = Callable[[dict], List[str]]
+
+# A compiled check: check(value, location, errors)
+_Check = Callable[[Any, str, List[str]], None]
+
+# Records to validate: (index, template name, config data)
+_Item = Tuple[int, str, dict]
+
+
+def _split_path(path: str) -> List[str]:
+    """Split a template variable path (`interfaces[].name`) into keys."""
+    keys = []
+    for key in path.split("."):
+        if key.endswith(ITEMS):
+            keys.extend([key[:-len(ITEMS)], ITEMS])
+        else:
+            keys.append(key)
+    return keys
+
+
+def _compile_check(tree: dict) -> _Check:
+    """Compile a tree of required keys into a check function.
+
+    A value with required keys must be an object, and a value whose items
+    are required (`ITEMS`) must be a list (or an object, which a template
+    loops over by key); the items of a list are checked against the
+    subtree.  Keys are present when they are not missing or null.
+    """
+    fields = [
+        (key, _compile_check(subtree) if subtree else None)
+        for key, subtree in sorted(tree.items())
+        if key != ITEMS
+    ]
+    iterable = ITEMS in tree
+    items = _compile_check(tree[ITEMS]) if tree.get(ITEMS) else None
+
+    def check(value: Any, location: str, errors: List[str]):
+        if iterable and isinstance(value, list):
+            if items is not None:
+                for index, item in enumerate(value):
+                    items(item, f"{location}[{index}]", errors)
+            return
+
+        if not isinstance(value, dict):
+            expected = "a list" if iterable and not fields else "an object"
+            errors.append(f"`{location}` should be {expected}.")
+            return
+
+        for key, child in fields:
+            child_value = value.get(key)
+            if child_value is None:
+                errors.append(f"`{location}.{key}` is missing.")
+            elif child is not None:
+                child(child_value, f"{location}.{key}", errors)
+
+    return check
+
+
+def compile_validator(paths: Iterable[str]) -> Validator:
+    """Compile a validator for the `config_data` paths a template needs.
+
+    The paths are merged into a tree once, so each record is checked in a
+    single walk of its config data.
+    """
+    tree = {}
+    for path in paths:
+        node = tree
+        for key in _split_path(path):
+            node = node.setdefault(key, {})
+    check = _compile_check(tree)
+
+    def validator(config_data: dict) -> List[str]:
+        errors = []
+        check(config_data, "config_data", errors)
+        return errors
+
+    return validator
+
+
+@functools.lru_cache(maxsize=1024)
+def get_validator(paths: Tuple[str, ...]) -> Validator:
+    """Get the (cached) compiled validator for a set of paths."""
+    return compile_validator(paths)
+
+
+def validate_items(items: List[_Item],
+                   requirements: Dict[str, Tuple[str, ...]]) \
+        -> List[Tuple[int, List[str]]]:
+    """Validate records against their templates' required paths.
+
+    Runs inline or in a validation worker process; the compiled validators
+    are cached in each process.
+
+    Returns:
+        The (index, error messages) of each record that is not valid.
+    """
+    invalid = []
+    for index, template_name, config_data in items:
+        errors = get_validator(requirements[template_name])(config_data)
+        if errors:
+            invalid.append((index, errors))
+    return invalid
+
+
+def template_requirements(template_names: Iterable[str]) \
+        -> Dict[str, Tuple[str, ...]]:
+    """Get the `config_data` paths needed to render each template.
+
+    A template needs its own variables and those of every template it
+    (transitively) includes, extends, or imports.  Templates that do not
+    exist are left out; the records that use them are not validated.
+    """
+    template_names = set(template_names)
+    records = {}
+    requested = set()
+    pending = template_names
+    while pending:
+        requested |= pending
+        fetched = storage.get_templates(pending)
+        records.update((record.name, record) for record in fetched)
+        pending = {
+            dependency
+            for record in fetched
+            for dependency in record.dependencies
+        } - requested
+
+    requirements = {}
+    for name in template_names & records.keys():
+        paths = set()
+        closure = [name]
+        for template_name in closure:
+            record = records.get(template_name)
+            if record is None:
+                continue
+            paths.update(record.variables)
+            closure.extend(
+                dependency for dependency in record.dependencies
+                if dependency not in closure
+            )
+        requirements[name] = tuple(sorted(paths))
+    return requirements
+
+
+async def validate_device_data(records: List[DeviceDataRecord]) \
+        -> Dict[int, List[str]]:
+    """Validate device data records against the templates they use.
+
+    The records are checked in a single pass: inline (off the event loop)
+    for smaller uploads, and in chunks across the validation process pool
+    for uploads of `VALIDATION_PARALLEL_THRESHOLD` records or more.
+
+    Returns:
+        The error messages of each record that is not valid, by the record's
+        index in `records`.
+    """
+    if not DEVICE_DATA_VALIDATION or not records:
+        return {}
+
+    requirements = await run_sync(
+        template_requirements, {record.template_name for record in records},
+    )
+    requirements = {
+        name: paths for name, paths in requirements.items() if paths
+    }
+    items = [
+        (index, record.template_name, record.config_data)
+        for index, record in enumerate(records)
+        if record.template_name in requirements
+    ]
+    if not items:
+        return {}
+
+    if len(items) < VALIDATION_PARALLEL_THRESHOLD:
+        results = [await run_render(validate_items, items, requirements)]
+    else:
+        results = await asyncio.gather(*[
+            run_process(validate_items, chunk, requirements)
+            for chunk in batched(items, VALIDATION_CHUNK_SIZE)
+        ])
+
+    invalid = {
+        index: errors for result in results for index, errors in result
+    }
+    if invalid:
+        logger.info(
+            f"{len(invalid)} of {len(records)} device data records are not "
+            f"valid for their templates."
+        )
+    return invalid
+
+
+def summarize_errors(errors: List[str], limit: int = 10) -> str:
+    """Join a record's error messages, up to `limit` of them."""
+    summary = " ".join(errors[:limit])
+    if len(errors) > limit:
+        summary += f" (and {len(errors) - limit} more errors)"
+    return summary
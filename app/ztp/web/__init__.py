@@ -20,6 +20,12 @@ from pathlib import Path
 
 import responder
 
+from ztp.template_versions import template_versions
+from ztp.web.admission import AdmissionMiddleware
+from ztp.web.compression import ContentEncodingMiddleware
+from ztp.web.metrics import MetricsMiddleware
+from ztp.web.tracing import TracingMiddleware
+
 
 here = Path(__file__).parent
 static_dir = here/"static"
@@ -34,9 +40,32 @@ api = responder.API(
     openapi="3.0.0",
     docs_route="/api",
 )
+api.add_middleware(ContentEncodingMiddleware)
+api.add_middleware(AdmissionMiddleware, route_for=api.path_matches_route)
+api.add_middleware(TracingMiddleware)
+api.add_middleware(MetricsMiddleware, route_for=api.path_matches_route)
+
+# Conditional requests and renders are served from the template-version
+# table without loading templates in this process, so keep it current
+# (with the other processes' template writes) from startup
+api.add_event_handler("startup", template_versions.start)
+
+
+def not_modified(resp: responder.Response, etag: str):
+    """Answer a conditional request with 304 Not Modified.
+
+    The response has an empty body and no `Content-Type` (responder would
+    otherwise send a JSON `null`).
+    """
+    resp.status_code = api.status_codes.HTTP_304
+    resp.headers["ETag"] = etag
+    resp.content = b""
 
 
 # Import Views
+import ztp.web.views.api.configs        # noqa
 import ztp.web.views.api.device_data    # noqa
+import ztp.web.views.api.render_cache   # noqa
 import ztp.web.views.api.templates      # noqa
 import ztp.web.views.config             # noqa
+import ztp.web.views.metrics            # noqa
@@ -16,10 +16,19 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+import argparse
 import logging
+import os
+import signal
+import sys
+import threading
 
 import ztp.web
-from ztp.config import LOG_LEVEL, RESPONDER_ADDRESS, RESPONDER_PORT
+from ztp.config import (
+    LOG_LEVEL, RESPONDER_ADDRESS, RESPONDER_GRACEFUL_TIMEOUT, RESPONDER_PORT,
+    RESPONDER_WORKERS,
+)
+from ztp.storage import storage
 
 
 logger = logging.getLogger(__name__)
@@ -38,9 +47,94 @@ def configure_logging():
     )
 
 
+def parse_args() -> argparse.Namespace:
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="python -m ztp.web",
+        description="Run the Rapid ZTP web service.",
+    )
+    parser.add_argument(
+        "--address", default=RESPONDER_ADDRESS,
+        help=f"address to listen on (default: {RESPONDER_ADDRESS})",
+    )
+    parser.add_argument(
+        "--port", type=int, default=RESPONDER_PORT,
+        help=f"TCP port to listen on (default: {RESPONDER_PORT})",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=RESPONDER_WORKERS,
+        help=f"number of worker processes (default: {RESPONDER_WORKERS})",
+    )
+    return parser.parse_args()
+
+
+def run_workers(workers: int, address: str, port: int):
+    """Serve the app from multiple worker processes.
+
+    Replaces this process with a gunicorn master that manages `workers`
+    uvicorn worker processes sharing one listening socket.  The app is not
+    preloaded; each worker imports it after the fork, so every worker opens
+    its own MongoDB connection pool and starts its own background threads.
+
+    Send the master SIGHUP for a graceful rolling restart: new workers are
+    started (loading the current code and configuration) and the old workers
+    finish their in-flight requests before exiting.
+    """
+    arguments = [
+        sys.executable, "-m", "gunicorn",
+        "--worker-class", "uvicorn.workers.UvicornWorker",
+        "--workers", str(workers),
+        "--bind", f"{address}:{port}",
+        "--graceful-timeout", str(RESPONDER_GRACEFUL_TIMEOUT),
+        "--log-level", LOG_LEVEL.lower(),
+        "ztp.web:api",
+    ]
+    logger.info(f"Starting {workers} worker processes: {' '.join(arguments)}")
+    os.execv(sys.executable, arguments)
+
+
+def restart_on_hangup() -> threading.Event:
+    """Restart the single-process server when it receives SIGHUP.
+
+    The server is asked to shut down gracefully (uvicorn stops accepting
+    connections and finishes the in-flight requests), as for SIGTERM; the
+    returned event is set, so the caller can restart the process (see
+    `restart()`) once the server has stopped.
+    """
+    hangup = threading.Event()
+
+    def handle_hangup(signum, frame):
+        logger.info("Received SIGHUP; restarting the server.")
+        hangup.set()
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    signal.signal(signal.SIGHUP, handle_hangup)
+    return hangup
+
+
+def restart():
+    """Replace this process with a new server, loading the current code."""
+    logging.shutdown()
+    os.execv(sys.executable, [sys.executable, "-m", "ztp.web"] + sys.argv[1:])
+
+
 if __name__ == "__main__":
+    args = parse_args()
     configure_logging()
 
-    ztp.web.api.run(address=RESPONDER_ADDRESS, port=RESPONDER_PORT)
+    if args.workers > 1 and not storage.shared:
+        logger.warning(
+            f"The `{storage.name}` storage backend cannot be shared by "
+            f"worker processes; starting a single worker."
+        )
+        args.workers = 1
+
+    if args.workers > 1:
+        run_workers(args.workers, args.address, args.port)
+    else:
+        hangup = restart_on_hangup()
+        ztp.web.api.run(address=args.address, port=args.port)
+        if hangup.is_set():
+            restart()
 
     logging.shutdown()
@@ -0,0 +1,291 @@
+"""Admission control (load shedding) middleware.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import random
+import time
+from typing import Callable, Optional
+
+from ztp.config import (
+    ADMISSION_ENABLED, ADMISSION_MAX_BULK_QUEUE, ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_MAX_QUEUE, ADMISSION_MAX_RETRY_AFTER, ADMISSION_QUEUE_TIMEOUT,
+)
+from ztp.metrics import admission_queue_wait, admission_rejections
+from ztp.tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+
+# Request priorities, highest first: admin (single-record API) requests are
+# admitted ahead of queued device requests, and are never shed for a full
+# queue; bulk API requests (device data listings and uploads, and bulk
+# renders) wait behind device requests, in their own bounded queue
+PRIORITY_ADMIN = "admin"
+PRIORITY_DEVICE = "device"
+PRIORITY_BULK = "bulk"
+_PRIORITY_ORDER = {PRIORITY_ADMIN: 0, PRIORITY_DEVICE: 1, PRIORITY_BULK: 2}
+
+# Device configuration routes (the boot-storm traffic)
+_DEVICE_ROUTE_PREFIX = "/config/"
+_API_ROUTE_PREFIX = "/api/"
+
+# API routes that read, write, or render the whole device collection
+_BULK_API_ROUTES = frozenset(("/api/configs/render", "/api/device_data"))
+
+# Weight of the latest request in the service-time moving average
+_SERVICE_TIME_WEIGHT = 0.1
+
+
+class Overloaded(Exception):
+    """A request was not admitted; the client should retry later."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"{reason}; retry after {retry_after} seconds")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController(object):
+    """Bounded-concurrency limiter with a priority queue.
+
+    At most `max_concurrency` requests are served at once; the others wait
+    in a queue, admin requests ahead of device requests, and device requests
+    ahead of bulk requests.  A device request that finds `max_queue` device
+    requests already waiting (or a bulk request that finds `max_bulk_queue`
+    bulk requests waiting) is rejected at once, and a request that waits
+    longer than `queue_timeout` seconds is rejected (the device would have
+    timed out anyway).  Rejections carry a
+    `Retry-After` delay estimated from the backlog and the moving-average
+    service time, with jitter so shed devices do not retry in lockstep.
+
+    Not thread-safe; use from the event loop thread only.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int,
+                 queue_timeout: float, max_retry_after: int,
+                 max_bulk_queue: int = 16):
+        """Initialize a new admission controller.
+
+        Args:
+            max_concurrency: The maximum number of requests served at once.
+            max_queue: The maximum number of device requests waiting.
+            queue_timeout: The longest a request waits to be admitted, in
+                seconds.
+            max_retry_after: The longest `Retry-After` delay, in seconds.
+            max_bulk_queue: The maximum number of bulk API requests waiting.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_bulk_queue = max_bulk_queue
+        self.queue_timeout = queue_timeout
+        self.max_retry_after = max_retry_after
+
+        self.active = 0
+        self.queued = {priority: 0 for priority in _PRIORITY_ORDER}
+        self.service_time = 0.1
+
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    def retry_after(self) -> int:
+        """Estimate when the backlog will have cleared, in seconds."""
+        backlog = self.active + sum(self.queued.values())
+        seconds = backlog * self.service_time / self.max_concurrency
+        seconds *= random.uniform(1.0, 1.5)
+        return min(self.max_retry_after, max(1, math.ceil(seconds)))
+
+    async def acquire(self, priority: str):
+        """Wait for a slot to serve a request.
+
+        Raises:
+            Overloaded: The queue is full, or the request waited too long.
+        """
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            admission_queue_wait.observe(0.0, priority=priority)
+            return
+
+        max_queue = {
+            PRIORITY_DEVICE: self.max_queue,
+            PRIORITY_BULK: self.max_bulk_queue,
+        }.get(priority)
+        if max_queue is not None and self.queued[priority] >= max_queue:
+            admission_rejections.inc(priority=priority, reason="queue_full")
+            raise Overloaded("queue_full", self.retry_after())
+
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (
+            _PRIORITY_ORDER[priority], next(self._sequence), future,
+        ))
+        self.queued[priority] += 1
+        start = time.perf_counter()
+        try:
+            with span("admission.wait"):
+                await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # The slot may have been handed over as the wait timed out
+            if not future.done() or future.cancelled():
+                admission_rejections.inc(
+                    priority=priority, reason="queue_timeout",
+                )
+                raise Overloaded("queue_timeout", self.retry_after())
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._hand_over()
+            raise
+        finally:
+            self.queued[priority] -= 1
+        admission_queue_wait.observe(
+            time.perf_counter() - start, priority=priority,
+        )
+
+    def release(self, service_time: float):
+        """Free a request's slot, admitting the next waiting request.
+
+        Args:
+            service_time: How long the request was served, in seconds.
+        """
+        self.service_time += \
+            _SERVICE_TIME_WEIGHT * (service_time - self.service_time)
+        self._hand_over()
+
+    def _hand_over(self):
+        """Pass a freed slot to the first live waiter, or free it."""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        """Get the limiter state."""
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "queued": dict(self.queued),
+            "max_queue": self.max_queue,
+            "max_bulk_queue": self.max_bulk_queue,
+            "service_time": self.service_time,
+        }
+
+
+admission = AdmissionController(
+    max_concurrency=ADMISSION_MAX_CONCURRENCY,
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    max_retry_after=ADMISSION_MAX_RETRY_AFTER,
+    max_bulk_queue=ADMISSION_MAX_BULK_QUEUE,
+)
+
+
+def request_priority(route: Optional[str]) -> Optional[str]:
+    """Get the admission priority of a route (None if it is not limited).
+
+    Device configuration and API requests are limited; the metrics, docs,
+    and static routes are always admitted.  Requests to the device data
+    collection and bulk render routes are bulk requests; the other API
+    requests (single device data records, the templates, and the cache
+    statistics, read or written) are admin requests.
+    """
+    if route is None:
+        return None
+    if route.startswith(_DEVICE_ROUTE_PREFIX):
+        return PRIORITY_DEVICE
+    if route.startswith(_API_ROUTE_PREFIX):
+        if route in _BULK_API_ROUTES:
+            return PRIORITY_BULK
+        return PRIORITY_ADMIN
+    return None
+
+
+class AdmissionMiddleware(object):
+    """ASGI middleware that limits the requests served at once.
+
+    Requests wait for a slot from the admission controller; requests that
+    are shed get a `503 Service Unavailable` response with a `Retry-After`
+    header.  The slot is held until the complete response has been sent.
+    """
+
+    def __init__(self, app, route_for: Callable[[str], Optional[str]],
+                 controller: AdmissionController = admission):
+        """Wrap an ASGI app with admission control.
+
+        Args:
+            app: The ASGI app.
+            route_for: Function that finds the route for a request path.
+            controller: The admission controller.
+        """
+        self.app = app
+        self.route_for = route_for
+        self.controller = controller
+
+    def __call__(self, scope: dict):
+        """Create the ASGI application instance for a connection."""
+        if scope["type"] != "http" or not ADMISSION_ENABLED:
+            return self.app(scope)
+
+        priority = request_priority(self.route_for(scope["path"]))
+        if priority is None:
+            return self.app(scope)
+
+        inner = self.app(scope)
+        controller = self.controller
+
+        async def admitted(receive, send):
+            try:
+                await controller.acquire(priority)
+            except Overloaded as error:
+                logger.info(
+                    f"Shed {scope['method']} {scope['path']}: "
+                    f"{error.reason}."
+                )
+                await send_overloaded(send, error.retry_after)
+                return
+
+            start = time.perf_counter()
+            try:
+                await inner(receive, send)
+            finally:
+                controller.release(time.perf_counter() - start)
+
+        return admitted
+
+
+async def send_overloaded(send, retry_after: int):
+    """Send a `503 Service Unavailable` response."""
+    body = json.dumps({
+        "error": f"The server is busy; please retry after {retry_after} "
+                 f"seconds.",
+    }).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"retry-after", str(retry_after).encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
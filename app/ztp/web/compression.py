@@ -0,0 +1,547 @@
+"""HTTP content-encoding negotiation for responses and request bodies.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import asyncio
+from collections import OrderedDict
+import json
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+import zlib
+
+from ztp.config import (
+    COMPRESSION_CACHE_MAX_BYTES, COMPRESSION_LEVEL, COMPRESSION_MINIMUM_SIZE,
+    REQUEST_MAX_DECODED_BYTES,
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+Headers = List[Tuple[bytes, bytes]]
+
+# Bodies larger than this are compressed in a worker thread
+_OFFLOAD_SIZE = 256 * 1024
+
+_COMPRESSIBLE_TYPES = re.compile(
+    rb"^(text/|application/(json|x-ndjson|x-tar|javascript|xml)|"
+    rb"application/[^;]*\+(json|xml))",
+)
+
+_ETAG_SUFFIX = re.compile(r'-(?:zstd|br|gzip|deflate)"')
+
+
+class RequestBodyTooLarge(Exception):
+    """The decoded request body exceeds the configured maximum size."""
+
+
+# Codecs
+class _ZlibCompressor(object):
+    """Streaming gzip / deflate (zlib) compressor."""
+
+    def __init__(self, wbits: int, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) \
+            + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class _BrotliCompressor(object):
+    """Streaming brotli compressor."""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=min(level, 11))
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class _ZstdCompressor(object):
+    """Streaming Zstandard compressor."""
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) \
+            + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class _ZlibDecompressor(object):
+    """Streaming gzip / deflate decompressor (the format is auto-detected)."""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(47)
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        decoded = self._decompressor.decompress(data, max_length)
+        if self._decompressor.unconsumed_tail:
+            raise RequestBodyTooLarge()
+        return decoded
+
+    def flush(self) -> bytes:
+        return self._decompressor.flush()
+
+
+class _BrotliDecompressor(object):
+    """Streaming brotli decompressor."""
+
+    def __init__(self):
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        decoded = self._decompressor.process(
+            data, output_buffer_limit=max_length,
+        )
+        if len(decoded) >= max_length \
+                or not self._decompressor.can_accept_more_data():
+            raise RequestBodyTooLarge()
+        return decoded
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _BoundedOutput(object):
+    """File-like sink for decompressed data, limited to `limit` bytes."""
+
+    def __init__(self):
+        self.limit = 0
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data: bytes) -> int:
+        self._size += len(data)
+        if self._size > self.limit:
+            raise RequestBodyTooLarge()
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        return data
+
+
+class _ZstdDecompressor(object):
+    """Streaming Zstandard decompressor."""
+
+    def __init__(self):
+        # The stream writer passes the output to the sink a block at a time,
+        # so decoding stops as soon as the output exceeds the limit
+        self._output = _BoundedOutput()
+        self._writer = zstandard.ZstdDecompressor().stream_writer(
+            self._output,
+        )
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        self._output.limit = max_length
+        self._writer.write(data)
+        return self._output.take()
+
+    def flush(self) -> bytes:
+        return b""
+
+
+# Supported content codings, in server preference order
+COMPRESSORS: Dict[str, Callable[[int], object]] = OrderedDict()
+DECOMPRESSORS: Dict[str, Callable[[], object]] = {}
+
+if zstandard is not None:
+    COMPRESSORS["zstd"] = _ZstdCompressor
+    DECOMPRESSORS["zstd"] = _ZstdDecompressor
+if brotli is not None:
+    COMPRESSORS["br"] = _BrotliCompressor
+    # Brotli < 1.2 cannot limit the decompressed output size; without it,
+    # br-encoded request bodies are not accepted
+    if hasattr(brotli.Decompressor, "can_accept_more_data"):
+        DECOMPRESSORS["br"] = _BrotliDecompressor
+COMPRESSORS["gzip"] = lambda level: _ZlibCompressor(31, level)
+COMPRESSORS["deflate"] = lambda level: _ZlibCompressor(15, level)
+DECOMPRESSORS["gzip"] = _ZlibDecompressor
+DECOMPRESSORS["x-gzip"] = _ZlibDecompressor
+DECOMPRESSORS["deflate"] = _ZlibDecompressor
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Select a content coding from an `Accept-Encoding` request header.
+
+    Returns:
+        The supported coding with the highest client quality value (ties go
+        to the server's preference order), or None for the identity coding.
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, parameters = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities["gzip" if coding == "x-gzip" else coding] = quality
+
+    best_coding, best_quality = None, 0.0
+    for coding in COMPRESSORS:
+        quality = qualities.get(coding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best_coding, best_quality = coding, quality
+    return best_coding
+
+
+def compress(encoding: str, data: bytes,
+             level: int = COMPRESSION_LEVEL) -> bytes:
+    """Compress a complete body with a content coding."""
+    return COMPRESSORS[encoding](level).finish(data)
+
+
+def variant_etag(etag: str, encoding: str) -> str:
+    """Create the entity tag of an encoded variant of a representation."""
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+
+class CompressedVariantCache(object):
+    """LRU cache of compressed response bodies, by entity tag and coding.
+
+    Responses with a strong entity tag (rendered configurations, templates,
+    device data) have identical bodies for identical tags, so their
+    compressed variants are reused instead of being recompressed on every
+    request.  Used only from the event loop thread.
+    """
+
+    def __init__(self, max_bytes: int):
+        """Initialize a new, empty compressed-variant cache."""
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, etag: str, encoding: str) -> Optional[bytes]:
+        """Get a compressed variant."""
+        body = self._entries.get((etag, encoding))
+        if body is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end((etag, encoding))
+        self.hits += 1
+        return body
+
+    def put(self, etag: str, encoding: str, body: bytes):
+        """Add a compressed variant, evicting the least recently used."""
+        if len(body) > self.max_bytes:
+            return
+        previous = self._entries.pop((etag, encoding), None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[(etag, encoding)] = body
+        self._size += len(body)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def stats(self) -> dict:
+        """Get the cache utilization and hit/miss counters."""
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+compressed_variants = CompressedVariantCache(COMPRESSION_CACHE_MAX_BYTES)
+
+
+# Header helpers
+def _get_header(headers: Headers, name: bytes) -> Optional[str]:
+    """Get a header value (decoded) from a list of raw ASGI headers."""
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _set_header(headers: Headers, name: bytes, value: str) -> Headers:
+    """Replace (or add) a header in a list of raw ASGI headers."""
+    headers = [(key, val) for key, val in headers if key.lower() != name]
+    headers.append((name, value.encode("latin-1")))
+    return headers
+
+
+def _remove_header(headers: Headers, name: bytes) -> Headers:
+    """Remove a header from a list of raw ASGI headers."""
+    return [(key, value) for key, value in headers if key.lower() != name]
+
+
+def _add_vary(headers: Headers) -> Headers:
+    """Add `Accept-Encoding` to the `Vary` response header."""
+    vary = _get_header(headers, b"vary")
+    if vary is None:
+        return headers + [(b"vary", b"Accept-Encoding")]
+    if "accept-encoding" in vary.lower():
+        return headers
+    return _set_header(headers, b"vary", f"{vary}, Accept-Encoding")
+
+
+class ContentEncodingMiddleware(object):
+    """ASGI middleware that negotiates HTTP content codings.
+
+    Responses: the coding is negotiated from `Accept-Encoding` (zstd and br
+    when the optional `zstandard` / `brotli` packages are installed, gzip,
+    and deflate).  Compressible bodies at least `minimum_size` bytes long
+    are compressed; streamed bodies are compressed chunk by chunk.  Encoded
+    variants carry a coding-specific entity tag, and the compressed bodies of
+    responses with a strong entity tag are cached and reused.
+
+    The `Accept-Encoding` header is hidden from the wrapped app, so no inner
+    middleware compresses the body a second time.
+
+    Requests: bodies sent with a supported `Content-Encoding` are decoded,
+    as they are received, before they reach the app; decoding stops (413)
+    once the decoded body exceeds `max_decoded_size` bytes.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+                 level: int = COMPRESSION_LEVEL,
+                 max_decoded_size: int = REQUEST_MAX_DECODED_BYTES,
+                 variant_cache: CompressedVariantCache = compressed_variants):
+        """Wrap an ASGI app with content-encoding negotiation."""
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.max_decoded_size = max_decoded_size
+        self.variant_cache = variant_cache
+
+    def __call__(self, scope: dict):
+        """Create the ASGI application instance for a connection."""
+        if scope["type"] != "http":
+            return self.app(scope)
+        return _ContentEncodingResponder(self, scope)
+
+
+class _ContentEncodingResponder(object):
+    """Per-request content-encoding state for ContentEncodingMiddleware."""
+
+    def __init__(self, middleware: ContentEncodingMiddleware, scope: dict):
+        self.middleware = middleware
+
+        headers = scope.get("headers", [])
+        accept_encoding = _get_header(headers, b"accept-encoding")
+        self.encoding = negotiate_encoding(accept_encoding) \
+            if accept_encoding else None
+        self.request_encoding = (
+            _get_header(headers, b"content-encoding") or "identity"
+        ).strip().lower()
+        self.if_none_match = _get_header(headers, b"if-none-match") or ""
+
+        # Hide the codings from the app; present the un-encoded variant tags
+        inner_headers = _remove_header(headers, b"accept-encoding")
+        if self.request_encoding != "identity":
+            inner_headers = _remove_header(inner_headers, b"content-encoding")
+            inner_headers = _remove_header(inner_headers, b"content-length")
+        if self.if_none_match:
+            inner_headers = _set_header(
+                inner_headers, b"if-none-match",
+                _ETAG_SUFFIX.sub('"', self.if_none_match),
+            )
+
+        self.scope = dict(scope, headers=inner_headers)
+        self.send = None
+        self.start_message = None
+        self.response_started = False
+        self.compressor = None
+
+    async def __call__(self, receive, send):
+        """Run the app with decoded request bodies and encoded responses."""
+        self.send = send
+
+        if self.request_encoding != "identity":
+            if self.request_encoding not in DECOMPRESSORS:
+                await self._send_error(
+                    415, f"Unsupported Content-Encoding "
+                         f"`{self.request_encoding}`.",
+                )
+                return
+            receive = self._decoding_receive(receive)
+
+        try:
+            await self.middleware.app(self.scope)(receive, self._send)
+        except RequestBodyTooLarge:
+            if self.response_started or self.start_message is not None:
+                raise
+            await self._send_error(
+                413, f"The decoded request body exceeds "
+                     f"{self.middleware.max_decoded_size} bytes.",
+            )
+
+    def _decoding_receive(self, receive):
+        """Wrap an ASGI receive function to decode the request body."""
+        decompressor = DECOMPRESSORS[self.request_encoding]()
+        max_size = self.middleware.max_decoded_size
+        state = {"size": 0, "done": False}
+
+        async def decoding_receive() -> dict:
+            message = await receive()
+            if message["type"] != "http.request" or state["done"]:
+                return message
+
+            more_body = message.get("more_body", False)
+            remaining = max_size - state["size"] + 1
+            body = decompressor.decompress(message.get("body", b""), remaining)
+            if not more_body:
+                body += decompressor.flush()
+                state["done"] = True
+
+            state["size"] += len(body)
+            if state["size"] > max_size:
+                raise RequestBodyTooLarge()
+
+            return {
+                "type": "http.request",
+                "body": body,
+                "more_body": more_body,
+            }
+
+        return decoding_receive
+
+    async def _send(self, message: dict):
+        """Intercept the app's response messages and encode the body."""
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            self.response_started = True
+            await self._start_response(start, message)
+
+        elif self.compressor is not None:
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            await self.send({
+                "type": "http.response.body",
+                "body": self.compressor.chunk(body) if more_body
+                else self.compressor.finish(body),
+                "more_body": more_body,
+            })
+
+        else:
+            await self.send(message)
+
+    async def _start_response(self, start: dict, message: dict):
+        """Choose the response coding, then send the start and first body."""
+        headers = _add_vary(list(start.get("headers", [])))
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        encoding = self.encoding
+        etag = _get_header(headers, b"etag")
+        content_type = (_get_header(headers, b"content-type") or "").encode()
+
+        if encoding is None \
+                or _get_header(headers, b"content-encoding") is not None \
+                or not _COMPRESSIBLE_TYPES.match(content_type.lower()) \
+                or (not more_body
+                    and len(body) < self.middleware.minimum_size):
+            if encoding and etag and start["status"] == 304 \
+                    and variant_etag(etag, encoding) in self.if_none_match:
+                headers = _set_header(
+                    headers, b"etag", variant_etag(etag, encoding),
+                )
+            await self.send(dict(start, headers=headers))
+            await self.send(message)
+            return
+
+        headers = _set_header(headers, b"content-encoding", encoding)
+        if etag:
+            headers = _set_header(
+                headers, b"etag", variant_etag(etag, encoding),
+            )
+
+        if more_body:
+            # Streamed response: compress (and flush) chunk by chunk
+            self.compressor = COMPRESSORS[encoding](self.middleware.level)
+            headers = _remove_header(headers, b"content-length")
+            await self.send(dict(start, headers=headers))
+            await self.send({
+                "type": "http.response.body",
+                "body": self.compressor.chunk(body),
+                "more_body": True,
+            })
+            return
+
+        cache = self.middleware.variant_cache
+        compressed = cache.get(etag, encoding) if etag else None
+        if compressed is None:
+            if len(body) > _OFFLOAD_SIZE:
+                compressed = await asyncio.get_event_loop().run_in_executor(
+                    None, compress, encoding, body, self.middleware.level,
+                )
+            else:
+                compressed = compress(encoding, body, self.middleware.level)
+            if etag and not etag.startswith("W/"):
+                cache.put(etag, encoding, compressed)
+
+        headers = _set_header(
+            headers, b"content-length", str(len(compressed)),
+        )
+        await self.send(dict(start, headers=headers))
+        await self.send({"type": "http.response.body", "body": compressed})
+
+    async def _send_error(self, status_code: int, error: str):
+        """Send a JSON error response."""
+        body = json.dumps({"error": error}).encode("utf-8")
+        await self.send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+            ],
+        })
+        await self.send({"type": "http.response.body", "body": body})
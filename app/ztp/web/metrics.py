@@ -0,0 +1,87 @@
+"""ASGI middleware that records request metrics.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import time
+from typing import Callable, Optional
+
+from ztp.context import RequestContext, set_context
+from ztp.metrics import (
+    http_request_duration, http_request_mongo_operations,
+    http_requests_in_flight,
+)
+
+
+# Route label for requests that do not match a registered route
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware(object):
+    """ASGI middleware that records per-route request metrics.
+
+    Records the request latency (until the app has sent the complete
+    response), the number of requests in flight, and the number of MongoDB
+    operations made while serving the request.  Requests are labeled with
+    the route pattern (e.g. `/config/{serial_number}`), not the request
+    path, to keep the number of label values bounded.
+    """
+
+    def __init__(self, app, route_for: Callable[[str], Optional[str]]):
+        """Wrap an ASGI app with request metrics.
+
+        Args:
+            app: The ASGI app.
+            route_for: Function that finds the route for a request path.
+        """
+        self.app = app
+        self.route_for = route_for
+
+    def __call__(self, scope: dict):
+        """Create the ASGI application instance for a connection."""
+        if scope["type"] != "http":
+            return self.app(scope)
+
+        route = self.route_for(scope["path"]) or UNMATCHED_ROUTE
+        method = scope["method"]
+        inner = self.app(scope)
+
+        async def measured(receive, send):
+            context = RequestContext(route)
+            set_context(context)
+            status = 500
+
+            async def measured_send(message: dict):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                await send(message)
+
+            http_requests_in_flight.inc(route=route)
+            start = time.perf_counter()
+            try:
+                await inner(receive, measured_send)
+            finally:
+                http_request_duration.observe(
+                    time.perf_counter() - start,
+                    method=method, route=route, status=status,
+                )
+                http_requests_in_flight.dec(route=route)
+                http_request_mongo_operations.observe(
+                    context.mongo_operations, route=route,
+                )
+
+        return measured
@@ -0,0 +1,187 @@
+"""Keyset pagination and streamed listings for the API collections.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from itertools import islice
+import json
+import logging
+from typing import (
+    AsyncIterator, Callable, Iterator, NamedTuple, Optional, Tuple,
+)
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+from responder import Request, Response
+
+from ztp.config import API_MAX_PAGE_SIZE, API_STREAM_BATCH_SIZE
+from ztp.executor import run_sync
+from ztp.storage import to_api
+from ztp.web import api
+
+
+logger = logging.getLogger(__name__)
+
+NDJSON = "ndjson"
+JSON = "json"
+
+STREAM_CONTENT_TYPES = {
+    NDJSON: "application/x-ndjson",
+    JSON: "application/json",
+}
+
+
+def get_page_parameters(req: Request) -> Tuple[Optional[int], Optional[str]]:
+    """Get the `limit` and `after` keyset-pagination query parameters.
+
+    Returns:
+        A tuple containing the page size limit (None when the listing is not
+        paginated) and the key value that the listing should start after.
+
+    Raises:
+        ValueError: If the limit is not an integer between one and the
+            maximum page size.
+    """
+    limit = req.params.get("limit")
+    after = req.params.get("after") or None
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= API_MAX_PAGE_SIZE:
+            raise ValueError(
+                f"The `limit` query parameter must be an integer between 1 "
+                f"and {API_MAX_PAGE_SIZE}."
+            )
+
+    return limit, after
+
+
+def get_stream_format(req: Request) -> Optional[str]:
+    """Get the requested streaming format, if the client requested one.
+
+    Clients request a streamed listing with the `stream` query parameter
+    (`ndjson` or `json`) or by accepting `application/x-ndjson`.
+
+    Raises:
+        ValueError: If the `stream` query parameter has an unknown value.
+    """
+    stream_format = req.params.get("stream")
+    if stream_format is None:
+        if "application/x-ndjson" in req.headers.get("Accept", ""):
+            return NDJSON
+        return None
+
+    stream_format = stream_format.lower()
+    if stream_format not in STREAM_CONTENT_TYPES:
+        raise ValueError(
+            f"The `stream` query parameter must be one of: "
+            f"{', '.join(STREAM_CONTENT_TYPES)}."
+        )
+    return stream_format
+
+
+# Finder signature: find(after, limit) -> storage records, ordered by key
+Finder = Callable[[Optional[str], Optional[int]], Iterator[NamedTuple]]
+
+
+def set_next_page_link(req: Request, resp: Response, after: str, limit: int):
+    """Add a `Link` header pointing to the next page of a listing."""
+    url = urlsplit(req.full_url)
+    query = {key: req.params.get(key) for key in req.params}
+    query.update(after=after, limit=limit)
+    next_url = urlunsplit(url._replace(query=urlencode(query)))
+    resp.headers["Link"] = f'<{next_url}>; rel="next"'
+
+
+async def stream_documents(
+        find: Finder,
+        after: Optional[str],
+        limit: Optional[int],
+        stream_format: str,
+) -> AsyncIterator[bytes]:
+    """Stream the records from a finder as NDJSON or a JSON array.
+
+    Records are read from the storage iterator, in batches, in the database
+    executor and are encoded and sent as they arrive, so the memory used is
+    constant regardless of the size of the collection.
+
+    Args:
+        find: Function that finds the records to be streamed.
+        after: Only stream the records whose key sorts after this value.
+        limit: The maximum number of records to stream.
+        stream_format: Either `ndjson` or `json`.
+    """
+    iterator = await run_sync(find, after, limit)
+
+    if stream_format == JSON:
+        yield b"["
+
+    first = True
+    while True:
+        batch = await run_sync(
+            lambda: list(islice(iterator, API_STREAM_BATCH_SIZE))
+        )
+        if not batch:
+            break
+
+        lines = [json.dumps(to_api(record)) for record in batch]
+        if stream_format == NDJSON:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+        else:
+            chunk = ",".join(lines)
+            yield (chunk if first else "," + chunk).encode("utf-8")
+        first = False
+
+    if stream_format == JSON:
+        yield b"]"
+
+
+async def list_documents(req: Request, resp: Response, find: Finder,
+                         key: str):
+    """Respond with a paginated, streamed, or complete document listing.
+
+    Args:
+        req: The API request.
+        resp: The API response.
+        find: Function that finds the storage records, ordered by key.
+        key: The unique, indexed field used as the pagination cursor.
+    """
+    try:
+        limit, after = get_page_parameters(req)
+        stream_format = get_stream_format(req)
+
+    except ValueError as error:
+        logger.error(error)
+        resp.status_code = api.status_codes.HTTP_400
+        resp.media = {"error": str(error)}
+
+    else:
+        if stream_format:
+            resp.headers["Content-Type"] = STREAM_CONTENT_TYPES[stream_format]
+            resp.stream(stream_documents, find, after, limit, stream_format)
+            return
+
+        # When paginating, request one extra record to detect a next page
+        records = await run_sync(
+            lambda: list(find(after, limit + 1 if limit else None))
+        )
+        if limit is not None and len(records) > limit:
+            records = records[:limit]
+            set_next_page_link(req, resp, getattr(records[-1], key), limit)
+
+        resp.media = [to_api(record) for record in records]
@@ -0,0 +1,82 @@
+"""Request tracing middleware.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from ztp.config import TRACING_ENABLED
+from ztp.context import current_context
+from ztp.tracing import Trace, finish_trace, server_timing
+
+
+class TracingMiddleware(object):
+    """ASGI middleware that traces each request.
+
+    Starts a trace (with a root span for the request) on the request
+    context, so the code serving the request can record its stages as
+    spans.  The stage durations are sent in a `Server-Timing` response
+    header; when the request is complete, the trace is checked against the
+    slow-request threshold and exported.
+
+    Must be wrapped by the metrics middleware, which creates the request
+    context.
+    """
+
+    def __init__(self, app):
+        """Wrap an ASGI app with request tracing."""
+        self.app = app
+
+    def __call__(self, scope: dict):
+        """Create the ASGI application instance for a connection."""
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            return self.app(scope)
+
+        inner = self.app(scope)
+
+        async def traced(receive, send):
+            context = current_context()
+            if context is None:
+                await inner(receive, send)
+                return
+
+            trace = Trace(
+                f"{scope['method']} {context.route}",
+                attributes={
+                    "http.method": scope["method"],
+                    "http.route": context.route,
+                    "http.target": scope["path"],
+                },
+            )
+            context.trace = trace
+
+            async def traced_send(message: dict):
+                if message["type"] == "http.response.start":
+                    trace.root.set_attribute(
+                        "http.status_code", message["status"],
+                    )
+                    message = dict(message, headers=list(
+                        message.get("headers", [])
+                    ) + [(
+                        b"server-timing",
+                        server_timing(trace).encode("latin-1"),
+                    )])
+                await send(message)
+
+            try:
+                await inner(receive, traced_send)
+            finally:
+                finish_trace(trace)
+
+        return traced
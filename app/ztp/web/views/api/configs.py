@@ -0,0 +1,365 @@
+"""Bulk device-configuration rendering API endpoints.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import asyncio
+from itertools import groupby, islice
+import json
+import logging
+from operator import attrgetter
+import tarfile
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+
+import jinja2
+from responder import Request, Response
+
+from ztp.config import BULK_RENDER_BATCH_SIZE, RENDER_EXECUTOR_WORKERS
+from ztp.executor import run_render, run_sync
+from ztp.render_cache import render_cache
+from ztp.render_pool import RenderError, load_template, render_isolated
+from ztp.storage import DeviceDataRecord, storage
+from ztp.template_versions import template_versions
+from ztp.web import api
+
+
+logger = logging.getLogger(__name__)
+
+
+NDJSON = "ndjson"
+TAR = "tar"
+
+CONTENT_TYPES = {
+    NDJSON: "application/x-ndjson",
+    TAR: "application/x-tar",
+}
+
+
+class _NdjsonWriter(object):
+    """Encode rendered configurations as newline-delimited JSON."""
+
+    @staticmethod
+    def config(serial_number: str, template_name: str,
+               content: bytes) -> bytes:
+        return (json.dumps({
+            "serial_number": serial_number,
+            "template_name": template_name,
+            "config": content.decode("utf-8"),
+        }) + "\n").encode("utf-8")
+
+    @staticmethod
+    def error(serial_number: str, error: str) -> bytes:
+        return (json.dumps({
+            "serial_number": serial_number,
+            "error": error,
+        }) + "\n").encode("utf-8")
+
+    @staticmethod
+    def close() -> bytes:
+        return b""
+
+
+class _TarWriter(object):
+    """Encode rendered configurations as a (streamed) tar archive.
+
+    Each configuration is written as `<serial_number>.cfg`; any errors are
+    collected and written to `errors.ndjson` at the end of the archive.
+    """
+
+    def __init__(self):
+        self.errors = []
+        self.mtime = time.time()
+
+    def config(self, serial_number: str, template_name: str,
+               content: bytes) -> bytes:
+        return self._file(f"{serial_number}.cfg", content)
+
+    def error(self, serial_number: str, error: str) -> bytes:
+        self.errors.append(_NdjsonWriter.error(serial_number, error))
+        return b""
+
+    def close(self) -> bytes:
+        errors = self._file("errors.ndjson", b"".join(self.errors)) \
+            if self.errors else b""
+        return errors + b"\0" * (2 * tarfile.BLOCKSIZE)
+
+    def _file(self, name: str, content: bytes) -> bytes:
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        info.mtime = self.mtime
+        info.mode = 0o644
+        padding = -len(content) % tarfile.BLOCKSIZE
+        return info.tobuf(format=tarfile.PAX_FORMAT) + content \
+            + b"\0" * padding
+
+
+def parse_render_request(data) \
+        -> Tuple[Optional[List[str]], Optional[str]]:
+    """Validate a bulk render request.
+
+    Returns:
+        A tuple containing the list of requested serial numbers (None when
+        selecting devices by template name) and the template name filter.
+
+    Raises:
+        ValueError: If the request is not valid.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("The request body should be a JSON object.")
+
+    serial_numbers = data.get("serial_numbers")
+    template_name = data.get("template_name")
+
+    if serial_numbers is not None:
+        if not isinstance(serial_numbers, list) or not all(
+            isinstance(serial_number, str) for serial_number in serial_numbers
+        ):
+            raise ValueError("`serial_numbers` should be a list of strings.")
+        return list(dict.fromkeys(serial_numbers)), template_name
+
+    if isinstance(template_name, str) and template_name:
+        return None, template_name
+
+    raise ValueError(
+        "Specify the devices to render with a `serial_numbers` list or a "
+        "`template_name`."
+    )
+
+
+def get_output_format(req: Request) -> str:
+    """Get the requested output format: NDJSON (default) or a tar archive."""
+    output_format = req.params.get("format")
+    if output_format is None:
+        return TAR if "application/x-tar" in req.headers.get("Accept", "") \
+            else NDJSON
+    if output_format not in CONTENT_TYPES:
+        raise ValueError(
+            f"The `format` query parameter must be one of: "
+            f"{', '.join(CONTENT_TYPES)}."
+        )
+    return output_format
+
+
+def _render_chunk(template_name: str, template_version: str,
+                  device_data_objects: List[DeviceDataRecord]) \
+        -> List[Tuple[str, Optional[bytes], Optional[str]]]:
+    """Render a chunk of device configurations with one template.
+
+    Returns:
+        A `(serial_number, content, error)` tuple for each device.
+    """
+    rendered = []
+    for device_data_object in device_data_objects:
+        cache_key = render_cache.make_key(
+            serial_number=device_data_object.serial_number,
+            device_updated=device_data_object.updated,
+            template_version=template_version,
+        )
+        content = render_cache.get(cache_key)
+        if content is None:
+            try:
+                rendered_version, content = render_isolated(
+                    template_name,
+                    template_version,
+                    device_data_object.config_data,
+                )
+            except RenderError as error:
+                rendered.append(
+                    (device_data_object.serial_number, None, str(error))
+                )
+                continue
+            except jinja2.TemplateNotFound:
+                rendered.append((
+                    device_data_object.serial_number,
+                    None,
+                    f"The template `{template_name}` could not be found.",
+                ))
+                continue
+            render_cache.put(
+                cache_key._replace(template_version=rendered_version),
+                template_name,
+                content,
+            )
+        rendered.append((device_data_object.serial_number, content, None))
+    return rendered
+
+
+async def render_group(template_name: str, template_version: str,
+                       device_data_objects: List[DeviceDataRecord]) \
+        -> List[Tuple[str, Optional[bytes], Optional[str]]]:
+    """Render a group of devices that share a template, in parallel."""
+    chunk_size = max(
+        1, -(-len(device_data_objects) // RENDER_EXECUTOR_WORKERS),
+    )
+    chunks = [
+        device_data_objects[index:index + chunk_size]
+        for index in range(0, len(device_data_objects), chunk_size)
+    ]
+    results = await asyncio.gather(*[
+        run_render(_render_chunk, template_name, template_version, chunk)
+        for chunk in chunks
+    ])
+    return [rendered for chunk in results for rendered in chunk]
+
+
+async def render_configs(serial_numbers: Optional[List[str]],
+                         template_name: Optional[str],
+                         output_format: str) -> AsyncIterator[bytes]:
+    """Render and stream the configurations for the selected devices.
+
+    The device records are read with a single query, in batches, ordered by
+    template so each template is loaded once per group of devices, and each
+    group is rendered in parallel in the render executor.
+    """
+    writer = _TarWriter() if output_format == TAR else _NdjsonWriter()
+    found = set()
+
+    iterator = await run_sync(
+        storage.select_device_data, serial_numbers, template_name,
+    )
+    while True:
+        batch = await run_sync(
+            lambda: list(islice(iterator, BULK_RENDER_BATCH_SIZE))
+        )
+        if not batch:
+            break
+
+        for template_name, group in groupby(
+            batch, key=attrgetter("template_name"),
+        ):
+            group = list(group)
+            found.update(device.serial_number for device in group)
+
+            try:
+                template_version = \
+                    template_versions.closure_version(template_name) \
+                    or await run_sync(load_template, template_name)
+            except jinja2.TemplateNotFound:
+                yield b"".join(
+                    writer.error(
+                        device.serial_number,
+                        f"The template `{template_name}` could not be found.",
+                    )
+                    for device in group
+                )
+                continue
+
+            yield b"".join(
+                writer.config(serial_number, template_name, content)
+                if error is None else writer.error(serial_number, error)
+                for serial_number, content, error in await render_group(
+                    template_name, template_version, group,
+                )
+            )
+
+    for serial_number in serial_numbers or []:
+        if serial_number not in found:
+            yield writer.error(
+                serial_number,
+                f"The device data for serial number `{serial_number}` could "
+                f"not be found.",
+            )
+
+    yield writer.close()
+
+
+@api.route("/api/configs/render")
+class ConfigRenderResource(object):
+    """API endpoint for bulk device-configuration rendering.
+
+    ---
+    post:
+        summary: Render Device Configurations
+        description: >
+            Render the configurations for many devices, selected by serial
+            number and/or template name, and stream them as newline-delimited
+            JSON (one object per device) or as a tar archive (one
+            `<serial_number>.cfg` file per device).
+        tags:
+            - Device Configurations
+        parameters:
+        - in: query
+          name: format
+          description: Output format (default `ndjson`).
+          schema:
+            type: string
+            enum: [ndjson, tar]
+        requestBody:
+            description: The devices to render.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            serial_numbers:
+                                type: array
+                                items:
+                                    type: string
+                            template_name:
+                                type: string
+        responses:
+            200:
+                description: OK
+                content:
+                    application/x-ndjson:
+                        schema:
+                            type: object
+                            properties:
+                                serial_number:
+                                    type: string
+                                template_name:
+                                    type: string
+                                config:
+                                    type: string
+                                error:
+                                    type: string
+                    application/x-tar:
+                        schema:
+                            type: string
+                            format: binary
+            400:
+                description: Bad Request
+                schema:
+                    type: object
+                    required:
+                        - error
+                    properties:
+                        error:
+                            type: string
+    """
+
+    @staticmethod
+    async def on_post(req: Request, resp: Response):
+        """Render device configurations in bulk."""
+        try:
+            data = await req.media()
+            serial_numbers, template_name = parse_render_request(data)
+            output_format = get_output_format(req)
+
+        except (json.JSONDecodeError, ValueError) as error:
+            logger.error(error)
+            resp.status_code = api.status_codes.HTTP_400
+            resp.media = {"error": str(error)}
+
+        else:
+            resp.headers["Content-Type"] = CONTENT_TYPES[output_format]
+            if output_format == TAR:
+                resp.headers["Content-Disposition"] = \
+                    'attachment; filename="configs.tar"'
+            resp.stream(
+                render_configs, serial_numbers, template_name, output_format,
+            )
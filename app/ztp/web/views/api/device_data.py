@@ -16,15 +16,24 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+from collections import Counter
 import logging
 import json
+from typing import Dict, List, Optional, Tuple, Union
 
-from marshmallow import Schema, fields, post_load
-import mongoengine
+from marshmallow import Schema, fields
 from responder import Request, Response
 
-from ztp.mongo.models.device_data import DeviceData
-from ztp.web import api
+from ztp.config import VALIDATION_MAX_ERRORS
+from ztp.executor import run_sync
+from ztp.storage import (
+    FAILED, DeviceDataRecord, DoesNotExist, NotUniqueError, SyncOutcome,
+    ValidationError, make_device_data, storage, to_api,
+)
+from ztp.utils import etag_matches, make_etag
+from ztp.validation import summarize_errors, validate_device_data
+from ztp.web import api, not_modified
+from ztp.web.pagination import list_documents
 
 
 logger = logging.getLogger(__name__)
@@ -41,10 +50,112 @@ class DeviceDataSchema(Schema):
     class Meta:
         ordered = True
 
-    @post_load
-    def make_device_data_object(self, data: dict) -> DeviceData:
-        """Deserialize device-data to a DeviceData object."""
-        return DeviceData(**data)
+
+def load_device_data(data, serial_number: Optional[str] = None) \
+        -> DeviceDataRecord:
+    """Deserialize and validate an uploaded device data record.
+
+    Args:
+        data: The uploaded record (a JSON object).
+        serial_number: The serial number from the URL, which overrides any
+            serial number in the uploaded record.
+
+    Raises:
+        ValidationError: If the record is not valid.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError("A device data record should be an object.")
+    data = DeviceDataSchema().load(data)[0]
+    return make_device_data(
+        serial_number or data.get("serial_number"),
+        data.get("template_name"),
+        data.get("config_data"),
+    )
+
+
+# A sync upsert: a valid record, or the failed outcome of an invalid one
+SyncItem = Union[DeviceDataRecord, SyncOutcome]
+
+
+def invalid_records_details(records: List[DeviceDataRecord],
+                            invalid: Dict[int, List[str]]) -> List[dict]:
+    """Describe (the first `VALIDATION_MAX_ERRORS`) invalid records."""
+    return [
+        {
+            "index": index,
+            "serial_number": records[index].serial_number,
+            "template_name": records[index].template_name,
+            "error": summarize_errors(invalid[index]),
+        }
+        for index in sorted(invalid)[:VALIDATION_MAX_ERRORS]
+    ]
+
+
+def load_sync_request(data) -> Tuple[List[SyncItem], List[str]]:
+    """Validate a device data sync request.
+
+    Invalid upsert records do not fail the whole request; each one is
+    reported as a failed outcome.
+
+    Returns:
+        A tuple containing the upserts (a record, or the failed outcome of
+        each invalid record), and the serial numbers to delete.
+
+    Raises:
+        ValidationError: If the request itself is not valid.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError("The request body should be a JSON object.")
+
+    upserts = data.get("upsert", [])
+    deletes = data.get("delete", [])
+    if not isinstance(upserts, list):
+        raise ValidationError(
+            "`upsert` should be a list of device data records."
+        )
+    if not isinstance(deletes, list) or not all(
+        isinstance(serial_number, str) for serial_number in deletes
+    ):
+        raise ValidationError("`delete` should be a list of serial numbers.")
+
+    items = []
+    for item in upserts:
+        try:
+            items.append(load_device_data(item))
+        except ValidationError as error:
+            serial_number = item.get("serial_number") \
+                if isinstance(item, dict) else None
+            items.append(SyncOutcome(serial_number, FAILED, str(error)))
+    return items, deletes
+
+
+async def validate_sync_items(items: List[SyncItem]) -> List[SyncItem]:
+    """Fail the upserted records that are not valid for their templates."""
+    positions = [
+        position for position, item in enumerate(items)
+        if isinstance(item, DeviceDataRecord)
+    ]
+    invalid = await validate_device_data([items[p] for p in positions])
+    items = list(items)
+    for index, errors in invalid.items():
+        record = items[positions[index]]
+        items[positions[index]] = SyncOutcome(
+            record.serial_number, FAILED, summarize_errors(errors),
+        )
+    return items
+
+
+def sync_device_data(items: List[SyncItem],
+                     deletes: List[str]) -> List[SyncOutcome]:
+    """Sync the valid records, and merge in the invalid records' outcomes."""
+    outcomes = iter(storage.sync_device_data(
+        [item for item in items if isinstance(item, DeviceDataRecord)],
+        deletes,
+    ))
+    return [
+        next(outcomes) if isinstance(item, DeviceDataRecord) else item
+        for item in items
+    ] + list(outcomes)
 
 
 @api.route("/api/device_data")
@@ -54,9 +165,34 @@ class DeviceDataCollectionResource(object):
     ---
     get:
         summary: List Device Data Records
-        description: List all device data records.
+        description: >
+            List device data records, ordered by serial number.  The listing
+            may be paginated or streamed.
         tags:
             - Device Data
+        parameters:
+        - in: query
+          name: limit
+          description: >
+              Maximum number of records to return; when there are more
+              records, a `Link` header points to the next page.
+          schema:
+            type: integer
+        - in: query
+          name: after
+          description: >
+              Return the records whose serial number sorts after this
+              value (the keyset-pagination cursor).
+          schema:
+            type: string
+        - in: query
+          name: stream
+          description: >
+              Stream the records from the database as newline-delimited JSON
+              (`ndjson`) or as a chunked JSON array (`json`).
+          schema:
+            type: string
+            enum: [ndjson, json]
         responses:
             200:
                 description: OK
@@ -66,12 +202,26 @@ class DeviceDataCollectionResource(object):
                             type: array
                             items:
                                 $ref: "#/components/schemas/DeviceData"
+                    application/x-ndjson:
+                        schema:
+                            $ref: "#/components/schemas/DeviceData"
+            400:
+                description: Bad Request
+                schema:
+                    type: object
+                    required:
+                        - error
+                    properties:
+                        error:
+                            type: string
 
     post:
         summary: Replace ALL Device Data Records
         description: >
             Clear all existing device data records and replace with the
-            uploaded device data.
+            uploaded device data.  The new records are loaded into a staging
+            collection and swapped in atomically; readers never see a
+            partially uploaded dataset.
         tags:
             - Device Data
         requestBody:
@@ -100,36 +250,156 @@ class DeviceDataCollectionResource(object):
                     properties:
                         error:
                             type: string
+
+    patch:
+        summary: Sync Device Data Records
+        description: >
+            Create, update, and delete device data records in bulk, writing
+            only the records that changed.  Each upserted record's content
+            hash (its template name and config data) is compared with the
+            stored record's hash; unchanged records are not written.  The
+            records are written independently: the response reports the
+            outcome of each record, in request order (the upserts, then the
+            deletes), and a summary count of each outcome.
+        tags:
+            - Device Data
+        requestBody:
+            description: >
+                The records to upsert and the serial numbers to delete.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            upsert:
+                                type: array
+                                items:
+                                    $ref: "#/components/schemas/DeviceData"
+                            delete:
+                                type: array
+                                items:
+                                    type: string
+        responses:
+            200:
+                description: OK
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            properties:
+                                summary:
+                                    type: object
+                                    additionalProperties:
+                                        type: integer
+                                results:
+                                    type: array
+                                    items:
+                                        type: object
+                                        properties:
+                                            serial_number:
+                                                type: string
+                                            result:
+                                                type: string
+                                                enum: [created, updated,
+                                                       unchanged, deleted,
+                                                       not_found, failed]
+                                            error:
+                                                type: string
+            400:
+                description: Bad Request
+                schema:
+                    type: object
+                    required:
+                        - error
+                    properties:
+                        error:
+                            type: string
     """
 
     @staticmethod
-    def on_get(req: Request, resp: Response):
-        """List all device data records."""
-        device_data_objects = list(DeviceData.objects())
-        schema = DeviceDataSchema(many=True)
-        data = list(schema.dump(device_data_objects)[0])
-        resp.media = data
+    async def on_get(req: Request, resp: Response):
+        """List device data records."""
+        await list_documents(
+            req, resp, find=storage.find_device_data, key="serial_number",
+        )
 
     @staticmethod
     async def on_post(req: Request, resp: Response):
         """Replace device data collection."""
         try:
             data = await req.media()
-            schema = DeviceDataSchema(many=True)
-            device_data_objects = schema.load(data)[0]
-            for device_data_object in device_data_objects:
-                device_data_object.validate()
+            if not isinstance(data, list):
+                raise ValidationError(
+                    "The posted data should be a list of device data records."
+                )
+            records = [load_device_data(item) for item in data]
 
-        except (json.JSONDecodeError, mongoengine.ValidationError) as error:
+        except (json.JSONDecodeError, ValidationError) as error:
             logger.error(error)
             resp.status_code = api.status_codes.HTTP_400
             resp.media = {"error": str(error)}
 
         else:
-            DeviceData.drop_collection()
-            for device_data_object in device_data_objects:
-                device_data_object.save()
-            resp.media = schema.dump(device_data_objects)[0]
+            invalid = await validate_device_data(records)
+            if invalid:
+                resp.status_code = api.status_codes.HTTP_400
+                resp.media = {
+                    "error": f"The device data was not replaced; "
+                             f"{len(invalid)} records are missing config "
+                             f"data their templates need.",
+                    "details": invalid_records_details(records, invalid),
+                }
+                return
+
+            try:
+                records = await run_sync(storage.replace_device_data, records)
+
+            except NotUniqueError as error:
+                logger.error(error)
+                resp.status_code = api.status_codes.HTTP_400
+                resp.media = {
+                    "error": "The device data was not replaced; the uploaded "
+                             "records violate a unique constraint (duplicate "
+                             "serial numbers?).",
+                    "details": error.details[:10],
+                }
+
+            else:
+                resp.media = DeviceDataSchema(many=True).dump(records)[0]
+
+    @staticmethod
+    async def on_patch(req: Request, resp: Response):
+        """Sync device data records (bulk upsert and delete)."""
+        try:
+            data = await req.media()
+            items, deletes = load_sync_request(data)
+
+        except (json.JSONDecodeError, ValidationError) as error:
+            logger.error(error)
+            resp.status_code = api.status_codes.HTTP_400
+            resp.media = {"error": str(error)}
+
+        else:
+            items = await validate_sync_items(items)
+            outcomes = await run_sync(sync_device_data, items, deletes)
+            summary = Counter(outcome.result for outcome in outcomes)
+            logger.info(
+                "Synced device data: " + ", ".join(
+                    f"{count} {result}"
+                    for result, count in sorted(summary.items())
+                )
+            )
+            resp.media = {
+                "summary": dict(summary),
+                "results": [
+                    {
+                        key: value
+                        for key, value in outcome._asdict().items()
+                        if value is not None
+                    }
+                    for outcome in outcomes
+                ],
+            }
 
 
 @api.route("/api/device_data/{serial_number}")
@@ -294,41 +564,38 @@ class DeviceDataResource(object):
     """
 
     @staticmethod
-    def on_get(req: Request, resp: Response, *, serial_number: str):
+    async def on_get(req: Request, resp: Response, *, serial_number: str):
         """Get device data, by device serial number."""
-        try:
-            device_data_object = DeviceData.objects.get(
-                serial_number=serial_number
-            )
+        record = await run_sync(storage.get_device_data, serial_number)
 
-        except mongoengine.DoesNotExist:
+        if record is None:
             resp.status_code = api.status_codes.HTTP_404
+            return
 
-        except mongoengine.MultipleObjectsReturned as error:
-            logger.error(error)
-            resp.status_code = api.status_codes.HTTP_500
-            resp.media = {"error": str(error)}
-
+        etag = make_etag(serial_number, record.updated)
+        if etag_matches(req.headers.get("If-None-Match"), etag):
+            not_modified(resp, etag)
         else:
-            schema = DeviceDataSchema()
-            resp.media = schema.dump(device_data_object)[0]
+            resp.headers["ETag"] = etag
+            resp.media = to_api(record)
 
     @staticmethod
     async def on_post(req: Request, resp: Response, *, serial_number: str):
         """Create a new device data record."""
         try:
             data = await req.media()
-            schema = DeviceDataSchema()
-            device_data_object = schema.load(data)[0]
-            device_data_object.serial_number = serial_number
-            device_data_object.save()
+            record = load_device_data(data, serial_number=serial_number)
+            invalid = await validate_device_data([record])
+            if invalid:
+                raise ValidationError(summarize_errors(invalid[0]))
+            record = await run_sync(storage.create_device_data, record)
 
-        except (json.JSONDecodeError, mongoengine.ValidationError) as error:
+        except (json.JSONDecodeError, ValidationError) as error:
             logger.error(error)
             resp.status_code = api.status_codes.HTTP_400
             resp.media = {"error": str(error)}
 
-        except mongoengine.NotUniqueError as error:
+        except NotUniqueError as error:
             logger.error(error)
             resp.status_code = api.status_codes.HTTP_400
             resp.media = {
@@ -338,57 +605,57 @@ class DeviceDataResource(object):
             }
 
         else:
-            resp.media = schema.dump(device_data_object)[0]
+            resp.media = DeviceDataSchema().dump(record)[0]
 
     @staticmethod
     async def on_put(req: Request, resp: Response, *, serial_number: str):
         """Update a device data record."""
         try:
             data = await req.media()
-            assert isinstance(data, dict)
-
-            device_data_object = DeviceData.objects.get(
-                serial_number=serial_number,
+            if not isinstance(data, dict):
+                raise ValidationError(
+                    "The posted data should be an object (dictionary)."
+                )
+
+            # Validate the updated record against its template, as uploads
+            # are validated
+            current = await run_sync(storage.get_device_data, serial_number)
+            if current is None:
+                raise DoesNotExist(f"No device data for {serial_number}.")
+            fields = dict(current._asdict(), **data)
+            updated = make_device_data(
+                fields.get("serial_number"),
+                fields.get("template_name"),
+                fields.get("config_data"),
             )
+            invalid = await validate_device_data([updated])
+            if invalid:
+                raise ValidationError(summarize_errors(invalid[0]))
 
-            for attribute, value in data.items():
-                setattr(device_data_object, attribute, value)
-            device_data_object.save()
-            device_data_object.reload()
+            record = await run_sync(
+                storage.update_device_data, serial_number, data,
+            )
 
-        except (json.JSONDecodeError, mongoengine.ValidationError) as error:
+        except (json.JSONDecodeError, ValidationError) as error:
             logger.error(error)
             resp.status_code = api.status_codes.HTTP_400
             resp.media = {"error": str(error)}
 
-        except mongoengine.DoesNotExist:
-            resp.status_code = api.status_codes.HTTP_404
-
-        except mongoengine.MultipleObjectsReturned as error:
+        except NotUniqueError as error:
             logger.error(error)
-            resp.status_code = api.status_codes.HTTP_500
+            resp.status_code = api.status_codes.HTTP_400
             resp.media = {"error": str(error)}
 
+        except DoesNotExist:
+            resp.status_code = api.status_codes.HTTP_404
+
         else:
-            schema = DeviceDataSchema()
-            resp.media = schema.dump(device_data_object)[0]
+            resp.media = DeviceDataSchema().dump(record)[0]
 
     @staticmethod
-    def on_delete(req: Request, resp: Response, *, serial_number: str):
+    async def on_delete(req: Request, resp: Response, *, serial_number: str):
         """Delete a device data record, by device serial number."""
-        try:
-            device_data_object = DeviceData.objects.get(
-                serial_number=serial_number
-            )
-
-        except mongoengine.DoesNotExist:
-            resp.status_code = api.status_codes.HTTP_404
-
-        except mongoengine.MultipleObjectsReturned as error:
-            logger.error(error)
-            resp.status_code = api.status_codes.HTTP_500
-            resp.media = {"error": str(error)}
-
-        else:
-            device_data_object.delete()
+        if await run_sync(storage.delete_device_data, serial_number):
             resp.status_code = api.status_codes.HTTP_204
+        else:
+            resp.status_code = api.status_codes.HTTP_404
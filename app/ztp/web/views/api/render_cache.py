@@ -0,0 +1,64 @@
+"""Rendered-configuration cache API endpoints.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from responder import Request, Response
+
+from ztp.render_cache import render_cache
+from ztp.web import api
+
+
+@api.route("/api/render_cache")
+class RenderCacheResource(object):
+    """API endpoint for rendered-configuration cache operations.
+
+    ---
+    get:
+        summary: Get Render Cache Statistics
+        description: >
+            Get the rendered-configuration cache utilization and hit/miss
+            counters.
+        tags:
+            - Render Cache
+        responses:
+            200:
+                description: OK
+                content:
+                    application/json:
+                        schema:
+                            type: object
+
+    delete:
+        summary: Clear the Render Cache
+        description: Remove all cached rendered configurations.
+        tags:
+            - Render Cache
+        responses:
+            204:
+                description: No Content
+    """
+
+    @staticmethod
+    def on_get(req: Request, resp: Response):
+        """Get the render cache statistics."""
+        resp.media = render_cache.stats()
+
+    @staticmethod
+    def on_delete(req: Request, resp: Response):
+        """Clear the render cache."""
+        render_cache.clear()
+        resp.status_code = api.status_codes.HTTP_204
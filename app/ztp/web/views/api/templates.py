@@ -19,12 +19,15 @@ or implied.
 import logging
 import json
 
-from marshmallow import Schema, fields, post_load
-import mongoengine
+from marshmallow import Schema, fields
 from responder import Request, Response
 
-from ztp.mongo.models.template import Template
-from ztp.web import api
+from ztp.executor import run_sync
+from ztp.storage import ValidationError, storage, to_api
+from ztp.template_versions import template_versions
+from ztp.utils import etag_matches, make_etag
+from ztp.web import api, not_modified
+from ztp.web.pagination import list_documents
 
 
 logger = logging.getLogger(__name__)
@@ -36,16 +39,13 @@ class TemplateSchema(Schema):
     name = fields.String()
     template = fields.String()
     sha256 = fields.String()
+    dependencies = fields.List(fields.String())
+    variables = fields.List(fields.String())
     updated = fields.DateTime()
 
     class Meta:
         ordered = True
 
-    @post_load
-    def make_template_object(self, data: dict) -> Template:
-        """Deserialize template data to a Template object."""
-        return Template(**data)
-
 
 @api.route("/api/templates")
 class TemplateCollectionResource(object):
@@ -54,9 +54,34 @@ class TemplateCollectionResource(object):
     ---
     get:
         summary: List Templates
-        description: List all templates.
+        description: >
+            List templates, ordered by name.  The listing may be paginated or
+            streamed.
         tags:
             - Templates
+        parameters:
+        - in: query
+          name: limit
+          description: >
+              Maximum number of records to return; when there are more
+              records, a `Link` header points to the next page.
+          schema:
+            type: integer
+        - in: query
+          name: after
+          description: >
+              Return the records whose template name sorts after this
+              value (the keyset-pagination cursor).
+          schema:
+            type: string
+        - in: query
+          name: stream
+          description: >
+              Stream the records from the database as newline-delimited JSON
+              (`ndjson`) or as a chunked JSON array (`json`).
+          schema:
+            type: string
+            enum: [ndjson, json]
         responses:
             200:
                 description: OK
@@ -66,15 +91,26 @@ class TemplateCollectionResource(object):
                             type: array
                             items:
                                 $ref: "#/components/schemas/Template"
+                    application/x-ndjson:
+                        schema:
+                            $ref: "#/components/schemas/Template"
+            400:
+                description: Bad Request
+                schema:
+                    type: object
+                    required:
+                        - error
+                    properties:
+                        error:
+                            type: string
     """
 
     @staticmethod
-    def on_get(req: Request, resp: Response):
-        """List all device data records."""
-        template_objects = list(Template.objects())
-        schema = TemplateSchema(many=True)
-        data = list(schema.dump(template_objects)[0])
-        resp.media = data
+    async def on_get(req: Request, resp: Response):
+        """List templates."""
+        await list_documents(
+            req, resp, find=storage.find_templates, key="name",
+        )
 
 
 @api.route("/api/templates/{name}")
@@ -84,7 +120,9 @@ class TemplatesResource(object):
     ---
     get:
         summary: Get Template Details
-        description: Get template details, by name.
+        description: >
+            Get template details, by name.  The template text (text/plain)
+            is tagged with the template's sha256 hash as its ETag.
         tags:
             - Templates
         parameters:
@@ -93,6 +131,11 @@ class TemplatesResource(object):
           description: Template name.
           schema:
             type: string
+        - in: header
+          name: If-None-Match
+          description: Entity tag(s) of the template the client already has.
+          schema:
+            type: string
         responses:
             200:
                 description: OK
@@ -103,6 +146,8 @@ class TemplatesResource(object):
                     text/plain:
                         schema:
                             type: string
+            304:
+                description: Not Modified
             404:
                 description: Not Found
                 schema:
@@ -190,26 +235,42 @@ class TemplatesResource(object):
   """
 
     @staticmethod
-    def on_get(req: Request, resp: Response, *, name: str):
+    async def on_get(req: Request, resp: Response, *, name: str):
         """Get template details, by name."""
-        try:
-            template_object = Template.objects.get(template_name=name)
-
-        except mongoengine.DoesNotExist:
+        if_none_match = req.headers.get("If-None-Match")
+        text = req.accepts("text/plain")
+        # The text and JSON representations have different entity tags
+        resp.headers["Vary"] = "Accept"
+
+        # The template text is versioned by its sha256 hash; answer
+        # conditional requests from the local template-version table.
+        if text:
+            sha256 = template_versions.get(name)
+            if sha256 and etag_matches(if_none_match, f'"{sha256}"'):
+                not_modified(resp, f'"{sha256}"')
+                return
+
+        template = await run_sync(storage.get_template, name)
+
+        if template is None:
             resp.status_code = api.status_codes.HTTP_404
+            return
 
-        except mongoengine.MultipleObjectsReturned as error:
-            logger.error(error)
-            resp.status_code = api.status_codes.HTTP_500
-            resp.media = {"error": str(error)}
+        if text:
+            etag = f'"{template.sha256}"'
+        else:
+            etag = make_etag(template.sha256, template.updated)
+
+        if etag_matches(if_none_match, etag):
+            not_modified(resp, etag)
+            return
 
+        resp.headers["ETag"] = etag
+        if text:
+            resp.content = template.template.encode("utf-8")
+            resp.headers["Content-Type"] = "text/plain; encoding=utf-8"
         else:
-            if req.accepts("text/plain"):
-                resp.content = template_object.template.encode("utf-8")
-                resp.headers["Content-Type"] = "text/plain; encoding=utf-8"
-            else:
-                schema = TemplateSchema()
-                resp.media = schema.dump(template_object)[0]
+            resp.media = to_api(template)
 
     @staticmethod
     async def on_post(req: Request, resp: Response, *, name: str):
@@ -223,17 +284,11 @@ class TemplatesResource(object):
             else:
                 template_text = await req.text
 
-            # Get the template from MongoDB, if it exists, otherwise create a
-            # new template object.
-            try:
-                template_object = Template.objects.get(name=name)
-            except mongoengine.DoesNotExist:
-                template_object = Template(name=name)
-
-            template_object.template = template_text
-            template_object.save()
+            template = await run_sync(
+                storage.save_template, name, template_text,
+            )
 
-        except (json.JSONDecodeError, mongoengine.ValidationError) as error:
+        except (json.JSONDecodeError, ValidationError) as error:
             logger.error(error)
             resp.status_code = api.status_codes.HTTP_400
             resp.media = {"error": str(error)}
@@ -247,32 +302,17 @@ class TemplatesResource(object):
                          "key."
             }
 
-        except mongoengine.MultipleObjectsReturned as error:
-            logger.error(error)
-            resp.status_code = api.status_codes.HTTP_500
-            resp.media = {"error": str(error)}
-
         else:
             if req.headers["Accept"] == "text/plain":
-                resp.media = template_object.template
+                resp.media = template.template
             else:
                 schema = TemplateSchema()
-                resp.media = schema.dump(template_object)[0]
+                resp.media = schema.dump(template)[0]
 
     @staticmethod
-    def on_delete(req: Request, resp: Response, *, name: str):
+    async def on_delete(req: Request, resp: Response, *, name: str):
         """Delete a device data record, by device serial number."""
-        try:
-            template_object = Template.objects.get(name=name)
-
-        except mongoengine.DoesNotExist:
-            resp.status_code = api.status_codes.HTTP_404
-
-        except mongoengine.MultipleObjectsReturned as error:
-            logger.error(error)
-            resp.status_code = api.status_codes.HTTP_500
-            resp.media = {"error": str(error)}
-
-        else:
-            template_object.delete()
+        if await run_sync(storage.delete_template, name):
             resp.status_code = api.status_codes.HTTP_204
+        else:
+            resp.status_code = api.status_codes.HTTP_404
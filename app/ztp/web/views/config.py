@@ -17,19 +17,32 @@ or implied.
 """
 
 import logging
+from typing import Optional
 
 import jinja2
-import mongoengine
 from responder import Request, Response
 
-from ztp.mongo.models.device_data import DeviceData
-from ztp.template_engine import get_template
-from ztp.web import api
+from ztp.executor import run_render, run_sync
+from ztp.prerender import prerenderer
+from ztp.render_cache import CacheKey, render_cache
+from ztp.render_pool import RenderError, load_template, render_isolated
+from ztp.singleflight import AsyncSingleFlight
+from ztp.storage import DeviceDataRecord, storage
+from ztp.template_versions import template_versions
+from ztp.tracing import annotate, span
+from ztp.utils import etag_matches, make_etag
+from ztp.web import api, not_modified
 
 
 logger = logging.getLogger(__name__)
 
 
+# Concurrent requests for the same device (a stack of switches, or a device
+# retrying aggressively) share one device data lookup and one render
+device_data_lookups = AsyncSingleFlight("device_data_lookup")
+config_renders = AsyncSingleFlight("config_render")
+
+
 @api.route("/config/{serial_number}")
 class ConfigurationTemplateEngineResource(object):
     """API endpoint for configuration template operations.
@@ -47,9 +60,24 @@ class ConfigurationTemplateEngineResource(object):
           description: Device serial number.
           schema:
             type: string
+        - in: header
+          name: If-None-Match
+          description: >
+              Entity tag(s) of the configuration(s) the client already has.
+          schema:
+            type: string
         responses:
             200:
                 description: OK
+                headers:
+                    ETag:
+                        description: >
+                            Entity tag derived from the device data `updated`
+                            timestamp and the template sha256 hash.
+                        schema:
+                            type: string
+            304:
+                description: Not Modified
             404:
                 description: Not Found
                 schema:
@@ -60,7 +88,10 @@ class ConfigurationTemplateEngineResource(object):
                         error:
                             type: string
             500:
-                description: Internal Server Error
+                description: >
+                    Internal Server Error; the device configuration could not
+                    be rendered (the template raised an error, or the render
+                    exceeded the time or output-size limit).
                 schema:
                     type: object
                     required:
@@ -71,37 +102,132 @@ class ConfigurationTemplateEngineResource(object):
     """
 
     @staticmethod
-    def on_get(req: Request, resp: Response, *, serial_number: str):
+    async def on_get(req: Request, resp: Response, *, serial_number: str):
         """Get rendered device configuration, by device serial number."""
-        try:
-            device_data_object = DeviceData.objects.get(
-                serial_number=serial_number
+        annotate({"ztp.serial_number": serial_number})
+        with span("device_data.get"):
+            device_data_object = await device_data_lookups.do(
+                serial_number,
+                lambda: run_sync(storage.get_device_data, serial_number),
             )
-            template = get_template(device_data_object.template_name)
-
-        except mongoengine.DoesNotExist:
+        if device_data_object is None:
             resp.status_code = api.status_codes.HTTP_404
             resp.media = {
                 "error": f"The device data for serial number "
                          f"`{serial_number}` could not be found.",
             }
+            return
+
+        template_name = device_data_object.template_name
+        annotate({"ztp.template": template_name})
+        try:
+            # Answer conditional requests from the local template-version
+            # table, without loading or rendering the template.
+            template_version = template_versions.closure_version(
+                template_name,
+            )
+            etag = config_etag(device_data_object, template_version)
+            if etag and etag_matches(req.headers.get("If-None-Match"), etag):
+                not_modified(resp, etag)
+                return
+
+            # Templates are compiled by the render workers; the server only
+            # needs the version, which the table has unless the template is
+            # new to this process.
+            if template_version is None:
+                with span("template.load"):
+                    template_version = await run_sync(
+                        load_template, template_name,
+                    )
+
+            etag = config_etag(device_data_object, template_version)
+            if etag_matches(req.headers.get("If-None-Match"), etag):
+                not_modified(resp, etag)
+                return
+            resp.headers["ETag"] = etag
+
+            cache_key = render_cache.make_key(
+                serial_number=serial_number,
+                device_updated=device_data_object.updated,
+                template_version=template_version,
+            )
+
+            # In-process cache -> stored pre-rendered copy -> render on demand
+            content = render_cache.get(cache_key)
+            annotate({"ztp.render_cache_hit": content is not None})
+            if content is None:
+                content = await config_renders.do(
+                    cache_key,
+                    lambda: render_configuration(
+                        cache_key, device_data_object,
+                    ),
+                )
 
         except jinja2.TemplateNotFound as error:
             logger.error(error)
+            resp.headers.pop("ETag", None)
             resp.status_code = api.status_codes.HTTP_404
             resp.media = {
-                "error": f"The template `{device_data_object.template_name}` "
-                         f"specified in the device data record could not be "
-                         f"found.",
+                "error": f"The template `{template_name}` specified in the "
+                         f"device data record could not be found.",
             }
 
-        except mongoengine.MultipleObjectsReturned as error:
-            logger.error(error)
+        except RenderError as error:
+            resp.headers.pop("ETag", None)
             resp.status_code = api.status_codes.HTTP_500
             resp.media = {"error": str(error)}
 
         else:
-            resp.content = template.render(
-                config_data=device_data_object.config_data
-            ).encode("utf-8")
+            resp.content = content
             resp.headers["Content-Type"] = "text/plain; encoding=utf-8"
+
+
+async def render_configuration(cache_key: CacheKey,
+                               device_data_object: DeviceDataRecord) -> bytes:
+    """Load the stored pre-rendered configuration, or render it on demand.
+
+    Configurations are rendered in the render pool's worker processes (from
+    the render executor, off the event loop).  The configuration is added to
+    the render cache, under the template version that was rendered.
+
+    Raises:
+        RenderError: The configuration could not be rendered.
+        jinja2.TemplateNotFound: The template does not exist.
+    """
+    with span("prerender.load"):
+        content = await run_sync(
+            prerenderer.load,
+            cache_key.serial_number,
+            cache_key.device_updated,
+            cache_key.template_version,
+        )
+    if content is None:
+        template_version, content = await run_render(
+            render_isolated,
+            device_data_object.template_name,
+            cache_key.template_version,
+            device_data_object.config_data,
+        )
+        cache_key = cache_key._replace(template_version=template_version)
+        prerenderer.store(device_data_object, template_version, content)
+    render_cache.put(cache_key, device_data_object.template_name, content)
+    return content
+
+
+def config_etag(device_data_object: DeviceDataRecord,
+                template_version: Optional[str]) -> Optional[str]:
+    """Create the entity tag for a device's rendered configuration.
+
+    The rendered configuration is determined by the device data (versioned by
+    its `updated` timestamp) and the template (versioned by its sha256 hash).
+
+    Returns:
+        The entity tag, or None if the template version is not known.
+    """
+    if template_version is None:
+        return None
+    return make_etag(
+        device_data_object.serial_number,
+        device_data_object.updated,
+        template_version,
+    )
@@ -0,0 +1,70 @@
+"""Prometheus metrics endpoint.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+from responder import Request, Response
+
+from ztp.bytecode_cache import bytecode_cache
+from ztp.metrics import (
+    CONTENT_TYPE, admission_metrics, cache_metrics, registry,
+    render_pool_metrics,
+)
+from ztp.render_cache import render_cache
+from ztp.render_pool import render_pool
+from ztp.web import api
+from ztp.web.admission import admission
+from ztp.web.compression import compressed_variants
+
+
+cache_metrics({
+    "render": render_cache.stats,
+    "compressed_variants": compressed_variants.stats,
+    "template_bytecode": bytecode_cache.stats,
+})
+admission_metrics(admission.stats)
+render_pool_metrics(render_pool.stats)
+
+
+@api.route("/metrics")
+class MetricsResource(object):
+    """Prometheus metrics endpoint.
+
+    ---
+    get:
+        summary: Get Metrics
+        description: >
+            Get the app metrics (request latencies, in-flight requests,
+            MongoDB operations, template compile and render times, cache
+            hit ratios, the admission limiter, and the render worker pool)
+            in the Prometheus text format.  In multi-process mode, each
+            worker process reports its own metrics.
+        tags:
+            - Metrics
+        responses:
+            200:
+                description: OK
+                content:
+                    text/plain:
+                        schema:
+                            type: string
+    """
+
+    @staticmethod
+    def on_get(req: Request, resp: Response):
+        """Get the metrics in the Prometheus text exposition format."""
+        resp.content = registry.expose().encode("utf-8")
+        resp.headers["Content-Type"] = CONTENT_TYPE
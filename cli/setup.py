@@ -13,6 +13,7 @@ with open(repo_root/"README.md") as readme_file:
     readme = readme_file.read()
 
 requirements = [
+    "aiohttp>=3.3",
     "Click>=6.0",
     "requests"
 ]
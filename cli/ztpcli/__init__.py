@@ -23,4 +23,5 @@ __copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
 
+from ztpcli.async_client import AsyncRapidZtpClient, ItemResult
 from ztpcli.client import RapidZtpClient
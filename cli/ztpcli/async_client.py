@@ -0,0 +1,406 @@
+"""Rapid ZTP App asyncio Client.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import asyncio
+import logging
+from pathlib import Path
+import random
+from typing import (
+    Any, Awaitable, Callable, Iterable, List, NamedTuple, Optional,
+)
+
+import aiohttp
+
+from ztpcli.client import BASE_URL
+from ztpcli.exceptions import ApiError
+from ztpcli.utils import check_type
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bulk-operation progress callback: progress(item_result)
+ProgressCallback = Callable[["ItemResult"], None]
+
+# Status codes that are retried (the server is overloaded or restarting)
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+# Internal server errors are retried only for idempotent requests (a POST
+# may have been applied before the error), and not for rendered
+# configurations (a template error fails again, every time)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RENDER_PATH_PREFIX = "config/"
+
+
+class ItemResult(NamedTuple):
+    """The result of one item of a bulk operation."""
+    item: Any
+    result: Any = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        """Whether the item succeeded."""
+        return self.error is None
+
+
+class AsyncRapidZtpClient(object):
+    """Rapid ZTP App asyncio Client.
+
+    Offers the methods of `RapidZtpClient` as coroutines.  Requests share a
+    pool of keep-alive HTTP connections, and at most `concurrency` requests
+    are in flight at once.  Connection errors, timeouts, and overloaded or
+    unavailable server responses (429, 502, 503, and 504) are retried with
+    exponential backoff, as are internal server errors (500) for idempotent
+    requests other than configuration renders.  The bulk methods run their
+    items concurrently and report a result or an error for each item,
+    rather than stopping at the first failure.
+
+    Use the client as an async context manager, or call `close()` when done:
+
+        async with AsyncRapidZtpClient("ztp.example.com") as client:
+            results = await client.upload_device_data_records(records)
+    """
+
+    def __init__(self, ztp_server: str, port: int = 80,
+                 concurrency: int = 10, retries: int = 3,
+                 backoff: float = 0.5, timeout: float = 30.0):
+        """Initialize a new asyncio Rapid ZTP client object.
+
+        Args:
+            ztp_server: Hostname or IP address of the Rapid ZTP server.
+            port: TCP port number of the Rapid ZTP web server.
+            concurrency: The maximum number of concurrent requests (and
+                pooled connections).
+            retries: The number of times a failed request is retried.
+            backoff: The delay before the first retry, in seconds; the delay
+                doubles with each retry.
+            timeout: The total timeout for each request attempt, in seconds.
+        """
+        check_type(ztp_server, str)
+        check_type(port, int)
+        check_type(concurrency, int)
+        check_type(retries, int)
+        check_type(backoff, (int, float))
+        check_type(timeout, (int, float))
+
+        self._ztp_server = ztp_server.strip().lower()
+        self._port = port
+        self.base_url = BASE_URL.format(
+            host=self._ztp_server,
+            port=self._port,
+        )
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self._headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self) -> "AsyncRapidZtpClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Close the client's pooled connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The client's HTTP session (created on first use)."""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                headers=self._headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def _request(self, method: str, path: str, **kwargs) -> Any:
+        """Make an API request, retrying transient failures.
+
+        Returns:
+            The decoded JSON response body, the response text for other
+            content types, or None for an empty response.
+
+        Raises:
+            ApiError: If the server returned an error response (after any
+                retries).
+            aiohttp.ClientError: If the request failed to connect or
+                complete (after any retries).
+            asyncio.TimeoutError: If the request timed out (after any
+                retries).
+        """
+        url = self.base_url + path
+        session = self.session
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    async with session.request(
+                        method, url, **kwargs
+                    ) as response:
+                        if response.status < 400:
+                            return await _read_body(response)
+                        error = ApiError(
+                            response.status,
+                            _error_message(await _read_body(response)),
+                            url,
+                        )
+                        retry_after = response.headers.get("Retry-After")
+                if not _retryable(method, path, error.status):
+                    raise error
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) \
+                    as connection_error:
+                error = connection_error
+
+            if attempt >= self.retries:
+                raise error
+
+            delay = _retry_delay(self.backoff, attempt, retry_after)
+            logger.warning(
+                f"{method} {url} failed ({error!r}); retrying in "
+                f"{delay:.2f} seconds."
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _gather(self, function: Callable[[Any], Awaitable],
+                      items: Iterable,
+                      progress: Optional[ProgressCallback] = None) \
+            -> List[ItemResult]:
+        """Run a coroutine function for each item, concurrently.
+
+        Args:
+            function: The coroutine function.
+            items: The items.
+            progress: Called with each item's result, as it completes.
+
+        Returns:
+            The result (or error) of each item, in the order given.
+        """
+        async def run(item) -> ItemResult:
+            try:
+                result = ItemResult(item, await function(item))
+            except (ApiError, aiohttp.ClientError, asyncio.TimeoutError,
+                    OSError, ValueError, TypeError) as error:
+                logger.error(f"{item!r}: {error!r}")
+                result = ItemResult(item, error=error)
+            if progress is not None:
+                progress(result)
+            return result
+
+        return list(await asyncio.gather(*[run(item) for item in items]))
+
+    async def upload_template_text(self, template_name: str,
+                                   text: str) -> dict:
+        """Create or update a template, by name, on the ZTP server.
+
+        Args:
+            template_name: The name of the template to be created or updated
+                on the ZTP server.
+            text: The template text.
+
+        Returns:
+            A dictionary with the created template object details.
+        """
+        check_type(template_name, str)
+        check_type(text, str)
+
+        template_name = template_name.strip()
+        return await self._request(
+            "POST", f"api/templates/{template_name}",
+            data=text.encode("utf-8"),
+            headers={"Content-Type": "text/plain; charset=utf-8"},
+        )
+
+    async def upload_template(self, template_path: Path) -> dict:
+        """Upload a template to the ZTP server.
+
+        Args:
+            template_path: The template path on the local file system.
+
+        Returns:
+            A dictionary with the created template object details.
+        """
+        check_type(template_path, Path)
+        with open(template_path, encoding="utf-8") as template_file:
+            template_text = template_file.read()
+        return await self.upload_template_text(
+            template_path.stem, template_text,
+        )
+
+    async def upload_templates(
+            self, template_paths: List[Path],
+            progress: Optional[ProgressCallback] = None) -> List[ItemResult]:
+        """Upload multiple templates to the ZTP server, concurrently.
+
+        Args:
+            template_paths: The template paths on the local file system.
+            progress: Called with each upload's result, as it completes.
+
+        Returns:
+            The result of each upload (the created template object, or the
+            error), in the order given.
+        """
+        check_type(template_paths, list)
+        return await self._gather(
+            self.upload_template, template_paths, progress,
+        )
+
+    async def upload_device_data(self, serial_number: str,
+                                 template_name: str,
+                                 config_data: dict) -> dict:
+        """Upload a device-data record.
+
+        Args:
+            serial_number: The device's serial number.
+            template_name: The name of the configuration template to be
+                applied to the device.
+            config_data: The data to be merged into the configuration template
+                to generate the device's configuration.
+
+        Returns:
+            A dictionary containing the created device-data record.
+        """
+        check_type(serial_number, str)
+        check_type(template_name, str)
+        check_type(config_data, dict)
+
+        serial_number = serial_number.strip().upper()
+        return await self._request(
+            "POST", f"api/device_data/{serial_number}",
+            json={
+                "serial_number": serial_number,
+                "template_name": template_name.strip(),
+                "config_data": config_data,
+            },
+        )
+
+    async def upload_device_data_records(
+            self, data: List[dict],
+            progress: Optional[ProgressCallback] = None) -> List[ItemResult]:
+        """Upload device-data records, concurrently.
+
+        Args:
+            data: A list of device-data records (dict). Each record should
+                include the following key-value pairs: serial_number: str,
+                template_name: str, and config_data: dict.
+            progress: Called with each upload's result, as it completes.
+
+        Returns:
+            The result of each upload (the created data record, or the
+            error), in the order given.
+        """
+        check_type(data, list)
+
+        async def upload(record: dict) -> dict:
+            check_type(record, dict)
+            return await self.upload_device_data(
+                serial_number=record.get("serial_number"),
+                template_name=record.get("template_name"),
+                config_data=record.get("config_data"),
+            )
+
+        return await self._gather(upload, data, progress)
+
+    async def get_device_configuration(self, serial_number: str) -> str:
+        """Get the rendered configuration for a device, by Serial Number.
+
+        Args:
+            serial_number: The device's serial number.
+
+        Returns:
+              A string containing the device's rendered configuration.
+        """
+        check_type(serial_number, str)
+        serial_number = serial_number.strip().upper()
+        return await self._request(
+            "GET", f"config/{serial_number}",
+            headers={"Accept": "text/plain"},
+        )
+
+    async def get_device_configurations(
+            self, serial_numbers: List[str],
+            progress: Optional[ProgressCallback] = None) -> List[ItemResult]:
+        """Get the rendered configurations for many devices, concurrently.
+
+        Args:
+            serial_numbers: The devices' serial numbers.
+            progress: Called with each request's result, as it completes.
+
+        Returns:
+            The result of each request (the rendered configuration, or the
+            error), in the order given.
+        """
+        check_type(serial_numbers, list)
+        return await self._gather(
+            self.get_device_configuration, serial_numbers, progress,
+        )
+
+
+async def _read_body(response: aiohttp.ClientResponse) -> Any:
+    """Read and decode a response body."""
+    if response.content_type == "application/json":
+        return await response.json()
+    text = await response.text()
+    return text if text else None
+
+
+def _error_message(body: Any) -> str:
+    """Get the error message from an error response body."""
+    if isinstance(body, dict) and "error" in body:
+        return str(body["error"])
+    return str(body) if body else "(no response body)"
+
+
+def _retryable(method: str, path: str, status: int) -> bool:
+    """Whether a request that failed with an error status is retried."""
+    if status in RETRY_STATUSES:
+        return True
+    return status == 500 \
+        and method.upper() in IDEMPOTENT_METHODS \
+        and not path.startswith(RENDER_PATH_PREFIX)
+
+
+def _retry_delay(backoff: float, attempt: int,
+                 retry_after: Optional[str] = None) -> float:
+    """Get the delay before retrying a request.
+
+    The server's `Retry-After` delay (in seconds) is honored when present;
+    otherwise the delay backs off exponentially, with jitter so concurrent
+    requests that failed together do not retry in lockstep.
+    """
+    if retry_after is not None:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+    return backoff * 2 ** attempt * random.uniform(0.5, 1.5)
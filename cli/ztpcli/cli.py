@@ -16,17 +16,406 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+import asyncio
+import hashlib
+import json
+from pathlib import Path
 import sys
+from typing import Dict, Iterable, List, Optional
+
 import click
+import requests
+
+from ztpcli.async_client import AsyncRapidZtpClient, ItemResult
+from ztpcli.client import UPLOAD_BATCH_SIZE, RapidZtpClient
+from ztpcli.exceptions import UploadError
+from ztpcli.records import FORMATS, read_device_data
+
+
+DEFAULT_WORKERS = 10
+
+
+class Group(click.Group):
+    """Command group that reports request failures as CLI errors."""
+
+    def invoke(self, ctx: click.Context):
+        try:
+            return super().invoke(ctx)
+        except requests.RequestException as error:
+            raise click.ClickException(str(error))
+
+
+class Settings(object):
+    """Connection settings shared by the subcommands."""
+
+    def __init__(self, server: str, port: int, workers: int):
+        self.server = server
+        self.port = port
+        self.workers = workers
+
+    def client(self) -> RapidZtpClient:
+        """Create a (thread-safe, pooled) client for the server."""
+        return RapidZtpClient(self.server, self.port, pool_size=self.workers)
+
+    def async_client(self) -> AsyncRapidZtpClient:
+        """Create an asyncio client for the server."""
+        return AsyncRapidZtpClient(
+            self.server, self.port, concurrency=self.workers,
+        )
+
+
+def run_bulk(settings: Settings, label: str, length: int, operation) \
+        -> List[ItemResult]:
+    """Run a bulk operation of the asyncio client, with a progress bar.
+
+    Args:
+        settings: The connection settings.
+        label: The progress bar label.
+        length: The number of items.
+        operation: Coroutine function called with the client and a progress
+            callback; returns the item results.
+    """
+    async def run() -> List[ItemResult]:
+        with click.progressbar(length=length, label=label,
+                               file=sys.stderr) as bar:
+            async with settings.async_client() as client:
+                return await operation(client, lambda result: bar.update(1))
+
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(run())
+
+
+def report_errors(results: List[ItemResult], describe) -> int:
+    """Print the failed items of a bulk operation.
+
+    Returns:
+        The number of failed items.
+    """
+    failed = [result for result in results if not result.ok]
+    for result in failed:
+        click.secho(
+            f"  {describe(result.item)}: {result.error}", fg="red", err=True,
+        )
+    return len(failed)
+
+
+def template_paths(directory: Path, pattern: str) -> List[Path]:
+    """Find the template files in a directory."""
+    return sorted(path for path in directory.glob(pattern) if path.is_file())
+
+
+def template_sha256(path: Path) -> str:
+    """Get the sha256 hash of a template file (as the server computes it)."""
+    with open(path, encoding="utf-8") as template_file:
+        return hashlib.sha256(
+            template_file.read().encode("utf-8")
+        ).hexdigest()
+
+
+def record_digest(record: dict) -> str:
+    """Get a digest of a device-data record's template name and data."""
+    return hashlib.sha256(json.dumps(
+        [record.get("template_name"), record.get("config_data") or {}],
+        sort_keys=True,
+    ).encode("utf-8")).hexdigest()
+
+
+def normalize_serial_number(serial_number: str) -> str:
+    """Normalize a serial number the way the client uploads it."""
+    return serial_number.strip().upper()
+
+
+def read_serial_numbers(serial_numbers: Iterable[str],
+                        serials_file: Optional[Path]) -> List[str]:
+    """Collect serial numbers from the arguments and a file (one per line)."""
+    serial_numbers = list(serial_numbers)
+    if serials_file is not None:
+        with open(serials_file, encoding="utf-8") as file:
+            serial_numbers.extend(line for line in file if line.strip())
+    return list(dict.fromkeys(
+        normalize_serial_number(serial_number)
+        for serial_number in serial_numbers
+    ))
+
+
+def print_diff(kind: str, local: Dict[str, str], remote: Dict[str, str],
+               show_unchanged: bool) -> int:
+    """Print the differences between local and server digests, by name.
+
+    Returns:
+        The number of differences.
+    """
+    differences = 0
+    for name in sorted(set(local) | set(remote)):
+        if name not in remote:
+            marker, color = "+", "green"
+        elif name not in local:
+            marker, color = "-", "red"
+        elif local[name] != remote[name]:
+            marker, color = "~", "yellow"
+        else:
+            if show_unchanged:
+                click.echo(f"  {kind} {name}")
+            continue
+        differences += 1
+        click.secho(f"{marker} {kind} {name}", fg=color)
+    return differences
+
+
+@click.group(cls=Group)
+@click.option("--server", envvar="ZTP_SERVER", default="localhost",
+              show_default=True,
+              help="Rapid ZTP server hostname or IP address "
+                   "(env: ZTP_SERVER).")
+@click.option("--port", envvar="ZTP_PORT", type=int, default=80,
+              show_default=True,
+              help="Rapid ZTP server TCP port (env: ZTP_PORT).")
+@click.option("--workers", "-w", type=click.IntRange(min=1),
+              default=DEFAULT_WORKERS, show_default=True,
+              help="Number of requests run in parallel.")
+@click.pass_context
+def main(ctx: click.Context, server: str, port: int, workers: int):
+    """Manage the templates and device data of a Rapid ZTP server."""
+    ctx.obj = Settings(server, port, workers)
+
+
+@main.command("push-templates")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option("--pattern", default="*", show_default=True,
+              help="Glob pattern selecting the template files.")
+@click.pass_obj
+def push_templates(settings: Settings, directory: str, pattern: str):
+    """Upload the templates in DIRECTORY (named by their file stems)."""
+    paths = template_paths(Path(directory), pattern)
+    if not paths:
+        raise click.ClickException(
+            f"No files match `{pattern}` in {directory}."
+        )
+
+    results = run_bulk(
+        settings, "Uploading templates", len(paths),
+        lambda client, progress: client.upload_templates(paths, progress),
+    )
+    failed = report_errors(results, lambda path: path.name)
+    click.echo(f"Uploaded {len(paths) - failed} of {len(paths)} templates.")
+    if failed:
+        sys.exit(1)
+
+
+@main.command("import-data")
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format",
+              type=click.Choice(sorted(set(FORMATS.values()))),
+              help="Record file format (default: from the file suffix).")
+@click.option("--batch-size", type=click.IntRange(min=1),
+              default=UPLOAD_BATCH_SIZE, show_default=True,
+              help="Records sent in each request.")
+@click.option("--offset", type=click.IntRange(min=0), default=0,
+              help="Skip this many records (to resume a failed import).")
+@click.pass_obj
+def import_data(settings: Settings, file: str, file_format: Optional[str],
+                batch_size: int, offset: int):
+    """Create or update the device-data records in FILE.
+
+    FILE is a JSON array, newline-delimited JSON, or CSV file of records;
+    it is streamed to the server in batches, and only the records that
+    changed are written.  Records on the server that are not in FILE are
+    left in place.
+    """
+    def progress(position: int, summary: dict):
+        counts = ", ".join(
+            f"{count} {result}" for result, count in sorted(summary.items())
+        )
+        click.echo(f"\r{position} records ({counts})", nl=False, err=True)
+
+    try:
+        result = settings.client().upload_device_data_file(
+            Path(file),
+            format=file_format,
+            batch_size=batch_size,
+            offset=offset,
+            progress=progress,
+            workers=settings.workers,
+        )
+    except UploadError as error:
+        click.echo(err=True)
+        raise click.ClickException(
+            f"{error}\nResume the import with: --offset {error.offset}"
+        )
+    except ValueError as error:
+        click.echo(err=True)
+        raise click.ClickException(f"Could not read {file}: {error}")
+    click.echo(err=True)
+
+    for failure in result.failures:
+        click.secho(
+            f"  {failure.get('serial_number')}: {failure.get('error')}",
+            fg="red", err=True,
+        )
+    click.echo(
+        f"Imported {result.offset - offset} records: " + ", ".join(
+            f"{count} {outcome}"
+            for outcome, count in sorted(result.summary.items())
+        )
+    )
+    if result.failures:
+        sys.exit(1)
+
+
+@main.command("fetch-configs")
+@click.argument("output_dir", type=click.Path(file_okay=False))
+@click.argument("serial_numbers", nargs=-1)
+@click.option("--serials-file", type=click.Path(exists=True, dir_okay=False),
+              help="File of serial numbers, one per line.")
+@click.option("--template", "template_name",
+              help="Select the devices that use this template.")
+@click.option("--all", "all_devices", is_flag=True,
+              help="Select every device on the server.")
+@click.option("--render", is_flag=True,
+              help="Render the configurations in one bulk request, instead "
+                   "of fetching each device's configuration in parallel.")
+@click.pass_obj
+def fetch_configs(settings: Settings, output_dir: str,
+                  serial_numbers: List[str], serials_file: Optional[str],
+                  template_name: Optional[str], all_devices: bool,
+                  render: bool):
+    """Save device configurations as OUTPUT_DIR/<serial_number>.cfg.
+
+    Select the devices by SERIAL_NUMBERS, --serials-file, --template, or
+    --all.
+    """
+    serial_numbers = read_serial_numbers(
+        serial_numbers, Path(serials_file) if serials_file else None,
+    )
+    if not (serial_numbers or template_name or all_devices):
+        raise click.UsageError(
+            "Select devices by serial number, --serials-file, --template, "
+            "or --all."
+        )
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    client = settings.client()
+
+    def save(serial_number: str, config: str):
+        path = output_dir/f"{serial_number}.cfg"
+        with open(path, "w", encoding="utf-8") as config_file:
+            config_file.write(config)
+
+    if all_devices or (template_name and not serial_numbers):
+        click.echo("Listing devices...", err=True)
+        serial_numbers = [
+            record["serial_number"] for record in client.list_device_data()
+            if not template_name or record["template_name"] == template_name
+        ]
+
+    if render:
+        saved = 0
+        failed = 0
+        with click.progressbar(length=len(serial_numbers),
+                               label="Rendering configurations",
+                               file=sys.stderr) as bar:
+            for result in client.render_device_configurations(
+                serial_numbers=serial_numbers,
+                template_name=template_name,
+            ):
+                if "error" in result:
+                    failed += 1
+                    click.secho(
+                        f"  {result['serial_number']}: {result['error']}",
+                        fg="red", err=True,
+                    )
+                else:
+                    save(result["serial_number"], result["config"])
+                    saved += 1
+                bar.update(1)
+
+    else:
+        def fetch(async_client: AsyncRapidZtpClient, advance):
+            def progress(result: ItemResult):
+                if result.ok:
+                    save(result.item, result.result)
+                advance(result)
+
+            return async_client.get_device_configurations(
+                serial_numbers, progress,
+            )
+
+        results = run_bulk(
+            settings, "Fetching configurations", len(serial_numbers), fetch,
+        )
+        failed = report_errors(results, lambda serial_number: serial_number)
+        saved = len(results) - failed
+
+    click.echo(f"Saved {saved} configurations to {output_dir}.")
+    if failed:
+        sys.exit(1)
+
+
+@main.command("diff")
+@click.option("--templates", "templates_dir",
+              type=click.Path(exists=True, file_okay=False),
+              help="Compare the templates in this directory.")
+@click.option("--pattern", default="*", show_default=True,
+              help="Glob pattern selecting the template files.")
+@click.option("--data", "data_file",
+              type=click.Path(exists=True, dir_okay=False),
+              help="Compare the device-data records in this file.")
+@click.option("--format", "file_format",
+              type=click.Choice(sorted(set(FORMATS.values()))),
+              help="Record file format (default: from the file suffix).")
+@click.option("--show-unchanged", is_flag=True,
+              help="List the unchanged items too.")
+@click.pass_obj
+def diff(settings: Settings, templates_dir: Optional[str], pattern: str,
+         data_file: Optional[str], file_format: Optional[str],
+         show_unchanged: bool):
+    """Compare local templates and device data with the server.
+
+    Lists the items only found locally (+), only found on the server (-),
+    and that differ (~); exits with status 1 when there are differences.
+    """
+    if not (templates_dir or data_file):
+        raise click.UsageError("Specify --templates and/or --data.")
+
+    client = settings.client()
+    differences = 0
+
+    if templates_dir:
+        local = {
+            path.stem: template_sha256(path)
+            for path in template_paths(Path(templates_dir), pattern)
+        }
+        remote = {
+            template["name"]: template["sha256"]
+            for template in client.list_templates()
+        }
+        differences += print_diff(
+            "template", local, remote, show_unchanged,
+        )
 
+    if data_file:
+        try:
+            local = {
+                normalize_serial_number(record["serial_number"]):
+                    record_digest(record)
+                for record in read_device_data(
+                    Path(data_file), format=file_format,
+                )
+            }
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            raise click.ClickException(
+                f"Could not read {data_file}: {error!r}"
+            )
+        remote = {
+            record["serial_number"]: record_digest(record)
+            for record in client.list_device_data()
+        }
+        differences += print_diff("device", local, remote, show_unchanged)
 
-@click.command()
-def main(args=None):
-    """Console script for ztpcli."""
-    click.echo("Replace this message by putting your code into "
-               "ztpcli.cli.main")
-    click.echo("See click documentation at http://click.pocoo.org/")
-    return 0
+    click.echo(f"{differences} differences.", err=True)
+    if differences:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -17,27 +17,55 @@ or implied.
 """
 
 
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import json
 import requests
-
-from ztpcli.utils import check_type
-from typing import List
+from requests.adapters import HTTPAdapter
+
+from ztpcli.exceptions import UploadError
+from ztpcli.records import read_device_data
+from ztpcli.utils import batched, check_type
+from typing import (
+    Callable, Iterable, Iterator, List, NamedTuple, Optional,
+)
 from pathlib import Path
 
-BASE_URL = "http://{host}:port/"
+BASE_URL = "http://{host}:{port}/"
+
+# Records sent in each batch of a streaming upload
+UPLOAD_BATCH_SIZE = 500
+
+
+class UploadResult(NamedTuple):
+    """The result of a streaming device-data upload."""
+    offset: int
+    summary: dict
+    failures: List[dict]
+
+
+# Streaming-upload progress callback: progress(offset, summary)
+ProgressCallback = Callable[[int, dict], None]
 
 
 class RapidZtpClient(object):
     """Rapid ZTP App Client."""
 
-    def __init__(self, ztp_server: str, port: int = 80):
+    def __init__(self, ztp_server: str, port: int = 80,
+                 pool_size: int = 10):
         """Initialize a new Rapid ZTP client object.
 
         Args:
             ztp_server: Hostname or IP address of the Rapid ZTP server.
             port: TCP port number of the Rapid ZTP web server.
+            pool_size: The number of keep-alive connections kept open to
+                the server (at least the number of threads that share the
+                client).
         """
         check_type(ztp_server, str)
         check_type(port, int)
+        check_type(pool_size, int)
 
         self._ztp_server = ztp_server.strip().lower()
         self._port = port
@@ -52,6 +80,7 @@ class RapidZtpClient(object):
 
         self.session = requests.session()
         self.session.headers.update(self._headers)
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=pool_size))
 
     def upload_template_text(self, template_name: str, text: str) -> dict:
         """Create or update a template, by name, on the ZTP server.
@@ -73,6 +102,7 @@ class RapidZtpClient(object):
         response = self.session.post(
             url=self.base_url + f"api/templates/{template_name}",
             data=data,
+            headers={"Content-Type": "text/plain; charset=utf-8"},
         )
         response.raise_for_status()
 
@@ -192,3 +222,221 @@ class RapidZtpClient(object):
         response.raise_for_status()
 
         return response.text
+
+    def list_templates(self) -> Iterator[dict]:
+        """List the templates on the ZTP server, ordered by name.
+
+        The listing is streamed from the server as it is consumed.
+
+        Returns:
+            An iterator of template objects.
+        """
+        return self._stream_ndjson(
+            "GET", "api/templates", params={"stream": "ndjson"},
+        )
+
+    def list_device_data(self) -> Iterator[dict]:
+        """List the device-data records on the ZTP server, by serial number.
+
+        The listing is streamed from the server as it is consumed.
+
+        Returns:
+            An iterator of device-data records.
+        """
+        return self._stream_ndjson(
+            "GET", "api/device_data", params={"stream": "ndjson"},
+        )
+
+    def render_device_configurations(
+            self, serial_numbers: Optional[List[str]] = None,
+            template_name: Optional[str] = None) -> Iterator[dict]:
+        """Render the configurations for many devices in one request.
+
+        Select the devices by serial number and/or template name.  The
+        configurations are streamed from the server as they are consumed.
+
+        Returns:
+            An iterator of dictionaries, one per device, each containing the
+            `serial_number` and either the rendered `config` (and its
+            `template_name`) or an `error`.
+        """
+        check_type(serial_numbers, list, may_be_none=True)
+        check_type(template_name, str, may_be_none=True)
+
+        json_data = {}
+        if serial_numbers is not None:
+            json_data["serial_numbers"] = [
+                serial_number.strip().upper()
+                for serial_number in serial_numbers
+            ]
+        if template_name is not None:
+            json_data["template_name"] = template_name.strip()
+
+        return self._stream_ndjson(
+            "POST", "api/configs/render",
+            params={"format": "ndjson"},
+            json=json_data,
+        )
+
+    def _stream_ndjson(self, method: str, path: str,
+                       **kwargs) -> Iterator[dict]:
+        """Make a request and stream its newline-delimited JSON response."""
+        response = self.session.request(
+            method, self.base_url + path, stream=True, **kwargs
+        )
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def sync_device_data(self, upserts: Optional[List[dict]] = None,
+                         deletes: Optional[List[str]] = None) -> dict:
+        """Create, update, and delete device-data records in bulk.
+
+        Only the records that changed are written by the server.
+
+        Args:
+            upserts: The device-data records to create or update.
+            deletes: The serial numbers of the records to delete.
+
+        Returns:
+            A dictionary with the `summary` count of each outcome and the
+            per-record `results`.
+        """
+        check_type(upserts, list, may_be_none=True)
+        check_type(deletes, list, may_be_none=True)
+
+        response = self.session.patch(
+            url=self.base_url + "api/device_data",
+            json={"upsert": upserts or [], "delete": deletes or []},
+        )
+        response.raise_for_status()
+
+        return response.json()
+
+    def upload_device_data_stream(self, records: Iterable[dict],
+                                  batch_size: int = UPLOAD_BATCH_SIZE,
+                                  offset: int = 0,
+                                  progress: Optional[ProgressCallback] = None,
+                                  workers: int = 1) -> UploadResult:
+        """Upload a stream of device-data records, in batches.
+
+        The records are consumed as they are sent, so the stream can be far
+        larger than memory.  Each batch is upserted with `sync_device_data`;
+        records that fail on the server are reported in the result and do
+        not stop the upload.
+
+        With several workers, batches are sent in parallel (at most two
+        batches per worker are read ahead) and their results are collected
+        in order, so the reported offset only covers complete batches.
+
+        Args:
+            records: The device-data records.
+            batch_size: The number of records sent in each request.
+            offset: The number of records to skip at the start of the stream
+                (to resume a failed upload).
+            progress: Called after each batch with the offset reached and
+                the running summary of the outcomes.
+            workers: The number of batches sent in parallel.
+
+        Returns:
+            The final offset, the summary count of each outcome, and the
+            failed records' outcomes.
+
+        Raises:
+            UploadError: If a batch could not be uploaded; its `offset` is
+                where to resume.
+            ValueError: If a record could not be read from the stream.
+        """
+        check_type(batch_size, int)
+        check_type(offset, int)
+        check_type(workers, int)
+
+        summary = Counter()
+        failures = []
+        records = islice(records, offset, None)
+
+        def upload(batch: List[dict]) -> dict:
+            return self.sync_device_data(upserts=[
+                _normalize_record(record) for record in batch
+            ])
+
+        def collect(batch: List[dict], future):
+            nonlocal offset
+            try:
+                response = future.result()
+            except (requests.RequestException, ValueError) as error:
+                raise UploadError(
+                    f"Uploading records {offset}-{offset + len(batch) - 1} "
+                    f"failed: {error}",
+                    offset=offset,
+                ) from error
+
+            offset += len(batch)
+            summary.update(response.get("summary", {}))
+            failures.extend(
+                result for result in response.get("results", [])
+                if result.get("result") == "failed"
+            )
+            if progress is not None:
+                progress(offset, dict(summary))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            try:
+                for batch in batched(records, batch_size):
+                    pending.append((batch, executor.submit(upload, batch)))
+                    while len(pending) >= 2 * workers \
+                            or pending and pending[0][1].done():
+                        collect(*pending.popleft())
+                while pending:
+                    collect(*pending.popleft())
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+        return UploadResult(offset, dict(summary), failures)
+
+    def upload_device_data_file(self, path: Path,
+                                format: Optional[str] = None,
+                                batch_size: int = UPLOAD_BATCH_SIZE,
+                                offset: int = 0,
+                                progress: Optional[ProgressCallback] = None,
+                                workers: int = 1) -> UploadResult:
+        """Stream device-data records from a JSON, NDJSON, or CSV file.
+
+        See `ztpcli.records.read_device_data` for the file formats, and
+        `upload_device_data_stream` for the upload.
+
+        Args:
+            path: The file path.
+            format: The file format (`json`, `ndjson`, or `csv`); by default
+                the format is selected by the file suffix.
+            batch_size: The number of records sent in each request.
+            offset: The number of records to skip at the start of the file
+                (to resume a failed upload).
+            progress: Called after each batch with the offset reached and
+                the running summary of the outcomes.
+            workers: The number of batches sent in parallel.
+        """
+        check_type(path, Path)
+        return self.upload_device_data_stream(
+            read_device_data(path, format=format),
+            batch_size=batch_size,
+            offset=offset,
+            progress=progress,
+            workers=workers,
+        )
+
+
+def _normalize_record(record: dict) -> dict:
+    """Normalize a device-data record the way `upload_device_data` does."""
+    if not isinstance(record, dict):
+        return record
+    record = dict(record)
+    if isinstance(record.get("serial_number"), str):
+        record["serial_number"] = record["serial_number"].strip().upper()
+    if isinstance(record.get("template_name"), str):
+        record["template_name"] = record["template_name"].strip()
+    return record
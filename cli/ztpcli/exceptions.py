@@ -17,3 +17,39 @@ or implied.
 """
 
 
+class RapidZtpError(Exception):
+    """Base class for Rapid ZTP client errors."""
+
+
+class ApiError(RapidZtpError):
+    """The Rapid ZTP server returned an error response."""
+
+    def __init__(self, status: int, message: str, url: str = None):
+        """Initialize a new API error.
+
+        Args:
+            status: The HTTP status code of the response.
+            message: The error message (the response's `error` value or
+                text).
+            url: The requested URL.
+        """
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+        self.url = url
+
+
+class UploadError(RapidZtpError):
+    """A streaming upload failed part-way through."""
+
+    def __init__(self, message: str, offset: int):
+        """Initialize a new upload error.
+
+        Args:
+            message: The error message.
+            offset: The number of records (from the start of the input)
+                that were uploaded; pass it as the `offset` of a new upload
+                to resume after the last complete batch.
+        """
+        super().__init__(message)
+        self.offset = offset
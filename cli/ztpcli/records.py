@@ -0,0 +1,222 @@
+"""Streaming device-data record readers.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import csv
+import json
+from pathlib import Path
+from typing import Any, Iterator, Optional, TextIO
+
+from ztpcli.utils import check_type
+
+
+# File formats, and the file suffixes that select them
+JSON = "json"
+NDJSON = "ndjson"
+CSV = "csv"
+
+FORMATS = {
+    ".json": JSON,
+    ".ndjson": NDJSON,
+    ".jsonl": NDJSON,
+    ".csv": CSV,
+}
+
+# Characters read from a JSON file at a time
+_CHUNK_SIZE = 64 * 1024
+
+# CSV columns that hold the record's own fields; the other columns are
+# config data
+_RECORD_COLUMNS = ("serial_number", "template_name")
+_CONFIG_DATA_PREFIX = "config_data."
+
+
+class _JsonArrayReader(object):
+    """Incrementally decode the items of a JSON array from a file."""
+
+    def __init__(self, file: TextIO, chunk_size: int = _CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def _read(self) -> bool:
+        """Append the next chunk of the file to the buffer."""
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def _peek(self) -> str:
+        """Skip whitespace and get the next character ("" at the end)."""
+        while True:
+            while self.position < len(self.buffer) \
+                    and self.buffer[self.position].isspace():
+                self.position += 1
+            if self.position < len(self.buffer) or not self._read():
+                return self.buffer[self.position:self.position + 1]
+
+    def _expect(self, characters: str) -> str:
+        """Consume the next character, which must be one of `characters`."""
+        character = self._peek()
+        if not character or character not in characters:
+            found = repr(character) if character else "the end of the file"
+            raise ValueError(
+                f"Invalid JSON array: expected one of {characters!r} but "
+                f"found {found}."
+            )
+        self.position += 1
+        return character
+
+    def _decode(self) -> Any:
+        """Decode the next value, reading more of the file as needed."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(
+                    self.buffer, self.position,
+                )
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+            # A value that ends the buffer may continue in the next chunk
+            if end == len(self.buffer) and self._read():
+                continue
+            self.position = end
+            return value
+
+    def __iter__(self) -> Iterator[Any]:
+        self._expect("[")
+        if self._peek() == "]":
+            return
+        while True:
+            yield self._decode()
+            if self._expect(",]") == "]":
+                return
+
+
+def read_json_array(file: TextIO) -> Iterator[Any]:
+    """Read the items of a JSON array, without loading the whole file."""
+    return iter(_JsonArrayReader(file))
+
+
+def read_ndjson(file: TextIO) -> Iterator[Any]:
+    """Read newline-delimited JSON values (blank lines are skipped)."""
+    for line_number, line in enumerate(file, start=1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ValueError(
+                    f"Invalid JSON on line {line_number}: {error}"
+                ) from error
+
+
+def _set_path(data: dict, path: str, value: Any):
+    """Set a value in nested dictionaries, by dotted key path."""
+    *parents, key = path.split(".")
+    for parent in parents:
+        data = data.setdefault(parent, {})
+        if not isinstance(data, dict):
+            raise ValueError(
+                f"The CSV column `{path}` conflicts with the column "
+                f"`{parent}`."
+            )
+    if isinstance(data.get(key), dict):
+        raise ValueError(
+            f"The CSV column `{path}` conflicts with the nested columns "
+            f"under it."
+        )
+    data[key] = value
+
+
+def read_csv(file: TextIO) -> Iterator[dict]:
+    """Read device-data records from CSV rows.
+
+    The `serial_number` and `template_name` columns hold the record fields;
+    every other column is a config data value.  Dotted column names map to
+    nested config data keys (`interface.vlan` sets
+    `config_data["interface"]["vlan"]`), and an optional `config_data.`
+    column prefix is ignored.  Values are strings; empty cells are left out
+    of the config data.
+    """
+    for row in csv.DictReader(file):
+        record = {column: row.get(column) for column in _RECORD_COLUMNS}
+        config_data = {}
+        for column, value in row.items():
+            if column is None or column in _RECORD_COLUMNS \
+                    or value is None or value == "":
+                continue
+            if column.startswith(_CONFIG_DATA_PREFIX):
+                column = column[len(_CONFIG_DATA_PREFIX):]
+            _set_path(config_data, column, value)
+        record["config_data"] = config_data
+        yield record
+
+
+READERS = {
+    JSON: read_json_array,
+    NDJSON: read_ndjson,
+    CSV: read_csv,
+}
+
+
+def file_format(path: Path) -> str:
+    """Get the record format of a file, from its suffix.
+
+    Raises:
+        ValueError: If the suffix is not a known record format.
+    """
+    try:
+        return FORMATS[path.suffix.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Cannot tell the format of `{path.name}` from its suffix; "
+            f"expected one of: {', '.join(FORMATS)}."
+        )
+
+
+def read_device_data(path: Path, format: Optional[str] = None) \
+        -> Iterator[dict]:
+    """Stream the device-data records from a JSON-array, NDJSON, or CSV file.
+
+    The records are read as they are consumed; the file is never loaded
+    whole.
+
+    Args:
+        path: The file path.
+        format: The file format (`json`, `ndjson`, or `csv`); by default the
+            format is selected by the file suffix.
+    """
+    check_type(path, Path)
+    format = format or file_format(path)
+    if format not in READERS:
+        raise ValueError(
+            f"Unknown record format `{format}`; expected one of: "
+            f"{', '.join(READERS)}."
+        )
+    reader = READERS[format]
+    with open(path, encoding="utf-8", newline="") as file:
+        yield from reader(file)
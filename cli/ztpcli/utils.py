@@ -16,6 +16,9 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+from itertools import islice
+from typing import Iterable, Iterator, List
+
 
 def check_type(o, acceptable_types, may_be_none=False):
     """Object is an instance of one of the acceptable types or None.
@@ -52,3 +55,13 @@ def check_type(o, acceptable_types, may_be_none=False):
             )
         )
         raise TypeError(error_message)
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists of (at most) `size` items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
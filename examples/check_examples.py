@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Check that the example device data is valid for the example template.
+
+Validates the example device data records against the `config_data` paths
+the example template needs (as the device data API does on upload), and
+renders each device's configuration with undefined variables treated as
+errors.  Run it from the app's environment:
+
+    $ cd app && pipenv run python ../examples/check_examples.py
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import asyncio
+import json
+import os
+from pathlib import Path
+import sys
+
+
+here = Path(__file__).parent
+
+# Check against an in-memory store; no database is needed
+os.environ["STORAGE_BACKEND"] = "memory"
+sys.path.insert(0, str(here.parent/"app"))
+
+import jinja2  # noqa: E402
+
+from ztp.storage import make_device_data, storage  # noqa: E402
+from ztp.validation import summarize_errors, validate_device_data  # noqa
+
+
+def main() -> int:
+    """Check the examples; returns the number of devices that failed."""
+    device_data_file = here/"switch-device-data.json"
+    with open(device_data_file) as file:
+        device_data = json.load(file)
+
+    templates = {}
+    for template_file in here.glob("*-template.txt"):
+        with open(template_file) as file:
+            text = templates[template_file.stem] = file.read()
+        storage.save_template(template_file.stem, text)
+
+    records = [make_device_data(**device) for device in device_data]
+    invalid = asyncio.get_event_loop().run_until_complete(
+        validate_device_data(records)
+    )
+
+    environment = jinja2.Environment(
+        loader=jinja2.DictLoader(templates),
+        undefined=jinja2.StrictUndefined,
+    )
+    failed = 0
+    for index, record in enumerate(records):
+        errors = list(invalid.get(index, []))
+        try:
+            environment.get_template(record.template_name).render(
+                config_data=record.config_data,
+            )
+        except jinja2.TemplateError as error:
+            errors.append(f"{type(error).__name__}: {error}")
+
+        if errors:
+            failed += 1
+            print(f"FAIL {record.serial_number}: {summarize_errors(errors)}")
+        else:
+            print(f"ok   {record.serial_number}")
+
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)